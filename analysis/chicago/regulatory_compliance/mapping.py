@@ -4,15 +4,8 @@ MATCH p=(l:LicenseRecord)-[:ORG_HAS_LICENSE]-(n:Organization)-[r:IS_SIMILAR_TO]-
 WHERE m.source = "CONTRACTS" AND n.source = "LICENSES" AND
 c.startDate IS NOT NULL AND
 l.endDate IS NOT NULL
-// Change date format
-WITH n, m,
-apoc.date.parse(c.startDate, "ms", "MM/dd/yyyy") AS startDate,
-apoc.date.parse(l.endDate, "ms", "MM/dd/yyyy") as endDate
-// Process date string as dates
-WITH n, m,
-date(datetime({epochmillis: startDate})) AS startDate,
-date(datetime({epochmillis: endDate})) AS endDate
-WITH n, m, min(startDate) as ContractDate, max(endDate) as LicenseDate
+// Dates are stored as native dates by the importers
+WITH n, m, min(c.startDate) as ContractDate, max(l.endDate) as LicenseDate
 WHERE ContractDate > LicenseDate
 WITH n
 MATCH (n)-[:BELONGS_TO_ORG_GROUP]->(og:OrganizationGroup)
@@ -72,6 +65,14 @@ data_property_mappings = {
         "name": {
             "uri": "http://purl.org/dc/terms/title",
             "type": "str"
+        },
+        "startDate": {
+            "uri": "http://purl.org/procurement/public-contracts#startDate",
+            "type": "date"
+        },
+        "endDate": {
+            "uri": "http://purl.org/procurement/public-contracts#actualEndDate",
+            "type": "date"
         }
     },
     "OrganizationGroup": {
@@ -91,32 +92,6 @@ computed_data_property_mappings = {
             WHERE elementId(c) = $node_id
             RETURN sum(r.amount) as value
         """
-    },
-    "LicenseRecord.startDate": {
-        "uri": "http://purl.org/procurement/public-contracts#startDate",
-        "type": "date",
-        "query": """
-            MATCH (l:LicenseRecord)
-            WHERE elementId(l) = $node_id
-            RETURN toString(apoc.date.format(
-                apoc.date.parse(l.startDate, "ms", "MM/dd/yyyy"),
-                "ms",
-                "yyyy-MM-dd"
-            )) AS value
-        """
-    },
-    "LicenseRecord.endDate": {
-        "uri": "http://purl.org/procurement/public-contracts#actualEndDate",
-        "type": "date",
-        "query": """
-            MATCH (l:LicenseRecord)
-            WHERE elementId(l) = $node_id
-            RETURN toString(apoc.date.format(
-                apoc.date.parse(l.endDate, "ms", "MM/dd/yyyy"),
-                "ms",
-                "yyyy-MM-dd"
-            )) AS value
-        """
     }
 }
 
@@ -0,0 +1,88 @@
+import argparse
+import logging
+import time
+
+from importer.memory_graph import MemoryGraph
+from resolution.blocking import name_words
+from resolution.engine import NameResolver
+from resolution.similarity import sorensen_dice_similarity
+from util.logger import setup_logging
+
+
+def build_names(count, seed=0):
+    # People drawn from a pool of first and last names, spelled with an occasional typo
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    syllables = ["ka", "lo", "mi", "ra", "ten", "son", "ber", "gan", "li", "ow",
+                 "ski", "man", "der", "vel", "ro", "an", "th", "el", "is", "dor"]
+
+    def word(parts):
+        return "".join(rng.choice(syllables, parts)).capitalize()
+
+    def typo(text):
+        if len(text) < 4 or rng.random() > 0.3:
+            return text
+        i = rng.integers(1, len(text) - 1)
+        return text[:i] + text[i + 1:] if rng.random() < 0.5 else text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+    firsts = [word(2) for _ in range(max(count // 30, 10))]
+    lasts = [word(3) for _ in range(max(count // 3, 10))]
+    people = [(rng.choice(firsts), rng.choice(["", "A ", "B "]), rng.choice(lasts)) for _ in range(count // 2)]
+    return [f"{typo(first)} {middle}{typo(last)}" for first, middle, last in
+            (people[i] for i in rng.integers(0, len(people), count))]
+
+
+def graph_names(graph_file):
+    graph = MemoryGraph.load(graph_file)
+    return [n.get("fullName") for n in graph.nodes("PersonRecord") if n.get("fullName") not in (None, " ", "?")]
+
+
+def fulltext_pairs(names, threshold=0.695):
+    # The queries of ChicagoPeopleSimilarity.create_people_similarity, on the in-memory fulltext index
+    graph = MemoryGraph()
+    for i, name in enumerate(names):
+        graph.set(graph.merge_node("PersonRecord", i), fullName=name)
+    index = graph.fulltext("person_record_fullName", "PersonRecord", "fullName")
+    pairs, candidates = set(), 0
+    for i, name in enumerate(names):
+        words = name_words(name)
+        if not words:
+            continue
+        for node in index.query(" AND ".join(f"{word}~0.65" for word in words)):
+            j = node.get("id")
+            if j != i:
+                candidates += 1
+                if sorensen_dice_similarity(name, names[j]) > threshold:
+                    pairs.add((min(i, j), max(i, j)))
+    return pairs, candidates
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Compare fulltext and blocked resolution of person names.")
+    parser.add_argument("--names", type=int, default=20000, help="Number of synthetic names")
+    parser.add_argument("--graph-file", default=None,
+                        help="Use the PersonRecord names of a graph saved by the memory backend instead")
+    parser.add_argument("--processes", type=int, default=None, help="Processes of the resolution engine")
+    args = parser.parse_args()
+
+    names = graph_names(args.graph_file) if args.graph_file else build_names(args.names)
+
+    start = time.perf_counter()
+    reference, candidates = fulltext_pairs(names)
+    fulltext = time.perf_counter() - start
+    logging.info(f"fulltext: {len(reference)} matches from {candidates:,} candidates in {fulltext:.2f}s")
+
+    resolution = NameResolver(processes=args.processes).resolve(names)
+    found = resolution.pairs()
+    recall = resolution.recall(reference)
+    logging.info(f"engine: {len(found)} matches in {resolution.elapsed:.2f}s, "
+                 f"recall {recall if recall is None else f'{recall:.3f}'} against fulltext, "
+                 f"{len(found - reference)} matches not found by fulltext")
+    logging.info(f"Speed-up: {fulltext / resolution.elapsed:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
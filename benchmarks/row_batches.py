@@ -0,0 +1,62 @@
+import argparse
+import logging
+import time
+from itertools import islice
+
+from util.frame_utils import iter_record_batches
+from util.logger import setup_logging
+
+
+def build_frame(rows, seed=0):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'RECORD_ID': np.arange(rows),
+        'Purchase Order Description': rng.choice(['SUPPLIES', 'SERVICES', 'CONSTRUCTION', None], rows),
+        'Vendor ID': rng.integers(0, 50000, rows).astype(str),
+        'Vendor Name': rng.choice(['ACME INC', 'STAGE LEFT, INC.', 'CITY SUPPLY LLC'], rows),
+        'Award Amount': np.where(rng.random(rows) < 0.1, np.nan, rng.random(rows) * 1e6),
+        'Start Date': rng.choice(['01/02/2020', '12/31/2021', None], rows),
+        'Zip': np.where(rng.random(rows) < 0.2, np.nan, rng.integers(60601, 60699, rows)),
+    })
+    frame['DATA_SOURCE'] = "CONTRACTS"
+    frame['RECORD_TYPE'] = "CONTRACT"
+    return frame
+
+
+def iterrows_batches(frame, batch_size):
+    # The get_rows path used by the factories before the bulk producer
+    import numpy as np
+
+    frame = frame.replace({np.nan: None})
+    rows = (row.to_dict() for _, row in frame.iterrows())
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def run(name, batches):
+    start = time.perf_counter()
+    total = sum(len(batch) for batch in batches)
+    elapsed = time.perf_counter() - start
+    logging.info(f"{name}: {total} rows in {elapsed:.2f}s ({total / elapsed:,.0f} rows/s)")
+    return elapsed
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Compare iterrows and bulk record batching on a synthetic frame.")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of synthetic rows")
+    parser.add_argument("--batch_size", type=int, default=1000, help="Rows per batch")
+    args = parser.parse_args()
+
+    frame = build_frame(args.rows)
+    legacy = run("iterrows", iterrows_batches(frame, args.batch_size))
+    bulk = run("bulk", iter_record_batches(frame, args.batch_size))
+    logging.info(f"Speed-up: {legacy / bulk:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@ import configparser
 import os
 
 class Neo4jGraphDB:
-    def __init__(self, uri=None, user=None, password=None, database=None):
+    def __init__(self, uri=None, user=None, password=None, database=None, driver=None):
         self.uri = uri
         self.user = user
         self.password = password
@@ -16,8 +16,8 @@ class Neo4jGraphDB:
         password = self.password or params.get('password', 'password')
         self._database = self.database or params.get('database', 'neo4j')
 
-        # Create connection
-        self._driver = GraphDatabase.driver(uri, auth=(user, password))
+        # Create connection, unless an existing driver is shared with this instance
+        self._driver = driver or GraphDatabase.driver(uri, auth=(user, password))
         self._session = None
     
     def _load_config(self, config_path):
@@ -2,26 +2,22 @@ def chi_contracts_importer_factory(base_importer_cls, backend: str):
     import logging
 
     class ChicagoContractsImporter(base_importer_cls):
+        cache_version = 2
+        result_options = ("keep_raw_dates",)
+        date_columns = ['Start Date', 'End Date', 'Approval Date']
+
         def __init__(self):
             super().__init__()
             self.backend = backend
 
-        @staticmethod
-        def get_csv_size(contracts_file, encoding="utf-8"):
-            return sum(1 for _ in ChicagoContractsImporter.get_rows(contracts_file))
-
-        @staticmethod
-        def get_rows(contracts_file):
-            import pandas as pd
-            import numpy as np
-            contracts = pd.read_csv(contracts_file, low_memory=False)
+        def normalize(self, contracts, offset=0):
+            from util.frame_utils import parse_dates
+            parse_dates(contracts, self.date_columns, keep_raw=self.keep_raw_dates)
             contracts['DATA_SOURCE'] = "CONTRACTS"
             contracts['RECORD_TYPE'] = "CONTRACT"
             if 'RECORD_ID' not in contracts:
-                contracts.insert(0, 'RECORD_ID', range(0, len(contracts)))
-            contracts.replace({np.nan: None}, inplace=True)
-            for _, row in contracts.iterrows():
-                yield row.to_dict()
+                contracts.insert(0, 'RECORD_ID', range(offset, offset + len(contracts)))
+            return contracts
 
         def set_constraints(self):
             queries = [
@@ -39,7 +35,7 @@ def chi_contracts_importer_factory(base_importer_cls, backend: str):
                 with self._driver.session(database=self.database) as session:
                     session.run(query)
 
-        def import_contract_records(self, contracts_file):
+        def import_contract_records(self, contracts):
             query = """
             UNWIND $batch as item
             MERGE (n:ContractRecord {id: item.RECORD_ID})
@@ -48,89 +44,297 @@ def chi_contracts_importer_factory(base_importer_cls, backend: str):
                 n.startDate = item.`Start Date`,
                 n.endDate = item.`End Date`,
                 n.approvalDate = item.`Approval Date`,
+                n.startDateRaw = item.`Start Date RAW`,
+                n.endDateRaw = item.`End Date RAW`,
+                n.approvalDateRaw = item.`Approval Date RAW`,
                 n.pdfFile = item.`Contract PDF`,
                 n.vendorId = item.`Vendor ID`,
                 n.contractId = item.`Purchase Order (Contract) Number`,
                 n.specificationId = item.`Specification Number`,
                 n.source = item.DATA_SOURCE
             """
-            size = self.get_csv_size(contracts_file)
-            self.batch_store(query, self.get_rows(contracts_file), size=size)
+            self.batch_store_source(query, contracts, partition_key="RECORD_ID")
+
+        @staticmethod
+        def get_vendors(contracts):
+            from util.frame_utils import aggregate_sets
+
+            def frames():
+                for frame in contracts.frames():
+                    # Same string as toString() on the raw value
+                    yield frame.assign(Zip=frame['Zip'].map(str, na_action='ignore'))
 
-        def merge_vendors_and_orders(self, contracts_file):
+            vendors = aggregate_sets(frames(), 'Vendor ID', {
+                'names': 'Vendor Name',
+                'addresses': ['Address 1', 'Address 2'],
+                'addressPostalCodes': 'Zip',
+                'addressStates': 'State',
+                'addressCities': 'City',
+            })
+            vendors['DATA_SOURCE'] = "CONTRACTS"
+            return vendors
+
+        def import_vendors(self, contracts):
+            # One write per vendor with the values of all its rows, instead of one per contract row
             query = """
             UNWIND $batch AS item
+            MERGE (o:Organization {id: item.`Vendor ID`})
+            SET o.names = apoc.coll.toSet(coalesce(o.names, []) + item.names),
+                o.source = item.DATA_SOURCE,
+                o.addresses = apoc.coll.toSet(coalesce(o.addresses, []) + item.addresses),
+                o.addressPostalCodes = apoc.coll.toSet(coalesce(o.addressPostalCodes, []) + item.addressPostalCodes),
+                o.addressStates = apoc.coll.toSet(coalesce(o.addressStates, []) + item.addressStates),
+                o.addressCities = apoc.coll.toSet(coalesce(o.addressCities, []) + item.addressCities)
+            WITH o
+            SET o.name = trim(apoc.text.capitalize(reduce(shortest = head(o.names), name IN o.names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)))
+            """
+            self.batch_store_frame(query, self.get_vendors(contracts), partition_key="Vendor ID")
+
+        @staticmethod
+        def get_dimensions(contracts):
+            from util.frame_utils import distinct_rows
+
+            # One pass over the file for all dimensions, keeping only the distinct values of each chunk
+            columns = ["Department", "Contract Type", "Procurement Type"]
+            parts = {column: [] for column in columns}
+            for frame in contracts.frames():
+                for column in columns:
+                    parts[column].append(distinct_rows([frame], column, default="Unknown"))
+            return {column: distinct_rows(parts[column], column) for column in columns}
+
+        def import_dimensions(self, contracts):
+            # A few hundred distinct values, created once so that fact rows only MATCH them
+            queries = {
+                "Department": """
+                UNWIND $batch AS item
+                MERGE (m:Department {id: item.Department})
+                SET m.source = "CONTRACTS"
+                """,
+                "Contract Type": """
+                UNWIND $batch AS item
+                MERGE (o:ContractType {id: item.`Contract Type`})
+                """,
+                "Procurement Type": """
+                UNWIND $batch AS item
+                MERGE (t:ProcurementType {id: item.`Procurement Type`})
+                """,
+            }
+            for column, values in self.get_dimensions(contracts).items():
+                logging.info(f"{len(values)} distinct values of {column}")
+                self.batch_store_frame(queries[column], values)
+
+        def merge_vendors_and_orders(self, contracts):
+            from util.frame_utils import count_missing
+
+            # Vendors are only matched, so that the contract number is the one key merged here;
+            # rows without a vendor still get their contract
+            query = """
+            UNWIND $batch AS item
+            MATCH (t:ProcurementType {id: coalesce(item.`Procurement Type`, "Unknown")})
             MERGE (n:ContractRecord {contractId: item.`Purchase Order (Contract) Number`})
             MERGE (m:Contract {id: item.`Purchase Order (Contract) Number`})
             SET m.names = apoc.coll.toSet(coalesce(m.names, []) + coalesce(item.`Purchase Order Description`, []))
 
-            WITH item, n, m,
-                CASE WHEN n.startDate IS NOT NULL AND n.startDate <> '' 
-                    THEN date(datetime({epochMillis: apoc.date.parse(n.startDate, 'ms', 'MM/dd/yyyy')}))
-                    ELSE NULL END AS safeStartDate,
-                CASE WHEN n.endDate IS NOT NULL AND n.endDate <> '' 
-                    THEN date(datetime({epochMillis: apoc.date.parse(n.endDate, 'ms', 'MM/dd/yyyy')}))
-                    ELSE NULL END AS safeEndDate
+            // Dates are parsed on load; the contract spans its earliest start and latest end
+            SET m.startDate = CASE WHEN m.startDate IS NULL OR item.`Start Date` < m.startDate
+                                   THEN item.`Start Date` ELSE m.startDate END,
+                m.endDate = CASE WHEN m.endDate IS NULL OR item.`End Date` > m.endDate
+                                 THEN item.`End Date` ELSE m.endDate END
 
-            WITH item, n, m,
-                [d IN [safeStartDate] WHERE d IS NOT NULL] AS startDates,
-                [d IN [safeEndDate] WHERE d IS NOT NULL] AS endDates
+            MERGE (n)-[:INCLUDED_IN_CONTRACT]->(m)
+            MERGE (n)-[:HAS_PROCUREMENT_TYPE]->(t)
 
-            SET m.startDate = toString(coalesce(apoc.coll.min(startDates), m.startDate)),
-                m.endDate = toString(coalesce(apoc.coll.max(endDates), m.endDate))
+            WITH n, item
+            MATCH (o:Organization {id: item.`Vendor ID`})
+            MERGE (n)-[:HAS_VENDOR]->(o)
+            """
+            missing = count_missing(contracts.frames(), 'Vendor ID')
+            if missing:
+                logging.warning(f"{missing} contract rows have no Vendor ID, their records are linked to no vendor")
+            self.batch_store_source(query, contracts, partition_key="Purchase Order (Contract) Number")
 
-            MERGE (o:Organization {id: item.`Vendor ID`})
-            SET o.names = apoc.coll.toSet(coalesce(o.names, []) + coalesce(item.`Vendor Name`, [])),
-                o.source = item.DATA_SOURCE,
-                o.addresses = apoc.coll.toSet(coalesce(o.addresses, []) + coalesce(item.`Address 1`, []) + coalesce(item.`Address 2`, [])),
-                o.addressPostalCodes = apoc.coll.toSet(coalesce(o.addressPostalCodes, []) + coalesce(toString(item.Zip), [])),
-                o.addressStates = apoc.coll.toSet(coalesce(o.addressStates, []) + coalesce(item.State, [])),
-                o.addressCities = apoc.coll.toSet(coalesce(o.addressCities, []) + coalesce(item.City, []))
-            
-            WITH item, n, m, o
-            SET o.name = trim(apoc.text.capitalize(reduce(shortest = head(o.names), name IN o.names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)))
-            
+        def merge_vendor_addresses(self, contracts):
+            # Its own stage, partitioned by the address it merges rather than by contract
+            query = """
+            UNWIND $batch AS item
             MERGE (a:Address {id: coalesce(item.`Address 1`, "Unknown")})
             SET a.addressPostalCode = toString(item.Zip),
                 a.addressState = item.State,
                 a.addressCity = item.City
-            
-            MERGE (t:ProcurementType {id: coalesce(item.`Procurement Type`, "Unknown")})
-            MERGE (n)-[:INCLUDED_IN_CONTRACT]->(m)
-            MERGE (n)-[:HAS_VENDOR]->(o)
-            MERGE (n)-[:HAS_PROCUREMENT_TYPE]->(t)
+            WITH a, item
+            MATCH (o:Organization {id: item.`Vendor ID`})
             MERGE (o)-[r:HAS_ADDRESS]->(a)
             SET r.source = item.DATA_SOURCE
             """
-            size = self.get_csv_size(contracts_file)
-            self.batch_store(query, self.get_rows(contracts_file), size=size)
+            # Same key as the MERGE, so that rows without an address share a worker with "Unknown" ones
+            self.batch_store_source(query, contracts,
+                                    partition_key=lambda row: "Unknown" if row['Address 1'] is None else row['Address 1'])
 
-        def merge_departments_contract_types(self, contracts_file):
+        def merge_departments_contract_types(self, contracts):
             query = """
             UNWIND $batch as item
+            MATCH (m:Department {id: coalesce(item.Department, "Unknown")})
+            MATCH (o:ContractType {id: coalesce(item.`Contract Type`, "Unknown")})
             MERGE (n:Contract {id: item.`Purchase Order (Contract) Number`})
             SET n.name = apoc.text.join(n.names, " + ")
-            MERGE (m:Department {id: coalesce(item.Department, "Unknown")})
-            SET m.source = "CONTRACTS"
-            MERGE (o:ContractType {id: coalesce(item.`Contract Type`, "Unknown")})
             MERGE (m)-[:ASSIGNS_CONTRACT]->(n)
             MERGE (n)-[:HAS_CONTRACT_TYPE]->(o)
             """
-            size = self.get_csv_size(contracts_file)
-            self.batch_store(query, self.get_rows(contracts_file), size=size)
+            self.batch_store_source(query, contracts, partition_key="Purchase Order (Contract) Number")
         
+        # Bulk forms of the stages above, for the neo4j-admin backend
+
+        def bulk_import_contract_records(self, contracts):
+            import pandas as pd
+
+            for frame in contracts.frames():
+                raw_dates = {f"{prop}Raw": frame[f"{column} RAW"]
+                             for prop, column in (("startDate", "Start Date"), ("endDate", "End Date"), ("approvalDate", "Approval Date"))
+                             if f"{column} RAW" in frame}
+                self.write_nodes("contracts", "ContractRecord", pd.DataFrame({
+                    "id": frame['RECORD_ID'],
+                    "name": frame['Purchase Order Description'],
+                    "amount": frame['Award Amount'],
+                    "startDate": frame['Start Date'],
+                    "endDate": frame['End Date'],
+                    "approvalDate": frame['Approval Date'],
+                    "pdfFile": frame['Contract PDF'],
+                    "vendorId": frame['Vendor ID'],
+                    "contractId": frame['Purchase Order (Contract) Number'],
+                    "specificationId": frame['Specification Number'],
+                    "source": frame['DATA_SOURCE'],
+                    **raw_dates,
+                }))
+
+        def bulk_import_dimensions(self, contracts):
+            import pandas as pd
+
+            labels = {"Department": "Department", "Contract Type": "ContractType", "Procurement Type": "ProcurementType"}
+            for column, values in self.get_dimensions(contracts).items():
+                nodes = pd.DataFrame({"id": values[column]})
+                if column == "Department":
+                    nodes["source"] = "CONTRACTS"
+                self.write_nodes("contracts", labels[column], nodes)
+
+        def bulk_import_vendors(self, contracts):
+            import pandas as pd
+            from util.frame_utils import display_names
+
+            vendors = self.get_vendors(contracts)
+            self.write_nodes("contracts", "Organization", pd.DataFrame({
+                "id": vendors['Vendor ID'],
+                "names": vendors['names'],
+                "source": vendors['DATA_SOURCE'],
+                "addresses": vendors['addresses'],
+                "addressPostalCodes": vendors['addressPostalCodes'],
+                "addressStates": vendors['addressStates'],
+                "addressCities": vendors['addressCities'],
+                "name": display_names(vendors['names']),
+            }))
+
+        def bulk_merge_vendors_and_orders(self, contracts):
+            import pandas as pd
+            from util.frame_utils import aggregate_sets
+
+            number = 'Purchase Order (Contract) Number'
+            # Contracts span their earliest start and latest end, over all their rows
+            names = aggregate_sets(contracts.frames(), number, {'names': 'Purchase Order Description'})
+            spans = []
+            for frame in contracts.frames():
+                dates = pd.DataFrame({
+                    number: frame[number],
+                    'startDate': pd.to_datetime(frame['Start Date']),
+                    'endDate': pd.to_datetime(frame['End Date']),
+                })
+                spans.append(dates.groupby(number).agg(startDate=('startDate', 'min'), endDate=('endDate', 'max')))
+            spans = pd.concat(spans).groupby(level=0).agg(startDate=('startDate', 'min'), endDate=('endDate', 'max'))
+            contract_nodes = names.join(spans, on=number)
+            self.write_nodes("contracts", "Contract", pd.DataFrame({
+                "id": contract_nodes[number],
+                "names": contract_nodes['names'],
+                "startDate": contract_nodes['startDate'].dt.date,
+                "endDate": contract_nodes['endDate'].dt.date,
+                "name": contract_nodes['names'].map(" + ".join),
+            }))
+
+            # Online, every row MERGEs the ContractRecord by contract number, so each record of a number
+            # is linked to the vendor and procurement type of every row of that number
+            records, links = [], []
+            for frame in contracts.frames():
+                frame = frame[frame[number].notna()]
+                records.append(frame[['RECORD_ID', number]])
+                links.append(pd.DataFrame({
+                    number: frame[number],
+                    "vendor": frame['Vendor ID'],
+                    "procurementType": frame['Procurement Type'].fillna("Unknown"),
+                }).drop_duplicates())
+                self.write_relationships("contracts", "INCLUDED_IN_CONTRACT", pd.DataFrame({
+                    "start": frame['RECORD_ID'], "end": frame[number],
+                }), "ContractRecord", "Contract")
+            if records:
+                records, links = pd.concat(records), pd.concat(links)
+                for column, rel_type, end_label in (("vendor", "HAS_VENDOR", "Organization"),
+                                                    ("procurementType", "HAS_PROCUREMENT_TYPE", "ProcurementType")):
+                    ends = records.merge(links[[number, column]].drop_duplicates(), on=number)
+                    self.write_relationships("contracts", rel_type, pd.DataFrame({
+                        "start": ends['RECORD_ID'], "end": ends[column],
+                    }), "ContractRecord", end_label)
+
+        def bulk_merge_vendor_addresses(self, contracts):
+            import pandas as pd
+            from util.frame_utils import distinct_rows
+
+            def addresses():
+                for frame in contracts.frames():
+                    yield pd.DataFrame({
+                        "id": frame['Address 1'].fillna("Unknown"),
+                        "addressPostalCode": frame['Zip'].map(str, na_action='ignore'),
+                        "addressState": frame['State'],
+                        "addressCity": frame['City'],
+                    })
+            self.write_nodes("contracts", "Address", distinct_rows(addresses(), "id", ["addressPostalCode", "addressState", "addressCity"]))
+
+            for frame in contracts.frames():
+                self.write_relationships("contracts", "HAS_ADDRESS", pd.DataFrame({
+                    "start": frame['Vendor ID'], "end": frame['Address 1'].fillna("Unknown"), "source": frame['DATA_SOURCE'],
+                }), "Organization", "Address")
+
+        def bulk_merge_departments_contract_types(self, contracts):
+            import pandas as pd
+
+            number = 'Purchase Order (Contract) Number'
+            for frame in contracts.frames():
+                self.write_relationships("contracts", "ASSIGNS_CONTRACT", pd.DataFrame({
+                    "start": frame['Department'].fillna("Unknown"), "end": frame[number],
+                }), "Department", "Contract")
+                self.write_relationships("contracts", "HAS_CONTRACT_TYPE", pd.DataFrame({
+                    "start": frame[number], "end": frame['Contract Type'].fillna("Unknown"),
+                }), "Contract", "ContractType")
+
         def import_data(self, contracts_file):
             logging.info("Loading constraints and indexes...")
-            self.set_constraints()
+            self.run_stage(self.set_constraints)
+
+            # Parsed once and shared by every stage, or streamed per stage with a chunk size
+            contracts = self.open_source(contracts_file, self.normalize)
     
             logging.info("Loading contract records...")
-            self.import_contract_records(contracts_file)
+            self.run_stage(self.import_contract_records, contracts)
             
+            logging.info("Importing departments, contract and procurement types...")
+            self.run_stage(self.import_dimensions, contracts)
+
+            logging.info("Importing vendors...")
+            self.run_stage(self.import_vendors, contracts)
+
             logging.info("Merging vendors and orders...")
-            self.merge_vendors_and_orders(contracts_file)
+            self.run_stage(self.merge_vendors_and_orders, contracts)
+
+            logging.info("Merging vendor addresses...")
+            self.run_stage(self.merge_vendor_addresses, contracts)
 
             logging.info("Merging departments and contract types...")
-            self.merge_departments_contract_types(contracts_file)
+            self.run_stage(self.merge_departments_contract_types, contracts)
 
     return ChicagoContractsImporter
 
@@ -12,7 +12,7 @@ def chi_delete_node_factory(base_importer_cls, backend: str):
                 logging.info(f"Deleting {str(label)}")
                 query = f"""
                 CALL apoc.periodic.iterate(
-                    'MATCH (n:{label}) RETURN n',
+                    'MATCH (n:`{label}`) RETURN n',
                     'DETACH DELETE n',
                     {{batchSize: 1000, parallel: false}}
                 ) YIELD batches, total
@@ -33,8 +33,9 @@ def chi_delete_node_factory(base_importer_cls, backend: str):
                                         "ContractRecord",
                                         "ContractType",
                                         "Department",
-                                        "Procurement type",
-                                        "Address"])
+                                        "ProcurementType",
+                                        "Address",
+                                        "PipelineStep"])
 
     return ChicagoNodeDeleter
 
@@ -5,6 +5,7 @@ def manual_match_factory(base_importer_cls, backend: str):
         def __init__(self):
             super().__init__()
             self.backend = backend
+            self.auto_match_threshold = 0.7
 
         def expand_department_pairs(self):
             raw_pairs = [
@@ -53,6 +54,22 @@ def manual_match_factory(base_importer_cls, backend: str):
                     }
 
 
+        def get_department_ids(self):
+            query = "MATCH (d:Department) RETURN d.id as id"
+            with self._driver.session() as session:
+                return [record["id"] for record in session.run(query)]
+
+        def expand_auto_pairs(self, ids):
+            # Matches of the department names in both directions, leaving out the pairs of the manual list
+            from resolution.departments import DepartmentMatcher
+
+            manual = {frozenset((pair["source"], pair["target"])) for pair in self.expand_department_pairs()}
+            for i, j, score in DepartmentMatcher(self.auto_match_threshold).match(ids):
+                if frozenset((ids[i], ids[j])) in manual:
+                    continue
+                yield {"source": ids[i], "target": ids[j], "score": score}
+                yield {"source": ids[j], "target": ids[i], "score": score}
+
         def create_manual_similarity_relationships(self):
             query = """
             UNWIND $batch as item
@@ -63,9 +80,23 @@ def manual_match_factory(base_importer_cls, backend: str):
             """
             self.batch_store(query, self.expand_department_pairs())
 
+        def create_auto_similarity_relationships(self):
+            query = """
+            UNWIND $batch as item
+            MATCH (a:Department) WHERE a.id = item.source
+            MATCH (b:Department) WHERE b.id = item.target AND a <> b
+            MERGE (a)-[r:IS_SIMILAR_TO {method: "AUTO_MATCH"}]->(b)
+            ON CREATE SET r.score = item.score
+            """
+            rows = list(self.expand_auto_pairs(self.get_department_ids()))
+            self.batch_store(query, rows, size=len(rows))
+
         def apply_updates(self):
             logging.info("Creating manual similarity relationships from hardcoded pairs...")
-            self.create_manual_similarity_relationships()
+            self.run_stage(self.create_manual_similarity_relationships)
+
+            logging.info("Creating similarity relationships of matching department names...")
+            self.run_stage(self.create_auto_similarity_relationships)
 
     return ManualDepartmentMatcher
 
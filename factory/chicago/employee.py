@@ -2,23 +2,19 @@ def chi_employees_importer_factory(base_importer_cls, backend: str):
     import logging
 
     class ChicagoEmployeesImporter(base_importer_cls):
+        cache_version = 1
+
         def __init__(self):
             super().__init__()
             self.backend = backend
 
         @staticmethod
-        def get_csv_size(employees_file, encoding="utf-8"):
-            return sum(1 for _ in ChicagoEmployeesImporter.get_rows(employees_file))
-
-        @staticmethod
-        def get_rows(employees_file):
-            import numpy as np
+        def normalize(employees, offset=0):
             import pandas as pd
-            employees = pd.read_csv(employees_file, low_memory=False)
             employees['DATA_SOURCE'] = "EMPLOYEES"
             employees['RECORD_TYPE'] = "PERSON"
             if 'RECORD_ID' not in employees:
-                employees.insert(0, 'RECORD_ID', range(4000000, 4000000 + len(employees)))
+                employees.insert(0, 'RECORD_ID', range(4000000 + offset, 4000000 + offset + len(employees)))
 
             def split_name(name):
                 parts = name.split(',')
@@ -29,9 +25,7 @@ def chi_employees_importer_factory(base_importer_cls, backend: str):
                 return pd.Series([first, middle, last])
 
             employees[['Owner First Name', 'Owner Middle Initial', 'Owner Last Name']] = employees['Name'].apply(split_name)
-            employees.replace({np.nan: None}, inplace=True)
-            for _, row in employees.iterrows():
-                yield row.to_dict()
+            return employees
 
         def set_constraints(self):
             queries = [
@@ -46,7 +40,22 @@ def chi_employees_importer_factory(base_importer_cls, backend: str):
                 with self._driver.session(database=self.database) as session:
                     session.run(query)
 
-        def import_people_records(self, employees_file):
+        def import_departments(self, employees):
+            from util.frame_utils import distinct_rows
+
+            # A few hundred departments, created once so that the person rows of any worker only MATCH them
+            query = """
+            UNWIND $batch AS item
+            MERGE (d:Department {id: item.Department})
+            SET d.source = item.DATA_SOURCE
+            """
+            departments = distinct_rows(employees.frames(), 'Department', ['DATA_SOURCE'])
+            logging.info(f"{len(departments)} distinct values of Department")
+            self.batch_store_frame(query, departments)
+
+        def import_people_records(self, employees):
+            from util.frame_utils import count_missing
+
             import_people_records_query = """
             UNWIND $batch as item
             MERGE (n:PersonRecord {id: item.RECORD_ID})
@@ -68,9 +77,8 @@ def chi_employees_importer_factory(base_importer_cls, backend: str):
             SET n.source = item.DATA_SOURCE
             SET n.title = item.`Job Titles`
 
-            MERGE (d:Department {id: item.Department})
-            SET d.source = item.DATA_SOURCE
-
+            WITH n, item
+            MATCH (d:Department {id: item.Department})
             MERGE (n)-[r:WORKS_FOR_DEPARTMENT]->(d)
             SET r.employmentType = item.`Full or Part-Time`
             SET r.salaryType = item.`Salary or Hourly`
@@ -79,15 +87,54 @@ def chi_employees_importer_factory(base_importer_cls, backend: str):
             SET r.hourlyRate = item.`Hourly Rate`
             """
 
-            size = self.get_csv_size(employees_file)
-            self.batch_store(import_people_records_query, self.get_rows(employees_file), size=size)
+            missing = count_missing(employees.frames(), 'Department')
+            if missing:
+                logging.warning(f"{missing} employee rows have no Department, their records work for no department")
+            self.batch_store_source(import_people_records_query, employees, partition_key="RECORD_ID")
+
+        def bulk_import_departments(self, employees):
+            from util.frame_utils import distinct_rows
+
+            departments = distinct_rows(employees.frames(), 'Department', ['DATA_SOURCE'])
+            self.write_nodes("employees", "Department", departments.rename(columns={
+                'Department': "id", 'DATA_SOURCE': "source",
+            }))
+
+        def bulk_import_people_records(self, employees):
+            import pandas as pd
+            from util.frame_utils import full_names
+
+            for frame in employees.frames():
+                self.write_nodes("employees", "PersonRecord", pd.DataFrame({
+                    "id": frame['RECORD_ID'],
+                    "firstName": frame['Owner First Name'],
+                    "lastName": frame['Owner Last Name'],
+                    "middleName": frame['Owner Middle Initial'],
+                    "fullName": full_names(frame['Owner First Name'], frame['Owner Middle Initial'], frame['Owner Last Name']),
+                    "source": frame['DATA_SOURCE'],
+                    "title": frame['Job Titles'],
+                }))
+                self.write_relationships("employees", "WORKS_FOR_DEPARTMENT", pd.DataFrame({
+                    "start": frame['RECORD_ID'],
+                    "end": frame['Department'],
+                    "employmentType": frame['Full or Part-Time'],
+                    "salaryType": frame['Salary or Hourly'],
+                    "typicalHours": frame['Typical Hours'],
+                    "annualSalary": frame['Annual Salary'],
+                    "hourlyRate": frame['Hourly Rate'],
+                }), "PersonRecord", "Department")
 
         def import_data(self, employees_file):
             logging.info("Loading constraints and indexes for person records and entities...")
-            self.set_constraints()
+            self.run_stage(self.set_constraints)
+
+            employees = self.open_source(employees_file, self.normalize)
+
+            logging.info("Importing departments...")
+            self.run_stage(self.import_departments, employees)
 
             logging.info("Loading person record nodes...")
-            self.import_people_records(employees_file)
+            self.run_stage(self.import_people_records, employees)
 
     return ChicagoEmployeesImporter
 
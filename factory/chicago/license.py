@@ -2,26 +2,22 @@ def chi_licenses_importer_factory(base_importer_cls, backend: str):
     import logging
 
     class ChicagoLicensesImporter(base_importer_cls):
+        cache_version = 2
+        result_options = ("keep_raw_dates",)
+        date_columns = ['LICENSE TERM START DATE', 'LICENSE TERM EXPIRATION DATE']
+
         def __init__(self):
             super().__init__()
             self.backend = backend
 
-        @staticmethod
-        def get_csv_size(licenses_file, encoding="utf-8"):
-            return sum(1 for _ in ChicagoLicensesImporter.get_rows(licenses_file))
-
-        @staticmethod
-        def get_rows(licenses_file):
-            import pandas as pd
-            import numpy as np
-            licenses = pd.read_csv(licenses_file, low_memory=False)
+        def normalize(self, licenses, offset=0):
+            from util.frame_utils import parse_dates
+            parse_dates(licenses, self.date_columns, keep_raw=self.keep_raw_dates)
             licenses['DATA_SOURCE'] = "LICENSES"
             licenses['RECORD_TYPE'] = "LICENSE"
             if 'RECORD_ID' not in licenses:
-                licenses.insert(0, 'RECORD_ID', range(1000000, 1000000 + len(licenses)))
-            licenses.replace({np.nan: None}, inplace=True)
-            for _, row in licenses.iterrows():
-                yield row.to_dict()
+                licenses.insert(0, 'RECORD_ID', range(1000000 + offset, 1000000 + offset + len(licenses)))
+            return licenses
 
         def set_constraints(self):
             queries = [
@@ -37,7 +33,7 @@ def chi_licenses_importer_factory(base_importer_cls, backend: str):
                 with self._driver.session(database=self.database) as session:
                     session.run(query)
 
-        def import_license_records(self, licenses_file):
+        def import_license_records(self, licenses):
             query = """
             UNWIND $batch as item
             MERGE (n:LicenseRecord {id: item.RECORD_ID})
@@ -54,6 +50,8 @@ def chi_licenses_importer_factory(base_importer_cls, backend: str):
                 n.date = item.`Approval Date`,
                 n.startDate = item.`LICENSE TERM START DATE`,
                 n.endDate = item.`LICENSE TERM EXPIRATION DATE`,
+                n.startDateRaw = item.`LICENSE TERM START DATE RAW`,
+                n.endDateRaw = item.`LICENSE TERM EXPIRATION DATE RAW`,
                 n.status = item.`LICENSE STATUS`,
                 n.code = item.`LICENSE CODE`,
                 n.number = item.`LICENSE NUMBER`,
@@ -61,63 +59,97 @@ def chi_licenses_importer_factory(base_importer_cls, backend: str):
                 n.latitude = item.LATITUDE,
                 n.longitude = item.LONGITUDE
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            self.batch_store_source(query, licenses, partition_key="RECORD_ID")
+
+        def import_license_type(self, licenses):
+            # A few hundred distinct codes, created once so that license rows only MATCH them
+            from util.frame_utils import distinct_rows
 
-        def import_license_type(self, licenses_file):
             query = """
             UNWIND $batch as item
             MERGE (n:LicenseType {id: item.`LICENSE CODE`})
             SET n.description = item.`LICENSE DESCRIPTION`
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            types = distinct_rows(licenses.frames(), 'LICENSE CODE', ['LICENSE DESCRIPTION'])
+            logging.info(f"{len(types)} distinct license types")
+            self.batch_store_frame(query, types)
 
-        def connect_license_to_type(self, licenses_file):
+        def connect_license_to_type(self, licenses):
             query = """
             UNWIND $batch as item
-            MERGE (n:LicenseType {id: item.`LICENSE CODE`})
+            MATCH (n:LicenseType {id: item.`LICENSE CODE`})
             MERGE (m:LicenseRecord {id: item.RECORD_ID})
             MERGE (m)-[:HAS_LICENSE_TYPE]->(n)
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            self.batch_store_source(query, licenses, partition_key="LICENSE CODE")
+
+        @staticmethod
+        def get_organizations(licenses):
+            from util.frame_utils import aggregate_sets
 
-        def import_organization(self, licenses_file):
+            def frames():
+                for frame in licenses.frames():
+                    yield frame.assign(**{
+                        'NAME': frame['LEGAL NAME'].fillna(frame['DOING BUSINESS AS NAME']),
+                        # Same string as toString() on the raw value
+                        'ZIP CODE': frame['ZIP CODE'].map(str, na_action='ignore'),
+                    })
+
+            organizations = aggregate_sets(frames(), 'ACCOUNT NUMBER', {
+                'names': 'NAME',
+                'otherNames': 'DOING BUSINESS AS NAME',
+                'addresses': 'ADDRESS',
+                'addressPostalCodes': 'ZIP CODE',
+                'addressStates': 'STATE',
+                'addressCities': 'CITY',
+            })
+            organizations['DATA_SOURCE'] = "LICENSES"
+            return organizations
+
+        def import_organization(self, licenses):
+            # One write per account with the values of all its rows, instead of one per license row
             query = """
             UNWIND $batch as item
             MERGE (o:Organization {id: item.`ACCOUNT NUMBER`})
-            SET o.names = apoc.coll.toSet(coalesce(o.names, []) + coalesce(item.`LEGAL NAME`, item.`DOING BUSINESS AS NAME`, [])),
-                o.otherNames = apoc.coll.toSet(coalesce(o.otherNames, []) + coalesce(item.`DOING BUSINESS AS NAME`, [])),
+            SET o.names = apoc.coll.toSet(coalesce(o.names, []) + item.names),
+                o.otherNames = apoc.coll.toSet(coalesce(o.otherNames, []) + item.otherNames),
                 o.source = item.DATA_SOURCE,
-                o.addresses = apoc.coll.toSet(coalesce(o.addresses, []) + coalesce(item.ADDRESS, [])),
-                o.addressPostalCodes = apoc.coll.toSet(coalesce(o.addressPostalCodes, []) + coalesce(toString(item.`ZIP CODE`), [])),
-                o.addressStates = apoc.coll.toSet(coalesce(o.addressStates, []) + coalesce(item.STATE, [])),
-                o.addressCities = apoc.coll.toSet(coalesce(o.addressCities, []) + coalesce(item.CITY, []))
+                o.addresses = apoc.coll.toSet(coalesce(o.addresses, []) + item.addresses),
+                o.addressPostalCodes = apoc.coll.toSet(coalesce(o.addressPostalCodes, []) + item.addressPostalCodes),
+                o.addressStates = apoc.coll.toSet(coalesce(o.addressStates, []) + item.addressStates),
+                o.addressCities = apoc.coll.toSet(coalesce(o.addressCities, []) + item.addressCities)
+            WITH o
+            SET o.name = trim(apoc.text.capitalize(reduce(shortest = head(o.names), name IN o.names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)))
+            """
+            self.batch_store_frame(query, self.get_organizations(licenses), partition_key="ACCOUNT NUMBER")
+
+        def connect_org_to_address(self, licenses):
+            # Organizations are only matched, so that the address is the one key merged here
+            query = """
+            UNWIND $batch as item
             MERGE (a:Address {id: item.ADDRESS})
             SET a.addressPostalCode = toString(item.`ZIP CODE`),
                 a.addressState = item.STATE,
                 a.addressCity = item.CITY,
                 a.latitude = item.LATITUDE,
                 a.longitude = item.LONGITUDE
+            WITH a, item
+            MATCH (o:Organization {id: item.`ACCOUNT NUMBER`})
             MERGE (o)-[r:HAS_ADDRESS]->(a)
             SET r.source = item.DATA_SOURCE
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            self.batch_store_source(query, licenses, partition_key="ADDRESS")
 
-        def connect_org_to_license(self, licenses_file):
+        def connect_org_to_license(self, licenses):
             query = """
             UNWIND $batch as item
             MERGE (n:Organization {id: item.`ACCOUNT NUMBER`})
-            SET n.name = trim(apoc.text.capitalize(reduce(shortest = head(n.names), name IN n.names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)))
             MERGE (m:LicenseRecord {id: item.RECORD_ID})
             MERGE (n)-[:ORG_HAS_LICENSE]->(m)
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            self.batch_store_source(query, licenses, partition_key="ACCOUNT NUMBER")
 
-        def connect_people_to_org(self, licenses_file):
+        def connect_people_to_org(self, licenses):
             query = """
             UNWIND $batch as item
             MERGE (n:Organization {id: item.`ACCOUNT NUMBER`})
@@ -126,30 +158,130 @@ def chi_licenses_importer_factory(base_importer_cls, backend: str):
             MERGE (p)-[r:WORKS_FOR_ORG]->(n)
             SET r.roles = p.titles
             """
-            size = self.get_csv_size(licenses_file)
-            self.batch_store(query, self.get_rows(licenses_file), size=size)
+            self.batch_store_source(query, licenses, partition_key="ACCOUNT NUMBER")
         
+        # Bulk forms of the stages above, for the neo4j-admin backend
+
+        def bulk_import_license_records(self, licenses):
+            import pandas as pd
+
+            for frame in licenses.frames():
+                raw_dates = {f"{prop}Raw": frame[f"{column} RAW"]
+                             for prop, column in (("startDate", "LICENSE TERM START DATE"), ("endDate", "LICENSE TERM EXPIRATION DATE"))
+                             if f"{column} RAW" in frame}
+                self.write_nodes("licenses", "LicenseRecord", pd.DataFrame({
+                    "id": frame['RECORD_ID'],
+                    "license_id": frame['LICENSE ID'],
+                    "name": frame['LEGAL NAME'].fillna(frame['DOING BUSINESS AS NAME']),
+                    "businessName": frame['DOING BUSINESS AS NAME'].fillna('-'),
+                    "businessId": frame['ACCOUNT NUMBER'],
+                    "address": frame['ADDRESS'],
+                    "addressPostalCode": frame['ZIP CODE'],
+                    "addressState": frame['STATE'],
+                    "addressCity": frame['CITY'],
+                    "source": frame['DATA_SOURCE'],
+                    "amount": frame.get('Award Amount'),
+                    "date": frame.get('Approval Date'),
+                    "startDate": frame['LICENSE TERM START DATE'],
+                    "endDate": frame['LICENSE TERM EXPIRATION DATE'],
+                    "status": frame['LICENSE STATUS'],
+                    "code": frame['LICENSE CODE'],
+                    "number": frame['LICENSE NUMBER'],
+                    "siteNumber": frame['SITE NUMBER'],
+                    "latitude": frame['LATITUDE'],
+                    "longitude": frame['LONGITUDE'],
+                    **raw_dates,
+                }))
+
+        def bulk_import_license_type(self, licenses):
+            from util.frame_utils import distinct_rows
+
+            types = distinct_rows(licenses.frames(), 'LICENSE CODE', ['LICENSE DESCRIPTION'])
+            self.write_nodes("licenses", "LicenseType", types.rename(columns={
+                'LICENSE CODE': "id", 'LICENSE DESCRIPTION': "description",
+            }))
+
+        def bulk_connect_license_to_type(self, licenses):
+            import pandas as pd
+
+            for frame in licenses.frames():
+                self.write_relationships("licenses", "HAS_LICENSE_TYPE", pd.DataFrame({
+                    "start": frame['RECORD_ID'], "end": frame['LICENSE CODE'],
+                }), "LicenseRecord", "LicenseType")
+
+        def bulk_import_organization(self, licenses):
+            import pandas as pd
+            from util.frame_utils import display_names
+
+            organizations = self.get_organizations(licenses)
+            self.write_nodes("licenses", "Organization", pd.DataFrame({
+                "id": organizations['ACCOUNT NUMBER'],
+                "names": organizations['names'],
+                "otherNames": organizations['otherNames'],
+                "source": organizations['DATA_SOURCE'],
+                "addresses": organizations['addresses'],
+                "addressPostalCodes": organizations['addressPostalCodes'],
+                "addressStates": organizations['addressStates'],
+                "addressCities": organizations['addressCities'],
+                "name": display_names(organizations['names']),
+            }))
+
+        def bulk_connect_org_to_address(self, licenses):
+            import pandas as pd
+            from util.frame_utils import distinct_rows
+
+            def addresses():
+                for frame in licenses.frames():
+                    yield pd.DataFrame({
+                        "id": frame['ADDRESS'],
+                        "addressPostalCode": frame['ZIP CODE'].map(str, na_action='ignore'),
+                        "addressState": frame['STATE'],
+                        "addressCity": frame['CITY'],
+                        "latitude": frame['LATITUDE'],
+                        "longitude": frame['LONGITUDE'],
+                    })
+            columns = ["addressPostalCode", "addressState", "addressCity", "latitude", "longitude"]
+            self.write_nodes("licenses", "Address", distinct_rows(addresses(), "id", columns))
+
+            for frame in licenses.frames():
+                self.write_relationships("licenses", "HAS_ADDRESS", pd.DataFrame({
+                    "start": frame['ACCOUNT NUMBER'], "end": frame['ADDRESS'], "source": frame['DATA_SOURCE'],
+                }), "Organization", "Address")
+
+        def bulk_connect_org_to_license(self, licenses):
+            import pandas as pd
+
+            for frame in licenses.frames():
+                self.write_relationships("licenses", "ORG_HAS_LICENSE", pd.DataFrame({
+                    "start": frame['ACCOUNT NUMBER'], "end": frame['RECORD_ID'],
+                }), "Organization", "LicenseRecord")
+
         def import_data(self, license_file):
             logging.info("Loading constraints...")
-            self.set_constraints()
+            self.run_stage(self.set_constraints)
+
+            licenses = self.open_source(license_file, self.normalize)
 
             logging.info("Loading license records...")
-            self.import_license_records(license_file)
+            self.run_stage(self.import_license_records, licenses)
     
             logging.info("Merging license types...")
-            self.import_license_type(license_file)
+            self.run_stage(self.import_license_type, licenses)
     
             logging.info("Connecting licenses to types...")
-            self.connect_license_to_type(license_file)
+            self.run_stage(self.connect_license_to_type, licenses)
     
             logging.info("Importing organizations...")
-            self.import_organization(license_file)
+            self.run_stage(self.import_organization, licenses)
+
+            logging.info("Connecting organizations to addresses...")
+            self.run_stage(self.connect_org_to_address, licenses)
     
             logging.info("Connecting organizations to licenses...")
-            self.connect_org_to_license(license_file)
+            self.run_stage(self.connect_org_to_license, licenses)
 
             logging.info("Connecting people to organizations...")
-            self.connect_people_to_org(license_file)
+            self.run_stage(self.connect_people_to_org, licenses)
 
     return ChicagoLicensesImporter
 
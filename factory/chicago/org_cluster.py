@@ -1,7 +1,15 @@
+from contextlib import nullcontext
+
+
 def chi_orgs_similarity_factory(base_importer_cls, backend: str):
     import logging
+    import os
+
+    from importer.clustering import ClusteringMixin
     
-    class ChicagoOrgsSimilarity(base_importer_cls):
+    class ChicagoOrgsSimilarity(ClusteringMixin, base_importer_cls):
+        result_options = ("similarity", "candidates_file", "incremental", "wcc")
+
         def __init__(self):
             super().__init__()
             self.backend = backend
@@ -30,19 +38,55 @@ def chi_orgs_similarity_factory(base_importer_cls, backend: str):
             with self._driver.session(database=self.database) as session:
                 return session.run(query, {"nodes": nodes}).single()["rows"]
 
-        def get_cluster_rows(self):
-            query = "MATCH (n:OrganizationGroup) RETURN DISTINCT n.clusterId as id"
+        def get_org_rows(self, nodes=None):
+            # Every named organization with its addresses, and whether it still has to be resolved
+            query = """
+            MATCH (n:Organization)
+            WHERE NOT (n.name IS NULL OR n.name = " " OR n.name = "?")
+            OPTIONAL MATCH (n)-[:HAS_ADDRESS]->(a:Address)
+            RETURN n.id as id, n.name as name, collect(a.id) as addresses,
+                   NOT n:RecordProcessed AND ($nodes IS NULL OR elementId(n) in $nodes) as new
+            """
+            with self._driver.session(database=self.database) as session:
+                result = session.run(query, {"nodes": nodes})
+                for record in iter(result):
+                    yield dict(record)
+
+        def get_unclustered_rows(self):
+            # Organizations not in a group yet, with the organizations they are similar to and their group
+            query = """
+            MATCH (n:Organization)
+            WHERE NOT (n)-[:BELONGS_TO_ORG_GROUP]->(:OrganizationGroup)
+            OPTIONAL MATCH (n)-[:IS_SIMILAR_TO]-(m:Organization)
+            OPTIONAL MATCH (m)-[:BELONGS_TO_ORG_GROUP]->(c:OrganizationGroup)
+            RETURN n.id as id, collect([m.id, c.clusterId]) as neighbors
+            """
             with self._driver.session(database=self.database) as session:
                 result = session.run(query)
                 for record in iter(result):
                     yield dict(record)
 
-        def count_cluster_rows(self):
-            query = "MATCH (n:OrganizationGroup) RETURN COUNT(DISTINCT n.clusterId) as rows"
+        def next_cluster_id(self):
+            query = "MATCH (c:OrganizationGroup) RETURN coalesce(max(c.clusterId), -1) + 1 as id"
             with self._driver.session(database=self.database) as session:
-                return session.run(query).single()["rows"]
+                return session.run(query).single()["id"]
+
+        def get_member_rows(self):
+            # Clustered organizations with what their group collects, and whether they are already connected to it
+            query = """
+            MATCH (p:Organization)
+            WHERE p.componentId IS NOT NULL
+            RETURN p.componentId as cluster, p.id as id, toString(p.id) as key, p.name as name, p.source as source,
+                   EXISTS { (p)-[:BELONGS_TO_ORG_GROUP]->(:OrganizationGroup {clusterId: p.componentId}) } as linked
+            """
+            with self._driver.session(database=self.database) as session:
+                result = session.run(query)
+                for record in iter(result):
+                    yield dict(record)
 
         def create_org_similarity_by_address(self, nodes=None):
+            if self.similarity == "local":
+                return self.resolve_org_similarity(nodes)
             query = """
             UNWIND $batch as item
             MATCH (o:Organization {id: item.id})
@@ -70,7 +114,87 @@ def chi_orgs_similarity_factory(base_importer_cls, backend: str):
             ON CREATE SET r.score = simil
             """
             size = self.count_record_rows()
-            self.batch_store(query, self.get_record_rows(nodes), size=size)
+            # Processed records are already left out by get_record_rows, so batch offsets don't apply
+            self.batch_store(query, self.get_record_rows(nodes), size=size, partition_key="id", resumable=False)
+
+        def org_name_index(self):
+            from resolution.lsh import OrgNameIndex
+
+            if self.similarity_index and os.path.exists(self.similarity_index):
+                return OrgNameIndex.load(self.similarity_index)
+            return OrgNameIndex()
+
+        def resolve_org_similarity(self, nodes=None):
+            # Same edges as create_org_similarity_by_address, from the MinHash index of names blocked by address
+            rows = list(self.get_org_rows(nodes))
+            index = self.org_name_index()
+            # Scores are only cached to be kept in a file, like resolve_people_similarity
+            with self.similarity_scores() if self.similarity_cache else nullcontext() as cache:
+                resolution = index.resolve([row["id"] for row in rows], [row["name"] for row in rows],
+                                           [row["addresses"] for row in rows], [row["new"] for row in rows], cache)
+            edges = [{"source": rows[source]["id"], "target": rows[target]["id"], "score": score}
+                     for source, target, score in resolution.edges(mutual=False)]
+            edges_query = """
+            UNWIND $batch as item
+            MATCH (node:Organization {id: item.source})
+            MATCH (o:Organization {id: item.target})
+            WHERE NOT EXISTS ((node)-[:IS_SIMILAR_TO]-(o))
+            MERGE (node)-[r:IS_SIMILAR_TO {method: "SIMILAR_NAME+SAME_ADDRESS"}]->(o)
+            ON CREATE SET r.score = item.score
+            """
+            self.batch_store(edges_query, edges, size=len(edges), partition_key="target", resumable=False)
+
+            processed_query = """
+            UNWIND $batch as item
+            MATCH (o:Organization {id: item.id})
+            SET o:RecordProcessed
+            """
+            processed = [{"id": row["id"]} for row in rows if row["new"]]
+            self.batch_store(processed_query, processed, size=len(processed), partition_key="id")
+            if self.similarity_index:
+                index.save(self.similarity_index)
+
+        def record_candidates(self):
+            # Every candidate pair of create_org_similarity_by_address with its score, whatever the threshold
+            rows = list(self.get_org_rows())
+            if self.similarity == "local":
+                return self.save_candidates(len(rows), self.indexed_candidates(rows))
+            query = """
+            UNWIND $ids as record_id
+            MATCH (o:Organization {id: record_id})
+            WITH o,
+                trim(apoc.text.replace(o.name, '(?i)\\b(?:co|ltd|inc|corp|llc|llp|pvt|gmbh|s.a.|s.l.|and|not)\\b', '')) as clean_name
+            WITH o, clean_name,
+                apoc.text.split(apoc.text.replace(clean_name, '[^a-zA-Z0-9\\s]', ''), "\\s+") as name_words
+            WITH o, clean_name,
+                [x IN name_words WHERE size(trim(x)) > 2 AND trim(x) IS NOT NULL AND NOT toLower(x) IN ['and', 'not']] as valid_name_words
+            WHERE size(valid_name_words) > 0
+            CALL db.index.fulltext.queryNodes(
+                "organization_name",
+                apoc.text.join([x IN valid_name_words | trim(x) + "~0.3"], " AND ")
+            )
+            YIELD node, score
+            WHERE node <> o AND EXISTS { (o)-[:HAS_ADDRESS]->(:Address)<-[:HAS_ADDRESS]-(node) }
+            WITH o, clean_name,
+                trim(apoc.text.replace(node.name, '(?i)\\b(?:co|ltd|inc|corp|llc|llp|pvt|gmbh|s.a.|s.l.|and|not)\\b', '')) as clean_node_name
+            RETURN o.id as source, node.id as target, apoc.text.sorensenDiceSimilarity(clean_name, clean_node_name) as score
+            """
+            pairs = []
+            with self._driver.session(database=self.database) as session:
+                for offset in range(0, len(rows), self.batch_size):
+                    ids = [row["id"] for row in rows[offset:offset + self.batch_size]]
+                    pairs.extend((record["source"], record["target"], record["score"])
+                                 for record in session.run(query, {"ids": ids}))
+            self.save_candidates(len(rows), pairs)
+
+        def indexed_candidates(self, rows):
+            # Every pair colliding in a fresh index, rather than those above the threshold
+            from resolution.lsh import OrgNameIndex
+
+            resolution = OrgNameIndex(threshold=0.0).resolve(
+                [row["id"] for row in rows], [row["name"] for row in rows], [row["addresses"] for row in rows])
+            return [(rows[source]["id"], rows[target]["id"], score)
+                    for source, target, score in resolution.edges(mutual=False)]
 
         def project_graph(self, node_label='Organization'):
             query = """
@@ -86,6 +210,8 @@ def chi_orgs_similarity_factory(base_importer_cls, backend: str):
                 session.run(query, {"node_label": node_label})
 
         def run_wcc(self):
+            if self.wcc == "local":
+                return self.local_wcc("Organization", "IS_SIMILAR_TO")
             query = """
             CALL gds.wcc.write('organizationResolved', { writeProperty: 'componentId' })
             YIELD nodePropertiesWritten, componentCount;
@@ -98,61 +224,103 @@ def chi_orgs_similarity_factory(base_importer_cls, backend: str):
             with self._driver.session(database=self.database) as session:
                 session.run(query)
 
-        def create_record_clusters(self):
-            query = """
-            CALL apoc.periodic.iterate(
-                \"MATCH (n:Organization) RETURN DISTINCT n.componentId as id\",
-                \"MERGE (n:OrganizationGroup {clusterId: id})\",
-                {batchSize:10000})
-            YIELD batches, total RETURN batches, total
+        def materialize_clusters(self):
+            # Members are read once and aggregated here, so every OrganizationGroup is written with a single SET
+            from resolution.clusters import aggregate_clusters
+
+            members = list(self.get_member_rows())
+            clusters = aggregate_clusters(members, {"ids": "key", "names": "name", "sources": "source"}, "names",
+                                          distinct=True)
+            clusters_query = """
+            UNWIND $batch as item
+            MERGE (c:OrganizationGroup {clusterId: item.id})
+            SET c.ids = item.ids, c.names = item.names, c.sources = item.sources, c.name = item.name, c.size = item.size
             """
-            with self._driver.session(database=self.database) as session:
-                session.run(query)
+            self.batch_store(clusters_query, clusters, size=len(clusters), partition_key="id", resumable=False)
 
-        def create_connections_to_clusters(self):
-            query = """
+            edges = [{"id": member["id"], "cluster": member["cluster"]} for member in members if not member["linked"]]
+            edges_query = """
+            UNWIND $batch as item
+            MATCH (p:Organization {id: item.id})
+            MATCH (c:OrganizationGroup {clusterId: item.cluster})
+            CREATE (p)-[:BELONGS_TO_ORG_GROUP]->(c)
+            """
+            self.batch_store(edges_query, edges, size=len(edges), partition_key="cluster", resumable=False)
+
+        def update_clusters(self):
+            # Incremental form of the WCC and cluster stages, writing only the groups that new organizations touch
+            from resolution.clusters import plan_cluster_updates
+
+            neighbors = {row["id"]: [tuple(pair) for pair in row["neighbors"]] for row in self.get_unclustered_rows()}
+            rows = plan_cluster_updates(neighbors, self.next_cluster_id())
+            merged = [row for row in rows if row["merged"]]
+            logging.info(f"{len(neighbors)} new organizations in {len(rows)} groups, "
+                         f"{sum(len(row['merged']) for row in merged)} groups merged")
+
+            merge_query = """
             UNWIND $batch as item
-            MATCH (p:Organization {componentId: item.id})
             MATCH (c:OrganizationGroup {clusterId: item.id})
+            MATCH (old:OrganizationGroup) WHERE old.clusterId IN item.merged
+            WITH c, collect(old) as merged
+            CALL apoc.refactor.mergeNodes([c] + merged, {properties: "discard", mergeRels: true})
+            YIELD node
+            MATCH (p:Organization)-[:BELONGS_TO_ORG_GROUP]->(node)
+            SET p.componentId = node.clusterId
+            """
+            self.batch_store(merge_query, merged, size=len(merged), partition_key="id", resumable=False)
+
+            connect_query = """
+            UNWIND $batch as item
+            MERGE (c:OrganizationGroup {clusterId: item.id})
+            WITH c, item
+            UNWIND item.records as record_id
+            MATCH (p:Organization {id: record_id})
+            SET p.componentId = c.clusterId
             MERGE (p)-[:BELONGS_TO_ORG_GROUP]->(c)
-            SET c.ids = apoc.coll.toSet(coalesce(c.ids, []) + coalesce(toString(p.id), [])),
-                c.names = apoc.coll.toSet(coalesce(c.names, []) + coalesce(p.name, [])),
-                c.sources = apoc.coll.toSet(coalesce(c.sources, []) + coalesce(p.source, []))
             """
-            size = self.count_cluster_rows()
-            self.batch_store(query, self.get_cluster_rows(), size=size)
+            self.batch_store(connect_query, rows, size=len(rows), partition_key="id", resumable=False)
 
-        def create_final_names_of_clusters(self):
-            query = """
+            rewrite_query = """
             UNWIND $batch as item
-            MATCH (c:OrganizationGroup {clusterId: item.id})
-            WITH c, reduce(shortest = head(c.names), name IN c.names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END) AS shortestName
-            SET c.name = shortestName
+            MATCH (p:Organization)-[:BELONGS_TO_ORG_GROUP]->(c:OrganizationGroup {clusterId: item.id})
+            WITH c, p ORDER BY p.id
+            WITH c, apoc.coll.toSet(collect(toString(p.id))) as ids, apoc.coll.toSet(collect(p.name)) as names,
+                 apoc.coll.toSet(collect(p.source)) as sources, count(p) as size
+            SET c.ids = ids, c.names = names, c.sources = sources, c.size = size,
+                c.name = reduce(shortest = head(names), name IN names | CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)
             """
-            size = self.count_cluster_rows()
-            self.batch_store(query, self.get_cluster_rows(), size=size)
-        
+            clusters = [{"id": row["id"]} for row in rows]
+            self.batch_store(rewrite_query, clusters, size=len(clusters), partition_key="id", resumable=False)
+
         def apply_updates(self):
+                if self.candidates_file:
+                    logging.info("Recording the candidate pairs of the similarity stage...")
+                    self.run_stage(self.record_candidates)
+                    return
+
                 logging.info("Creating similarity IS_SIMILAR_TO relationships...")
-                self.create_org_similarity_by_address()
-                
-                logging.info("Creating graph projection...")
-                self.project_graph()
-                
-                logging.info("Running WCC algorithm...")
-                self.run_wcc()
-                
-                logging.info("Deleting projection...")
-                self.delete_projection()
-                
-                logging.info("Creating organization clusters...")
-                self.create_record_clusters()
+                self.run_stage(self.create_org_similarity_by_address)
+
+                if self.incremental:
+                    logging.info("Updating the groups of new organizations...")
+                    self.run_stage(self.update_clusters)
+                    return
                 
-                logging.info("Creating connections to clusters...")
-                self.create_connections_to_clusters()
+                if self.wcc == "local":
+                    logging.info("Running WCC in this process...")
+                    self.run_stage(self.run_wcc)
+                else:
+                    logging.info("Creating graph projection...")
+                    self.run_stage(self.project_graph)
+
+                    logging.info("Running WCC algorithm...")
+                    self.run_stage(self.run_wcc)
+
+                    logging.info("Deleting projection...")
+                    self.run_stage(self.delete_projection)
                 
-                logging.info("Creating cluster names...")
-                self.create_final_names_of_clusters()
+                logging.info("Creating organization clusters and their connections...")
+                self.run_stage(self.materialize_clusters)
 
     return ChicagoOrgsSimilarity
 
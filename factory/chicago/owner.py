@@ -2,26 +2,19 @@ def chi_people_importer_factory(base_importer_cls, backend: str):
     import logging
 
     class ChicagoPeopleImporter(base_importer_cls):
+        cache_version = 1
+
         def __init__(self):
             super().__init__()
             self.backend = backend
 
         @staticmethod
-        def get_csv_size(owners_file, encoding="utf-8"):
-            return sum(1 for _ in ChicagoPeopleImporter.get_rows(owners_file))
-
-        @staticmethod
-        def get_rows(owners_file):
-            import numpy as np
-            import pandas as pd
-            owners = pd.read_csv(owners_file, low_memory=False)
+        def normalize(owners, offset=0):
             owners['DATA_SOURCE'] = "OWNERS"
             owners['RECORD_TYPE'] = "PERSON"
             if 'RECORD_ID' not in owners:
-                owners.insert(0, 'RECORD_ID', range(3000000, 3000000 + len(owners)))
-            owners.replace({np.nan: None}, inplace=True)
-            for _, row in owners.iterrows():
-                yield row.to_dict()
+                owners.insert(0, 'RECORD_ID', range(3000000 + offset, 3000000 + offset + len(owners)))
+            return owners
 
         def set_constraints(self):
             queries = [
@@ -35,7 +28,7 @@ def chi_people_importer_factory(base_importer_cls, backend: str):
                 with self._driver.session(database=self.database) as session:
                     session.run(query)
 
-        def import_people_records(self, owners_file):
+        def import_people_records(self, owners):
             import_people_records_query = """
             UNWIND $batch as item
             MERGE (n:PersonRecord {id: item.RECORD_ID})
@@ -58,15 +51,32 @@ def chi_people_importer_factory(base_importer_cls, backend: str):
             SET n.employerId = item.`Account Number`
             SET n.title = item.Title
             """
-            size = self.get_csv_size(owners_file)
-            self.batch_store(import_people_records_query, self.get_rows(owners_file), size=size)
-        
+            self.batch_store_source(import_people_records_query, owners, partition_key="RECORD_ID")
+
+        def bulk_import_people_records(self, owners):
+            import pandas as pd
+            from util.frame_utils import full_names
+
+            for frame in owners.frames():
+                self.write_nodes("owners", "PersonRecord", pd.DataFrame({
+                    "id": frame['RECORD_ID'],
+                    "firstName": frame['Owner First Name'],
+                    "lastName": frame['Owner Last Name'],
+                    "middleName": frame['Owner Middle Initial'],
+                    "fullName": full_names(frame['Owner First Name'], frame['Owner Middle Initial'], frame['Owner Last Name']),
+                    "source": frame['DATA_SOURCE'],
+                    "employerId": frame['Account Number'],
+                    "title": frame['Title'],
+                }))
+
         def import_data(self, owners_file):
             logging.info("Loading constraints and indexes for person records and entities...")
-            self.set_constraints()
+            self.run_stage(self.set_constraints)
+
+            owners = self.open_source(owners_file, self.normalize)
 
             logging.info("Loading person record nodes...")
-            self.import_people_records(owners_file)
+            self.run_stage(self.import_people_records, owners)
 
     return ChicagoPeopleImporter
 
@@ -1,7 +1,14 @@
+from contextlib import nullcontext
+
+
 def chi_people_similarity_factory(base_importer_cls, backend: str):
     import logging
 
-    class ChicagoPeopleSimilarity(base_importer_cls):
+    from importer.clustering import ClusteringMixin
+
+    class ChicagoPeopleSimilarity(ClusteringMixin, base_importer_cls):
+        result_options = ("similarity", "candidates_file", "incremental", "wcc", "louvain")
+
         def __init__(self):
             super().__init__()
             self.backend = backend
@@ -31,19 +38,54 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
             with self._driver.session() as session:
                 return session.run(query, {"nodes": nodes}).single()["rows"]
 
-        def get_cluster_rows(self):
-            query = """MATCH (n:Person) RETURN DISTINCT n.clusterId as id"""
+        def get_name_rows(self, nodes=None):
+            # Every named record, as the fulltext index holds them, and whether it still has to be resolved
+            query = """
+            MATCH (n:PersonRecord)
+            WHERE NOT (n.fullName IS NULL OR n.fullName = " " OR n.fullName = "?")
+            RETURN n.id as id, n.fullName as name,
+                   NOT n:RecordProcessed AND ($nodes IS NULL OR elementId(n) in $nodes) as new
+            """
+            with self._driver.session() as session:
+                result = session.run(query, {"nodes": nodes})
+                for record in iter(result):
+                    yield dict(record)
+
+        def get_unclustered_rows(self):
+            # Records not resolved to a Person yet, with the records they are similar to and their Person
+            query = """
+            MATCH (n:PersonRecord)
+            WHERE NOT (n)-[:RECORD_RESOLVED_TO]->(:Person)
+            OPTIONAL MATCH (n)-[:IS_SIMILAR_TO]-(m:PersonRecord)
+            OPTIONAL MATCH (m)-[:RECORD_RESOLVED_TO]->(c:Person)
+            RETURN n.id as id, collect([m.id, c.clusterId]) as neighbors
+            """
             with self._driver.session() as session:
                 result = session.run(query)
                 for record in iter(result):
                     yield dict(record)
 
-        def count_cluster_rows(self):
-            query = """MATCH (n:Person) RETURN COUNT(DISTINCT n.clusterId) as rows"""
+        def next_cluster_id(self):
+            query = """MATCH (c:Person) RETURN coalesce(max(c.clusterId), -1) + 1 as id"""
+            with self._driver.session() as session:
+                return session.run(query).single()["id"]
+
+        def get_member_rows(self):
+            # Clustered records with what their Person collects, and whether they are already connected to it
+            query = """
+            MATCH (p:PersonRecord)
+            WHERE p.componentId IS NOT NULL
+            RETURN p.componentId as cluster, p.id as id, p.fullName as fullName, p.employerId as employerId,
+                   p.title as title, EXISTS { (p)-[:RECORD_RESOLVED_TO]->(:Person {clusterId: p.componentId}) } as linked
+            """
             with self._driver.session() as session:
-                return session.run(query).single()["rows"]
+                result = session.run(query)
+                for record in iter(result):
+                    yield dict(record)
 
         def create_people_similarity(self, nodes=None):
+            if self.similarity == "local":
+                return self.resolve_people_similarity(nodes)
             query = """
             UNWIND $batch as item
             MATCH (p:PersonRecord {id: item.id})
@@ -64,7 +106,72 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
             ON CREATE SET r.score = simil
             """
             size = self.count_record_rows(nodes)
-            self.batch_store(query, self.get_record_rows(nodes), size=size)
+            # Processed records are already left out by get_record_rows, so batch offsets don't apply
+            self.batch_store(query, self.get_record_rows(nodes), size=size, partition_key="id", resumable=False)
+
+        def resolve_people_similarity(self, nodes=None):
+            # Same edges as create_people_similarity, from blocked and vectorized comparisons in this process
+            from resolution.engine import NameResolver
+
+            rows = list(self.get_name_rows(nodes))
+            # Scores are only cached to be kept in a file, looking a block up costs about as much as scoring it
+            with self.similarity_scores() if self.similarity_cache else nullcontext() as cache:
+                resolution = NameResolver(processes=self.similarity_processes).resolve(
+                    [row["name"] for row in rows], [row["new"] for row in rows], cache)
+            edges = [{"source": rows[source]["id"], "target": rows[target]["id"], "score": score}
+                     for source, target, score in resolution.edges()]
+            edges_query = """
+            UNWIND $batch as item
+            MATCH (node:PersonRecord {id: item.source})
+            MATCH (p:PersonRecord {id: item.target})
+            MERGE (node)-[r:IS_SIMILAR_TO {method: "SIMILAR_NAME"}]->(p)
+            ON CREATE SET r.score = item.score
+            """
+            self.batch_store(edges_query, edges, size=len(edges), partition_key="target", resumable=False)
+
+            processed_query = """
+            UNWIND $batch as item
+            MATCH (p:PersonRecord {id: item.id})
+            SET p:RecordProcessed
+            """
+            processed = [{"id": row["id"]} for row in rows if row["new"]]
+            self.batch_store(processed_query, processed, size=len(processed), partition_key="id")
+
+        def record_candidates(self):
+            # Every candidate pair of create_people_similarity with its score, whatever the threshold
+            rows = list(self.get_name_rows())
+            if self.similarity == "local":
+                return self.save_candidates(len(rows), self.resolved_candidates(rows))
+            query = """
+            UNWIND $ids as record_id
+            MATCH (p:PersonRecord {id: record_id})
+            WITH p, apoc.text.split(apoc.text.replace(p.fullName ,'[^a-zA-Z0-9\\s]', ''), "\\s+") as name_words
+            WHERE size(name_words) > 0
+            CALL db.index.fulltext.queryNodes(
+                "person_record_fullName",
+                apoc.text.join([x IN name_words | trim(x) + "~0.65"], " AND ")
+            )
+            YIELD node, score
+            WITH p, node
+            WHERE p <> node
+            RETURN p.id as source, node.id as target, apoc.text.sorensenDiceSimilarity(p.fullName, node.fullName) as score
+            """
+            pairs = []
+            with self._driver.session() as session:
+                for offset in range(0, len(rows), self.batch_size):
+                    ids = [row["id"] for row in rows[offset:offset + self.batch_size]]
+                    pairs.extend((record["source"], record["target"], record["score"])
+                                 for record in session.run(query, {"ids": ids}))
+            self.save_candidates(len(rows), pairs)
+
+        def resolved_candidates(self, rows):
+            # Every pair the engine compares within its blocks, rather than those above the threshold
+            from resolution.engine import NameResolver
+
+            resolution = NameResolver(threshold=0.0, processes=self.similarity_processes).resolve(
+                [row["name"] for row in rows])
+            return [(rows[source]["id"], rows[target]["id"], score)
+                    for source, target, score in resolution.edges(mutual=False)]
 
         def project_wcc_graph(self):
             query = """
@@ -76,6 +183,8 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
                 session.run(query)
 
         def run_wcc(self):
+            if self.wcc == "local":
+                return self.local_wcc("PersonRecord", "IS_SIMILAR_TO")
             query = """
             CALL gds.wcc.write('personWcc', { writeProperty: 'componentId' })
             YIELD nodePropertiesWritten, componentCount;
@@ -88,40 +197,79 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
             with self._driver.session() as session:
                 session.run(query)
 
-        def create_record_clusters(self):
-            query = """
-            CALL apoc.periodic.iterate(
-                "MATCH (n:PersonRecord) RETURN DISTINCT n.componentId as id",
-                "MERGE (n:Person {clusterId: id})",
-                {batchSize:10000})
-            YIELD batches, total RETURN batches, total
+        def materialize_clusters(self):
+            # Members are read once and aggregated here, so every Person is written with a single SET
+            from resolution.clusters import aggregate_clusters
+
+            members = list(self.get_member_rows())
+            clusters = aggregate_clusters(members, {"fullNames": "fullName", "employerIds": "employerId",
+                                                    "titles": "title"}, "fullNames")
+            clusters_query = """
+            UNWIND $batch as item
+            MERGE (c:Person {clusterId: item.id})
+            SET c.fullNames = item.fullNames, c.employerIds = item.employerIds, c.titles = item.titles,
+                c.name = item.name, c.size = item.size
             """
-            with self._driver.session() as session:
-                session.run(query)
+            self.batch_store(clusters_query, clusters, size=len(clusters), partition_key="id", resumable=False)
 
-        def create_connections_to_clusters(self):
-            query = """
+            edges = [{"id": member["id"], "cluster": member["cluster"]} for member in members if not member["linked"]]
+            edges_query = """
+            UNWIND $batch as item
+            MATCH (p:PersonRecord {id: item.id})
+            MATCH (c:Person {clusterId: item.cluster})
+            CREATE (p)-[:RECORD_RESOLVED_TO]->(c)
+            """
+            self.batch_store(edges_query, edges, size=len(edges), partition_key="cluster", resumable=False)
+
+        def update_clusters(self):
+            # Incremental form of the WCC and cluster stages, writing only the clusters that new records touch
+            from resolution.clusters import plan_cluster_updates
+
+            neighbors = {row["id"]: [tuple(pair) for pair in row["neighbors"]] for row in self.get_unclustered_rows()}
+            rows = plan_cluster_updates(neighbors, self.next_cluster_id())
+            merged = [row for row in rows if row["merged"]]
+            logging.info(f"{len(neighbors)} new records in {len(rows)} clusters, "
+                         f"{sum(len(row['merged']) for row in merged)} clusters merged")
+
+            merge_query = """
             UNWIND $batch as item
-            MATCH (p:PersonRecord {componentId: item.id})
             MATCH (c:Person {clusterId: item.id})
+            MATCH (old:Person) WHERE old.clusterId IN item.merged
+            WITH c, collect(old) as merged
+            CALL apoc.refactor.mergeNodes([c] + merged, {properties: "discard", mergeRels: true})
+            YIELD node
+            MATCH (p:PersonRecord)-[:RECORD_RESOLVED_TO]->(node)
+            SET p.componentId = node.clusterId
+            """
+            self.batch_store(merge_query, merged, size=len(merged), partition_key="id", resumable=False)
+
+            connect_query = """
+            UNWIND $batch as item
+            MERGE (c:Person {clusterId: item.id})
+            WITH c, item
+            UNWIND item.records as record_id
+            MATCH (p:PersonRecord {id: record_id})
+            SET p.componentId = c.clusterId
             MERGE (p)-[:RECORD_RESOLVED_TO]->(c)
-            SET c.fullNames = coalesce(c.fullNames, []) + p.fullName,
-                c.employerIds = coalesce(c.employerIds, []) + p.employerId,
-                c.titles = coalesce(c.titles, []) + p.title
             """
-            size = self.count_cluster_rows()
-            self.batch_store(query, self.get_cluster_rows(), size=size)
+            self.batch_store(connect_query, rows, size=len(rows), partition_key="id", resumable=False)
 
-        def create_final_names_of_clusters(self):
-            query = """
+            # Lists are rebuilt from the records, as appending would repeat the values of merged clusters
+            rewrite_query = """
             UNWIND $batch as item
-            MATCH (c:Person {clusterId: item.id})
-            WITH c, reduce(shortest = head(c.fullNames), name IN c.fullNames |
-                           CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END) AS shortestName
-            SET c.name = shortestName
+            MATCH (p:PersonRecord)-[:RECORD_RESOLVED_TO]->(c:Person {clusterId: item.id})
+            WITH c, p ORDER BY p.id
+            WITH c, collect(p.fullName) as fullNames, collect(p.employerId) as employerIds, collect(p.title) as titles,
+                 count(p) as size
+            SET c.fullNames = fullNames, c.employerIds = employerIds, c.titles = titles, c.size = size,
+                c.name = reduce(shortest = head(fullNames), name IN fullNames |
+                                CASE WHEN size(name) < size(shortest) THEN name ELSE shortest END)
+            WITH c
+            OPTIONAL MATCH (c)-[r:WORKS_FOR_ORG]->(:Organization)
+            SET r.roles = c.titles
             """
-            size = self.count_cluster_rows()
-            self.batch_store(query, self.get_cluster_rows(), size=size)
+            clusters = [{"id": row["id"]} for row in rows]
+            self.batch_store(rewrite_query, clusters, size=len(clusters), partition_key="id", resumable=False)
 
         def project_louvain_graph(self):
             query = """
@@ -138,6 +286,9 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
                 session.run(query)
 
         def run_louvain(self):
+            if self.louvain == "local":
+                return self.local_louvain("PersonRecord", "IS_SIMILAR_TO", "score", "louvain",
+                                          "louvainIntermediateCommunities")
             query = """
             CALL gds.louvain.write('personLouvain', {
                 relationshipWeightProperty: 'score',
@@ -161,40 +312,54 @@ def chi_people_similarity_factory(base_importer_cls, backend: str):
             query = "CALL gds.graph.drop('personLouvain')"
             with self._driver.session() as session:
                 session.run(query)
-        
+
         def apply_updates(self):
+            if self.candidates_file:
+                logging.info("Recording the candidate pairs of the similarity stage...")
+                self.run_stage(self.record_candidates)
+                return
+
             logging.info("Creating similarity IS_SIMILAR_TO relationships...")
-            self.create_people_similarity()
-            
-            logging.info("Creating WCC graph projection...")
-            self.project_wcc_graph()
-            
-            logging.info("Running WCC algorithm...")
-            self.run_wcc()
-            
-            logging.info("Deleting WCC projection...")
-            self.delete_wcc_projection()
+            self.run_stage(self.create_people_similarity)
+
+            if self.incremental:
+                logging.info("Updating the clusters of new records...")
+                self.run_stage(self.update_clusters)
+                # Louvain communities span whole components and are left to the next full run
+                return
             
-            logging.info("Creating person clusters...")
-            self.create_record_clusters()
+            if self.wcc == "local":
+                logging.info("Running WCC in this process...")
+                self.run_stage(self.run_wcc)
+            else:
+                logging.info("Creating WCC graph projection...")
+                self.run_stage(self.project_wcc_graph)
 
-            logging.info("Creating connections to clusters...")
-            self.create_connections_to_clusters()
+                logging.info("Running WCC algorithm...")
+                self.run_stage(self.run_wcc)
+
+                logging.info("Deleting WCC projection...")
+                self.run_stage(self.delete_wcc_projection)
             
-            logging.info("Creating cluster names...")
-            self.create_final_names_of_clusters()
+            logging.info("Creating person clusters and their connections...")
+            self.run_stage(self.materialize_clusters)
             
+            if self.louvain == "local":
+                logging.info("Running Louvain in this process...")
+                self.run_stage(self.run_louvain)
+                return
+
             logging.info("Creating Louvain projection....")
-            self.project_louvain_graph()
+            self.run_stage(self.project_louvain_graph)
             
             logging.info("Running Louvain algorithm...")
-            self.run_louvain()
+            self.run_stage(self.run_louvain)
             
             logging.info("Set Louvain cluster...")
-            self.set_louvain_cluster()
+            self.run_stage(self.set_louvain_cluster)
             
             logging.info("Deleting Louvain projection...")
-            self.delete_louvain_projection()
+            self.run_stage(self.delete_louvain_projection)
 
     return ChicagoPeopleSimilarity
 
@@ -0,0 +1,332 @@
+import argparse
+import hashlib
+import json
+import logging
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timezone
+
+from factory.chicago.owner import chi_people_importer_factory
+from factory.chicago.employee import chi_employees_importer_factory
+from factory.chicago.people_cluster import chi_people_similarity_factory
+from factory.chicago.contract import chi_contracts_importer_factory
+from factory.chicago.license import chi_licenses_importer_factory
+from factory.chicago.org_cluster import chi_orgs_similarity_factory
+from factory.chicago.dept_similarity import manual_match_factory
+from util.cli_entry import BACKENDS, add_importer_arguments, importer_options
+from util.cli_utils import checkpoint_scope, configure, get_valid_path, validate_file_exists
+from util.csv_utils import file_digest
+from util.logger import setup_logging
+
+Step = namedtuple("Step", ["name", "factory", "file", "depends_on"])
+
+# Steps of the Chicago graph and the steps whose output they read or write.
+# Employee and contract both MERGE Department nodes, and contract and license
+# both MERGE Organization and Address nodes, so each pair is kept in sequence.
+STEPS = [
+    Step("owner", chi_people_importer_factory, "Business_Owners_20240103.csv", ()),
+    Step("employee", chi_employees_importer_factory, "Employees_20250422.csv", ()),
+    Step("people_cluster", chi_people_similarity_factory, None, ("owner", "employee")),
+    Step("contract", chi_contracts_importer_factory, "Contracts_20240103.csv", ("employee",)),
+    Step("license", chi_licenses_importer_factory, "Business_Licenses_20240103.csv", ("people_cluster", "contract")),
+    Step("org_cluster", chi_orgs_similarity_factory, None, ("contract", "license")),
+    Step("dept_similarity", manual_match_factory, None, ("employee", "contract")),
+]
+
+
+class StepResult:
+    def __init__(self, name):
+        self.name = name
+        self.status = "pending"
+        self.fingerprint = None
+        self.start = None
+        self.end = None
+
+    @property
+    def seconds(self):
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+class ChicagoPipeline:
+    """Run the Chicago steps in one process, sharing one driver.
+
+    A step starts as soon as the steps it depends on have finished, so independent
+    steps run concurrently. The constraints and indexes of the selected steps are
+    created one step at a time before any step starts. Steps whose input file,
+    upstream steps, importer version and result_options are unchanged since their
+    last successful run are skipped, based on a fingerprint stored in the graph as
+    a PipelineStep node.
+    """
+
+    def __init__(self, steps, base_cls, backend, base_path, options, parallel=3, force=False, only=None):
+        self.steps = {step.name: step for step in steps}
+        self.order = [step.name for step in steps]
+        self.base_cls = base_cls
+        self.backend = backend
+        self.base_path = base_path
+        self.options = options
+        self.parallel = parallel
+        self.force = force
+        self.only = set(only) if only else None
+        self.results = {name: StepResult(name) for name in self.order}
+        self.origin = None
+        self._check_dependencies()
+
+        # One driver for every step; the importers built on it must not close it
+        self.db = base_cls()
+        shared_driver = self.db._driver
+
+        class SharedDriverImporter(base_cls):
+            def __init__(self):
+                super().__init__(driver=shared_driver)
+
+            def close(self):
+                pass
+
+        self.shared_cls = SharedDriverImporter
+
+    def _check_dependencies(self):
+        seen = set()
+        for name in self.order:
+            for dependency in self.steps[name].depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step '{name}' depends on unknown step '{dependency}'")
+                if dependency not in seen:
+                    raise ValueError(f"Step '{name}' must be declared after its dependency '{dependency}'")
+            seen.add(name)
+
+    def close(self):
+        self.db.close()
+
+    # Fingerprints
+
+    def fingerprint(self, name):
+        step = self.steps[name]
+        digest = hashlib.sha256(name.encode("utf-8"))
+        # Runtime options such as --workers are not result_options, so tuning them does not re-run steps
+        importer_cls = step.factory(self.shared_cls, self.backend)
+        options = {option: self.options.get(option) for option in importer_cls.result_options}
+        digest.update(json.dumps({"version": importer_cls.cache_version, "options": options},
+                                 sort_keys=True).encode("utf-8"))
+        if step.file:
+            digest.update(file_digest(self.data_file(step)).encode("utf-8"))
+        for dependency in step.depends_on:
+            digest.update(self.results[dependency].fingerprint.encode("utf-8"))
+        return digest.hexdigest()
+
+    def stored_fingerprints(self):
+        query = "MATCH (s:PipelineStep) RETURN s.name AS name, s.fingerprint AS fingerprint"
+        with self.db._driver.session(database=self.db._database) as session:
+            return {record["name"]: record["fingerprint"] for record in session.run(query)}
+
+    def save_fingerprint(self, result):
+        query = """
+        MERGE (s:PipelineStep {name: $name})
+        SET s.fingerprint = $fingerprint,
+            s.seconds = $seconds,
+            s.completedAt = datetime($completed_at)
+        """
+        with self.db._driver.session(database=self.db._database) as session:
+            session.run(query, name=result.name, fingerprint=result.fingerprint,
+                        seconds=round(result.seconds, 3),
+                        completed_at=datetime.now(timezone.utc).isoformat()).consume()
+
+    # Execution
+
+    def data_file(self, step):
+        data_file = get_valid_path(self.base_path) / step.file
+        validate_file_exists(data_file)
+        return data_file
+
+    def run_step(self, name):
+        step = self.steps[name]
+        result = self.results[name]
+        result.start = time.perf_counter()
+        importer = step.factory(self.shared_cls, self.backend)()
+        configure(importer, self.options)
+        # Checkpoints of an interrupted run only apply to the same inputs. File steps use the
+        # same scope as the single-step commands, so bulk-loaded stages are skipped on resume
+        importer.checkpoint_scope = result.fingerprint
+        try:
+            if step.file:
+                data_file = self.data_file(step)
+                importer.checkpoint_scope = checkpoint_scope(data_file)
+                logging.info(f"[{name}] Importing {step.file} records using backend '{self.backend}'...")
+                importer.import_data(str(data_file))
+            else:
+                logging.info(f"[{name}] Applying updates to the graph using backend '{self.backend}'...")
+                importer.apply_updates()
+                importer.checkpoints.clear()
+        finally:
+            importer.write_metrics()
+            result.end = time.perf_counter()
+        self.save_fingerprint(result)
+
+    def is_selected(self, name):
+        return self.only is None or name in self.only
+
+    def missing_dependencies(self, stored):
+        # Steps left out by --only must have run before, or the selected steps read nothing
+        return sorted({dependency for name in self.order if self.is_selected(name)
+                       for dependency in self.steps[name].depends_on
+                       if not self.is_selected(dependency) and dependency not in stored})
+
+    def create_schema(self):
+        # Concurrent steps would race to create the same constraints and indexes
+        for name in filter(self.is_selected, self.order):
+            importer = self.steps[name].factory(self.shared_cls, self.backend)()
+            if hasattr(importer, "set_constraints"):
+                configure(importer, self.options)
+                logging.info(f"[{name}] Creating constraints and indexes...")
+                importer.set_constraints()
+
+    def run(self):
+        self.origin = time.perf_counter()
+        stored = self.stored_fingerprints()
+        missing = self.missing_dependencies(stored)
+        if missing:
+            logging.error(f"Steps {', '.join(missing)} have never run, add them to --only")
+            for name in self.order:
+                self.results[name].status = "not run"
+            return False
+        self.create_schema()
+        pending = list(self.order)
+        pending = list(self.order)
+        running = {}
+        failed = False
+
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            while pending or running:
+                # Start every step whose dependencies are done, unless a step has failed
+                for name in list(pending):
+                    if failed:
+                        break
+                    step = self.steps[name]
+                    states = [self.results[dependency].status for dependency in step.depends_on]
+                    if any(state in ("failed", "blocked") for state in states):
+                        self.results[name].status = "blocked"
+                        pending.remove(name)
+                        continue
+                    if not all(state in ("done", "skipped") for state in states):
+                        continue
+                    pending.remove(name)
+                    result = self.results[name]
+                    result.fingerprint = self.fingerprint(name)
+                    if not self.is_selected(name):
+                        if stored[name] != result.fingerprint:
+                            logging.warning(f"[{name}] Inputs changed since the last run, "
+                                            f"later steps read its earlier results")
+                        logging.info(f"[{name}] Not selected by --only, skipping")
+                        result.status = "skipped"
+                        continue
+                    if not self.force and stored.get(name) == result.fingerprint:
+                        logging.info(f"[{name}] Inputs unchanged since the last run, skipping")
+                        result.status = "skipped"
+                        continue
+                    result.status = "running"
+                    running[executor.submit(self.run_step, name)] = name
+
+                if failed and not running:
+                    break
+                if not running:
+                    # Skipped steps may have unlocked others
+                    continue
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    name = running.pop(future)
+                    result = self.results[name]
+                    try:
+                        future.result()
+                        result.status = "done"
+                        logging.info(f"[{name}] Completed in {result.seconds:.1f}s")
+                    except Exception:
+                        result.status = "failed"
+                        failed = True
+                        logging.exception(f"[{name}] Step failed, not starting further steps")
+
+        for name in pending:
+            self.results[name].status = "not run"
+        return not failed
+
+    # Reporting
+
+    def critical_path(self):
+        # Longest chain of executed steps by duration, following declared dependencies
+        finish, previous = {}, {}
+        for name in self.order:
+            best = max(self.steps[name].depends_on, key=lambda dependency: finish[dependency], default=None)
+            finish[name] = self.results[name].seconds + (finish[best] if best else 0.0)
+            previous[name] = best
+        if not finish:
+            return [], 0.0
+        name = max(finish, key=finish.get)
+        total = finish[name]
+        path = []
+        while name:
+            path.append(name)
+            name = previous[name]
+        return list(reversed(path)), total
+
+    def summary(self):
+        lines = [f"{'step':<18}{'status':<10}{'start':>9}{'duration':>11}"]
+        for name in self.order:
+            result = self.results[name]
+            start = f"{result.start - self.origin:.1f}s" if result.start is not None else "-"
+            duration = f"{result.seconds:.1f}s" if result.end is not None else "-"
+            lines.append(f"{name:<18}{result.status:<10}{start:>9}{duration:>11}")
+        path, total = self.critical_path()
+        wall = time.perf_counter() - self.origin
+        step_total = sum(result.seconds for result in self.results.values())
+        lines.append(f"Critical path: {' -> '.join(path)} ({total:.1f}s)")
+        lines.append(f"Wall time: {wall:.1f}s, sum of step times: {step_total:.1f}s")
+        return "\n".join(lines)
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Run the Chicago import steps as a dependency graph.")
+    # Clustering steps read the graph back, so the pipeline runs online or in memory
+    parser.add_argument("--backend", choices=["neo4j", "memory"], required=True,
+                        help="Which importer backend to use")
+    parser.add_argument("--graph-file", default=None,
+                        help="File the memory backend loads its graph from and saves it to")
+    parser.add_argument("--base_path", default="./data/chicago/",
+                        help="Base directory where the files are located")
+    parser.add_argument("--parallel", type=int, default=3,
+                        help="Maximum number of steps running at once")
+    parser.add_argument("--force", action="store_true",
+                        help="Run every step even if its inputs are unchanged")
+    parser.add_argument("--only", nargs="+", choices=[step.name for step in STEPS],
+                        help="Run only these steps, their dependencies must already be done")
+    add_importer_arguments(parser)
+    args = parser.parse_args()
+
+    pipeline = ChicagoPipeline(
+        STEPS,
+        BACKENDS[args.backend],
+        args.backend,
+        args.base_path,
+        importer_options(args),
+        parallel=args.parallel,
+        force=args.force,
+        only=args.only,
+    )
+    if args.backend == "memory":
+        pipeline.db.graph_file = args.graph_file
+    try:
+        succeeded = pipeline.run()
+    finally:
+        pipeline.close()
+    logging.info("Pipeline summary:\n" + pipeline.summary())
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
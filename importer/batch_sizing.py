@@ -0,0 +1,48 @@
+import json
+import threading
+
+
+class AdaptiveBatchSize:
+    """Batch size controller for one query, steered by observed transaction latency.
+
+    After every committed batch the size is scaled by target / observed
+    latency (at most doubling or halving per step) and capped so that the
+    estimated payload stays under a memory ceiling. A batch failing for its
+    size halves it.
+    """
+
+    def __init__(self, initial, target_latency=2.0, min_size=50, max_size=50000,
+                 max_batch_bytes=32 * 1024 * 1024):
+        self.size = initial
+        self.target_latency = target_latency
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_batch_bytes = max_batch_bytes
+        self.row_bytes = None
+        self._lock = threading.Lock()
+
+    def next_size(self):
+        return self.size
+
+    def observe(self, batch, seconds):
+        with self._lock:
+            if self.row_bytes is None and batch:
+                # A small sample is enough to estimate the payload of a row
+                sample = batch[:20]
+                self.row_bytes = max(1, len(json.dumps(sample, default=str)) // len(sample))
+
+            ratio = 2.0 if seconds <= 0 else min(2.0, max(0.5, self.target_latency / seconds))
+            # Only grow when the batch was full, otherwise latency says nothing about larger batches
+            if ratio > 1 and len(batch) < self.size:
+                return
+            self.size = self._clamp(int(self.size * ratio))
+
+    def shrink(self):
+        with self._lock:
+            self.size = self._clamp(self.size // 2)
+
+    def _clamp(self, size):
+        max_size = self.max_size
+        if self.row_bytes:
+            max_size = min(max_size, self.max_batch_bytes // self.row_bytes)
+        return max(self.min_size, min(size, max_size))
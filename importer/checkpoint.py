@@ -0,0 +1,75 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+
+class CheckpointStore:
+    """Progress of an import run, saved as a small JSON file after every change.
+
+    Each stage records whether it completed and, for every batch store inside
+    it, how many leading rows are committed. Rows rather than batches are
+    counted because batch sizes may change between runs. Batches can commit
+    out of order when stored in parallel, so only the contiguous prefix counts.
+    The file is kept after a successful import, so resuming a finished import
+    skips all of it; a run without --resume starts a fresh checkpoint.
+    Updaters clear it once they succeed instead, since what they read from
+    the graph may have changed by their next run.
+    """
+
+    def __init__(self, path, scope):
+        self.path = Path(path)
+        self.scope = scope
+        self._stages = {}
+        self._pending = {}
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not self.path.is_file():
+            return
+
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("scope") != self.scope:
+            logging.warning(f"Checkpoint {self.path} was written for {data.get('scope')}, starting from scratch")
+            return
+
+        self._stages = data.get("stages", {})
+
+    def is_completed(self, stage):
+        return self._stages.get(stage, {}).get("completed", False)
+
+    def committed_rows(self, key):
+        return self._stages.get(key, {}).get("rows", 0)
+
+    def commit_batch(self, key, index, rows):
+        # Indices count the batches of the current run, starting after the rows already committed
+        with self._lock:
+            state = self._stages.setdefault(key, {"rows": 0})
+            pending = self._pending.setdefault(key, {})
+            pending[index] = rows
+            while self._next.get(key, 0) in pending:
+                state["rows"] += pending.pop(self._next.get(key, 0))
+                self._next[key] = self._next.get(key, 0) + 1
+            self._save()
+
+    def complete(self, stage):
+        with self._lock:
+            self._stages.setdefault(stage, {})["completed"] = True
+            self._save()
+
+    def clear(self):
+        with self._lock:
+            self._stages = {}
+            self._pending = {}
+            self._next = {}
+            self.path.unlink(missing_ok=True)
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"scope": self.scope, "stages": self._stages}, f, indent=2)
+        tmp_path.replace(self.path)
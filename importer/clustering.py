@@ -0,0 +1,145 @@
+import logging
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from resolution.cache import SimilarityCache
+from resolution.clusters import ArrayUnionFind
+from resolution.louvain import LouvainCommunities
+from resolution.sweep import CandidatePairs
+
+
+def key_order(key):
+    # Keys of one label may mix integers and strings, which Python cannot compare
+    return isinstance(key, str), key
+
+
+class ClusteringMixin:
+    """Similarity and clustering helpers of the clustering steps, mixed into their Neo4jBaseImporter.
+
+    Nodes are identified by their key property rather than by internal ids,
+    which Neo4j may reuse after a delete. The local WCC and Louvain stages
+    number components and communities by the position of their smallest key
+    in key order, so the numbers depend only on the graph. The similarity,
+    WCC and Louvain options are set here, so only clustering steps carry them.
+    """
+
+    key_property = "id"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.similarity = "fulltext"
+        self.similarity_processes = None
+        self.similarity_index = None
+        self.similarity_cache = None
+        self.candidates_file = None
+        self.incremental = False
+        self.wcc = "gds"
+        self.louvain = "gds"
+        self.edge_page_size = 100_000
+
+    def read_node_keys(self, session, label: str, prop: str = None):
+        """Keys of `label` nodes in ascending order, with their integer `prop` or -1 when it is not set."""
+        query = f"MATCH (n:`{label}`) WHERE n.`{self.key_property}` IS NOT NULL " \
+                f"RETURN n.`{self.key_property}` as key" + (f", n.`{prop}` as value" if prop else "")
+        rows = sorted(((record["key"], record["value"] if prop else None) for record in session.run(query)),
+                      key=lambda row: key_order(row[0]))
+        keys = [key for key, _ in rows]
+        values = np.array([-1 if value is None else value for _, value in rows], dtype=np.int64) if prop else None
+        return keys, values
+
+    def read_edge_pages(self, session, label: str, rel_type: str, keys, weight_property: str = None):
+        """Relationships between `label` nodes as (source, target, weight) positions in keys, one page at a time.
+
+        Pages hold the relationships of edge_page_size start nodes taken in key
+        order, each start node found by a lookup of its key.
+        """
+        query = f"""
+        UNWIND $keys as key
+        MATCH (a:`{label}` {{`{self.key_property}`: key}})-[r:`{rel_type}`]->(b:`{label}`)
+        RETURN key as source, collect(b.`{self.key_property}`) as targets, collect({f"coalesce(r.`{weight_property}`, 1.0)" if weight_property else "1.0"}) as weights
+        """
+        positions = {key: i for i, key in enumerate(keys)}
+        for offset in range(0, len(keys), self.edge_page_size):
+            sources, targets, weights = [], [], []
+            for record in session.run(query, {"keys": keys[offset:offset + self.edge_page_size]}):
+                ends = [positions[target] for target in record["targets"] if target in positions]
+                sources.extend([positions[record["source"]]] * len(ends))
+                targets.extend(ends)
+                weights.extend(weight for target, weight in zip(record["targets"], record["weights"])
+                               if target in positions)
+            yield (np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64),
+                   np.asarray(weights, dtype=float))
+
+    @contextmanager
+    def similarity_scores(self):
+        """SimilarityCache backed by similarity_cache, with its hits and misses added to the running stage."""
+        cache = SimilarityCache(self.similarity_cache)
+        try:
+            yield cache
+        finally:
+            cache.close()
+            if cache.hits or cache.misses:
+                self.metrics.record_cache(self._stage or "similarity", cache.hits, cache.misses)
+                logging.info(cache.summary())
+
+    def save_candidates(self, records: int, pairs):
+        """Save the (source id, target id, score) candidate pairs of a similarity stage to candidates_file."""
+        CandidatePairs.from_pairs(records, pairs).save(self.candidates_file)
+
+    def local_wcc(self, label: str, rel_type: str, write_property: str = "componentId"):
+        """Weakly connected components of `label` nodes over `rel_type`, computed here instead of by GDS.
+
+        Node keys are read in one pass and edges a page at a time, so memory
+        stays at the keys and a few arrays of the node count plus one page of
+        edges. Only nodes whose component changed are written.
+        """
+        start = time.perf_counter()
+        with self._driver.session(database=self.database) as session:
+            keys, components = self.read_node_keys(session, label, write_property)
+            sets, edges = ArrayUnionFind(len(keys)), 0
+            for sources, targets, _ in self.read_edge_pages(session, label, rel_type, keys):
+                sets.union(sources, targets)
+                edges += len(sources)
+
+        found = sets.roots().astype(np.int64)
+        changed = np.flatnonzero(found != components)
+        logging.info(f"{len(np.unique(found))} components of {len(keys)} {label} nodes over {edges} "
+                     f"{rel_type} relationships in {time.perf_counter() - start:.1f}s, {len(changed)} nodes changed")
+
+        write_query = f"""
+        UNWIND $batch as item
+        MATCH (n:`{label}` {{`{self.key_property}`: item.key}})
+        SET n.`{write_property}` = item.component
+        """
+        rows = ({"key": keys[i], "component": int(found[i])} for i in changed)
+        self.batch_store(write_query, rows, size=len(changed), resumable=False)
+
+    def local_louvain(self, label: str, rel_type: str, weight_property: str, write_property: str,
+                      intermediate_property: str = None):
+        """Louvain communities of `label` nodes over `rel_type`, computed here instead of by GDS.
+
+        The weighted relationships are read once into CSR arrays and the
+        components are optimized over similarity_processes processes. Each
+        node gets its first-level community in write_property and, when
+        intermediate_property is given, the community of every level, in
+        batches rather than one transaction over the label.
+        """
+        with self._driver.session(database=self.database) as session:
+            keys, _ = self.read_node_keys(session, label)
+            pages = list(self.read_edge_pages(session, label, rel_type, keys, weight_property))
+        sources, targets, weights = (np.concatenate([page[i] for page in pages]) if pages else np.empty(0)
+                                     for i in range(3))
+        communities = LouvainCommunities(processes=self.similarity_processes).detect(
+            len(keys), sources.astype(np.int64), targets.astype(np.int64), weights)
+
+        write_query = f"""
+        UNWIND $batch as item
+        MATCH (n:`{label}` {{`{self.key_property}`: item.key}})
+        SET n.`{write_property}` = item.community
+        {f"SET n.`{intermediate_property}` = item.communities" if intermediate_property else ""}
+        """
+        rows = ({"key": keys[i], "community": int(communities[0, i]), "communities": communities[:, i].tolist()}
+                for i in range(len(keys)))
+        self.batch_store(write_query, rows, size=len(keys), resumable=False)
@@ -0,0 +1,1859 @@
+import math
+import re
+import time
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from itertools import islice
+
+from importer.memory_graph import ConstraintViolation, Entity, Node, Relationship, to_set
+from resolution.similarity import sorensen_dice_similarity
+
+
+class CypherError(Exception):
+    """A query the memory backend cannot parse or run, or that Neo4j would reject as well."""
+
+
+# Lexer
+
+TOKENS = re.compile(r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<quoted>`(?:[^`]|``)*`)
+  | (?P<number>\d+\.\d+(?:[eE][+-]?\d+)?|\d+[eE][+-]?\d+|\d+)
+  | (?P<param>\$\w+)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op><>|!=|<=|>=|=~|\+=|\.\.|[-+*/%^=<>()\[\]{},.:;|])
+""", re.VERBOSE | re.DOTALL)
+ESCAPES = {"\\": "\\", "'": "'", '"': '"', "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind, value, start, end):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+
+def unescape(text):
+    def replace(match):
+        escape = match.group(1)
+        if escape in ESCAPES:
+            return ESCAPES[escape]
+        if escape[0] in "uU" and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        # Neo4j keeps unknown escapes, so regular expressions such as "\s+" reach the function as written
+        return match.group(0)
+
+    return re.sub(r"\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|.)", replace, text, flags=re.DOTALL)
+
+
+def tokenize(text):
+    tokens, position = [], 0
+    while position < len(text):
+        match = TOKENS.match(text, position)
+        if match is None:
+            raise CypherError(f"Invalid input {text[position:position + 20]!r} at position {position}")
+        kind, value = match.lastgroup, match.group()
+        if kind == "string":
+            value = unescape(value[1:-1])
+        elif kind == "quoted":
+            value = value[1:-1].replace("``", "`")
+        elif kind == "param":
+            value = value[1:]
+        elif kind == "number":
+            value = float(value) if any(c in value for c in ".eE") else int(value)
+        if kind != "space":
+            tokens.append(Token(kind, value, position, match.end()))
+        position = match.end()
+    tokens.append(Token("end", None, len(text), len(text)))
+    return tokens
+
+
+# Values
+
+def type_name(value):
+    if value is None:
+        return "NULL"
+    if isinstance(value, Node):
+        return "Node"
+    if isinstance(value, Relationship):
+        return "Relationship"
+    return {bool: "Boolean", int: "Integer", float: "Float", str: "String", list: "List", dict: "Map",
+            date: "Date", datetime: "DateTime"}.get(type(value), type(value).__name__)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def equals(a, b):
+    """Cypher `=`: None when either side is null, False across types."""
+    if a is None or b is None:
+        return None
+    if isinstance(a, Entity) or isinstance(b, Entity):
+        return a is b
+    if is_number(a) and is_number(b):
+        return a == b
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False
+        result = True
+        for x, y in zip(a, b):
+            equal = equals(x, y)
+            if equal is False:
+                return False
+            if equal is None:
+                result = None
+        return result
+    return type(a) is type(b) and a == b
+
+
+def compare(a, b):
+    """-1, 0 or 1, or None when the values are null or not comparable."""
+    if a is None or b is None:
+        return None
+    if is_number(a) and is_number(b) or isinstance(a, str) and isinstance(b, str) \
+            or isinstance(a, bool) and isinstance(b, bool) \
+            or type(a) is type(b) and isinstance(a, date):
+        if a != a or b != b:
+            return None
+        return (a > b) - (a < b)
+    return None
+
+
+def truth(value, context):
+    if value is None or isinstance(value, bool):
+        return value
+    raise CypherError(f"Type mismatch: expected Boolean but was {type_name(value)} in {context}")
+
+
+def contains(values, value):
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise CypherError(f"Type mismatch: expected List but was {type_name(values)} in IN")
+    result = False
+    for item in values:
+        equal = equals(value, item)
+        if equal:
+            return True
+        if equal is None:
+            result = None
+    return result
+
+
+def add(a, b):
+    if isinstance(a, list):
+        return a + b if isinstance(b, list) else a + [b]
+    if isinstance(b, list):
+        return [a] + b
+    if a is None or b is None:
+        return None
+    if isinstance(a, str) or isinstance(b, str):
+        if isinstance(a, (str, int, float)) and isinstance(b, (str, int, float)):
+            return to_string(a) + to_string(b)
+    elif is_number(a) and is_number(b):
+        return a + b
+    raise CypherError(f"Cannot add {type_name(a)} and {type_name(b)}")
+
+
+def arithmetic(operator):
+    def apply(a, b):
+        if a is None or b is None:
+            return None
+        if not (is_number(a) and is_number(b)):
+            raise CypherError(f"Cannot apply {operator} to {type_name(a)} and {type_name(b)}")
+        if operator == "-":
+            return a - b
+        if operator == "*":
+            return a * b
+        if operator == "^":
+            return float(a) ** b
+        if isinstance(a, int) and isinstance(b, int):
+            if b == 0:
+                raise CypherError("/ by zero")
+            # Java integer division and remainder truncate towards zero
+            quotient = abs(a) // abs(b) * (1 if (a >= 0) == (b >= 0) else -1)
+            return quotient if operator == "/" else a - quotient * b
+        if b == 0:
+            return math.nan if a == 0 or operator == "%" else math.copysign(math.inf, a)
+        return a / b if operator == "/" else math.fmod(a, b)
+    return apply
+
+
+def get_property(value, name):
+    if value is None:
+        return None
+    if isinstance(value, Entity):
+        return value.props.get(name)
+    if isinstance(value, dict):
+        return value.get(name)
+    if isinstance(value, date) and hasattr(value, name):
+        return getattr(value, name)
+    raise CypherError(f"Type mismatch: expected a map but was {type_name(value)} when reading `{name}`")
+
+
+def check_value(value):
+    # Property values are primitives or homogeneous lists of them, as in Neo4j
+    if value is None or isinstance(value, (bool, int, float, str, date)):
+        return value
+    if isinstance(value, list):
+        if any(item is None for item in value):
+            raise CypherError("Collections containing null values can not be stored in properties.")
+        if all(isinstance(item, (bool, int, float, str, date)) for item in value):
+            return list(value)
+    raise CypherError(f"Property values can only be of primitive types or arrays thereof, not {type_name(value)}")
+
+
+def freeze(value):
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    return value
+
+
+def order_key(value):
+    # Ascending Cypher order: maps, nodes, relationships, lists, dates, strings, booleans, numbers, null
+    if value is None:
+        return (8,)
+    if isinstance(value, bool):
+        return (6, value)
+    if is_number(value):
+        return (7, value)
+    if isinstance(value, str):
+        return (5, value)
+    if isinstance(value, datetime):
+        return (4, value.isoformat())
+    if isinstance(value, date):
+        return (3, value.isoformat())
+    if isinstance(value, list):
+        return (2, tuple(order_key(item) for item in value))
+    if isinstance(value, Entity):
+        return (1, value.id)
+    return (0, str(freeze(value)))
+
+
+def to_string(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, (int, float, date)):
+        return value.isoformat() if isinstance(value, date) else str(value)
+    raise CypherError(f"Invalid input for function 'toString()': expected a primitive but was {type_name(value)}")
+
+
+def to_integer(value):
+    if value is None or isinstance(value, bool):
+        return None if value is None else int(value)
+    if is_number(value):
+        return int(value)
+    try:
+        return int(float(value)) if "." in value or "e" in value.lower() else int(value)
+    except ValueError:
+        return None
+
+
+def to_float(value):
+    if value is None or is_number(value):
+        return None if value is None else float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def java_split(text, regex):
+    # String.split: trailing empty strings are dropped
+    parts = re.split(regex, text)
+    while len(parts) > 1 and parts[-1] == "":
+        parts.pop()
+    return parts
+
+
+def capitalize(text):
+    return text[:1].upper() + text[1:]
+
+
+def null_safe(function):
+    def call(value, *args):
+        return None if value is None else function(value, *args)
+    return call
+
+
+FUNCTIONS = {
+    "coalesce": lambda *values: next((value for value in values if value is not None), None),
+    "trim": null_safe(str.strip),
+    "ltrim": null_safe(str.lstrip),
+    "rtrim": null_safe(str.rstrip),
+    "tolower": null_safe(str.lower),
+    "toupper": null_safe(str.upper),
+    "replace": null_safe(lambda text, search, replacement: text.replace(search, replacement)),
+    "split": null_safe(lambda text, delimiter: text.split(delimiter)),
+    "substring": null_safe(lambda text, start, length=None: text[start:None if length is None else start + length]),
+    "left": null_safe(lambda text, length: text[:length]),
+    "right": null_safe(lambda text, length: text[len(text) - length:]),
+    "reverse": null_safe(lambda value: value[::-1]),
+    "size": null_safe(len),
+    "head": null_safe(lambda values: values[0] if values else None),
+    "last": null_safe(lambda values: values[-1] if values else None),
+    "tail": null_safe(lambda values: values[1:]),
+    "range": lambda start, end, step=1: list(range(start, end + (1 if step > 0 else -1), step)),
+    "tostring": to_string,
+    "tointeger": to_integer,
+    "tofloat": to_float,
+    "toboolean": null_safe(lambda value: value if isinstance(value, bool)
+                           else {"true": True, "false": False}.get(str(value).lower())),
+    "tointegerlist": null_safe(lambda values: [to_integer(value) for value in values]),
+    "tostringlist": null_safe(lambda values: [to_string(value) for value in values]),
+    "abs": null_safe(abs),
+    "round": null_safe(lambda value: float(math.floor(value + 0.5))),
+    "floor": null_safe(lambda value: float(math.floor(value))),
+    "ceil": null_safe(lambda value: float(math.ceil(value))),
+    "sqrt": null_safe(math.sqrt),
+    "id": null_safe(lambda entity: entity.id),
+    "elementid": null_safe(lambda entity: str(entity.id)),
+    "labels": null_safe(lambda node: sorted(node.labels)),
+    "type": null_safe(lambda rel: rel.type),
+    "keys": null_safe(lambda value: list(value.props if isinstance(value, Entity) else value)),
+    "properties": null_safe(lambda value: dict(value.props if isinstance(value, Entity) else value)),
+    "startnode": null_safe(lambda rel: rel.start),
+    "endnode": null_safe(lambda rel: rel.end),
+    "timestamp": lambda: int(time.time() * 1000),
+    "datetime": lambda value=None: datetime.now(timezone.utc) if value is None else datetime.fromisoformat(value),
+    "date": lambda value=None: date.today() if value is None else date.fromisoformat(value),
+    "apoc.coll.toset": null_safe(to_set),
+    "apoc.text.capitalize": null_safe(capitalize),
+    "apoc.text.capitalizeall": null_safe(lambda text: re.sub(r"\S+", lambda word: capitalize(word.group()), text)),
+    "apoc.text.replace": null_safe(lambda text, regex, replacement: re.sub(regex, lambda _: replacement, text)),
+    "apoc.text.split": null_safe(java_split),
+    "apoc.text.join": null_safe(lambda values, delimiter: delimiter.join(str(value) for value in values)),
+    "apoc.text.sorensendicesimilarity": sorensen_dice_similarity,
+}
+
+
+# Aggregating functions
+
+class Count:
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        if value is not None:
+            self.count += 1
+
+    def result(self, ctx):
+        return self.count
+
+
+class Collect:
+    def __init__(self):
+        self.values = []
+
+    def add(self, value):
+        if value is not None:
+            self.values.append(value)
+
+    def result(self, ctx):
+        return self.values
+
+
+class Extreme:
+    def __init__(self, sign):
+        self.sign = sign
+        self.value = None
+
+    def add(self, value):
+        if value is not None and (self.value is None or compare(value, self.value) == self.sign):
+            self.value = value
+
+    def result(self, ctx):
+        return self.value
+
+
+class Sum:
+    def __init__(self, average=False):
+        self.average = average
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def result(self, ctx):
+        if self.average:
+            return self.total / self.count if self.count else None
+        return self.total
+
+
+class GraphProjection:
+    # gds.graph.project as an aggregating function over (name, source, target, dataConfig, config) rows
+    def __init__(self):
+        self.arguments = None
+        self.nodes = {}
+        self.edges = []
+
+    def add(self, arguments):
+        name, source, target, data = (list(arguments) + [None] * 4)[:4]
+        self.arguments = arguments
+        for node in (source, target):
+            if node is not None:
+                self.nodes[node.id] = node
+        if source is not None and target is not None:
+            self.edges.append((source, target, (data or {}).get("relationshipProperties") or {}))
+
+    def result(self, ctx):
+        if self.arguments is None:
+            return None
+        name = self.arguments[0]
+        config = self.arguments[4] if len(self.arguments) > 4 else None
+        projection = NamedGraph(list(self.nodes.values()), self.edges,
+                                undirected=bool((config or {}).get("undirectedRelationshipTypes")))
+        ctx.graph_projection(name, projection)
+        return {"graphName": name, "nodeCount": projection.node_count, "relationshipCount": len(self.edges)}
+
+
+AGGREGATES = {
+    "count": Count,
+    "collect": Collect,
+    "max": lambda: Extreme(1),
+    "min": lambda: Extreme(-1),
+    "sum": Sum,
+    "avg": lambda: Sum(average=True),
+    "gds.graph.project": GraphProjection,
+}
+
+
+class Distinct:
+    def __init__(self, aggregate):
+        self.aggregate = aggregate
+        self.seen = set()
+
+    def add(self, value):
+        key = freeze(value)
+        if key not in self.seen:
+            self.seen.add(key)
+            self.aggregate.add(value)
+
+    def result(self, ctx):
+        return self.aggregate.result(ctx)
+
+
+# Procedures
+
+class NamedGraph:
+    """GDS named graph: nodes in id order and edges as positions into them, with their properties."""
+
+    def __init__(self, nodes, edges, undirected=False):
+        self.nodes = sorted(nodes, key=lambda node: node.id)
+        position = {node.id: i for i, node in enumerate(self.nodes)}
+        self.edges = [(position[source.id], position[target.id], props) for source, target, props in edges]
+        self.undirected = undirected
+
+    @property
+    def node_count(self):
+        return len(self.nodes)
+
+    def arrays(self, weight_property=None):
+        import numpy as np
+
+        sources = np.array([edge[0] for edge in self.edges], dtype=np.int64)
+        targets = np.array([edge[1] for edge in self.edges], dtype=np.int64)
+        weights = np.array([float(edge[2].get(weight_property, 1.0)) if weight_property else 1.0
+                            for edge in self.edges], dtype=float)
+        return sources, targets, weights
+
+
+def labels_of(projection):
+    if projection == "*" or projection is None:
+        return None
+    if isinstance(projection, str):
+        return [projection]
+    if isinstance(projection, list):
+        return projection
+    raise CypherError("Only label and relationship type names are supported in gds.graph.project")
+
+
+def gds_graph_project(ctx, name, node_projection, relationship_projection, config=None):
+    start = time.perf_counter()
+    labels, types = labels_of(node_projection), labels_of(relationship_projection)
+    nodes = {node.id: node for label in labels for node in ctx.graph.nodes(label)} if labels \
+        else {node.id: node for node in ctx.graph.nodes()}
+    edges = [(rel.start, rel.end, {}) for rel in ctx.graph.all_relationships()
+             if (types is None or rel.type in types) and rel.start.id in nodes and rel.end.id in nodes]
+    projection = NamedGraph(list(nodes.values()), edges)
+    ctx.graph_projection(name, projection)
+    return [{"graphName": name, "nodeCount": projection.node_count, "relationshipCount": len(edges),
+             "nodeProjection": node_projection, "relationshipProjection": relationship_projection,
+             "projectMillis": int((time.perf_counter() - start) * 1000)}]
+
+
+def projection_of(ctx, name):
+    if name not in ctx.graph.projections:
+        raise CypherError(f"Graph with name `{name}` does not exist on database `neo4j`.")
+    return ctx.graph.projections[name]
+
+
+def gds_graph_drop(ctx, name, fail_if_missing=True):
+    if name not in ctx.graph.projections:
+        if fail_if_missing:
+            projection_of(ctx, name)
+        return []
+    projection = ctx.graph.projections.pop(name)
+    return [{"graphName": name, "nodeCount": projection.node_count, "relationshipCount": len(projection.edges)}]
+
+
+def gds_wcc_write(ctx, name, config):
+    import numpy as np
+    from resolution.clusters import ArrayUnionFind
+
+    start = time.perf_counter()
+    projection = projection_of(ctx, name)
+    sources, targets, _ = projection.arrays()
+    sets = ArrayUnionFind(projection.node_count)
+    sets.union(sources, targets)
+    # Components are numbered by their smallest node id, nodes being in id order
+    ids = np.array([node.id for node in projection.nodes], dtype=np.int64)
+    components = ids[sets.roots()].tolist() if len(ids) else []
+    for node, component in zip(projection.nodes, components):
+        ctx.graph.set_property(node, config["writeProperty"], component)
+    return [{"nodePropertiesWritten": len(components), "componentCount": len(set(components)),
+             "computeMillis": int((time.perf_counter() - start) * 1000), "configuration": config}]
+
+
+def modularity(community, sources, targets, weights):
+    import numpy as np
+
+    degrees = np.bincount(sources, weights, len(community)) + np.bincount(targets, weights, len(community))
+    total = degrees.sum()
+    if total == 0:
+        return 0.0
+    inside = 2 * weights[community[sources] == community[targets]].sum()
+    return float(inside / total - ((np.bincount(community, degrees) / total) ** 2).sum())
+
+
+def gds_louvain_write(ctx, name, config):
+    import numpy as np
+    from resolution.louvain import LouvainCommunities
+
+    start = time.perf_counter()
+    projection = projection_of(ctx, name)
+    sources, targets, weights = projection.arrays(config.get("relationshipWeightProperty"))
+    levels = LouvainCommunities().detect(projection.node_count, sources, targets, weights)
+    ids = np.array([node.id for node in projection.nodes], dtype=np.int64)
+    communities = ids[levels] if len(ids) else np.empty((1, 0), dtype=np.int64)
+    for i, node in enumerate(projection.nodes):
+        value = communities[:, i].tolist() if config.get("includeIntermediateCommunities") \
+            else int(communities[-1, i])
+        ctx.graph.set_property(node, config["writeProperty"], value)
+    modularities = [modularity(level, sources, targets, weights) for level in levels] if len(ids) else [0.0]
+    return [{"communityCount": len(np.unique(communities[-1])), "modularity": modularities[-1],
+             "modularities": modularities, "ranLevels": len(levels), "nodePropertiesWritten": len(ids),
+             "computeMillis": int((time.perf_counter() - start) * 1000), "configuration": config}]
+
+
+def fulltext_query_nodes(ctx, index, query, options=None):
+    try:
+        nodes = ctx.graph.query_fulltext(index, query)
+    except KeyError as e:
+        raise CypherError(str(e.args[0])) from None
+    return [{"node": node, "score": 1.0} for node in nodes]
+
+
+def merge_nodes(ctx, nodes, config=None):
+    config = config or {}
+    properties = config.get("properties", "overwrite")
+    if properties not in ("discard", "overwrite", "override"):
+        raise CypherError(f"apoc.refactor.mergeNodes properties: {properties!r} is not supported in memory")
+    nodes = list({node.id: node for node in nodes if node is not None}.values())
+    if not nodes:
+        return []
+    ctx.graph.merge_nodes(nodes[0], nodes[1:], "discard" if properties == "discard" else "overwrite")
+    return [{"node": nodes[0]}]
+
+
+def periodic_iterate(ctx, outer, inner, config=None):
+    # Every record of the outer query runs the inner one with its columns as variables
+    start = time.perf_counter()
+    config = config or {}
+    params = {**ctx.params, **(config.get("params") or {})}
+    records = parse(outer).execute(Context(ctx.graph, params))
+    statement = parse(inner)
+    for record in records:
+        statement.execute(Context(ctx.graph, params), [record])
+    batch_size = config.get("batchSize", 10000)
+    return [{"batches": math.ceil(len(records) / batch_size), "total": len(records),
+             "timeTaken": int(time.perf_counter() - start), "committedOperations": len(records),
+             "failedOperations": 0, "failedBatches": 0, "retries": 0, "errorMessages": {},
+             "wasTerminated": False}]
+
+
+PROCEDURES = {
+    "db.index.fulltext.querynodes": fulltext_query_nodes,
+    "apoc.refactor.mergenodes": merge_nodes,
+    "apoc.periodic.iterate": periodic_iterate,
+    "gds.graph.project": gds_graph_project,
+    "gds.graph.drop": gds_graph_drop,
+    "gds.wcc.write": gds_wcc_write,
+    "gds.louvain.write": gds_louvain_write,
+}
+
+
+# Patterns
+
+class NodePattern:
+    __slots__ = ("var", "labels", "props")
+
+    def __init__(self, var, labels, props):
+        self.var = var
+        self.labels = labels
+        self.props = props
+
+
+class RelPattern:
+    __slots__ = ("var", "types", "props", "direction")
+
+    def __init__(self, var, types, props, direction):
+        self.var = var
+        self.types = types
+        self.props = props
+        self.direction = direction
+
+
+class PathPattern:
+    def __init__(self, nodes, rels):
+        self.nodes = nodes
+        self.rels = rels
+        self.variables = [pattern.var for pattern in nodes + rels]
+        self.names = set(self.variables)
+        for pattern in nodes + rels:
+            if pattern.props is not None:
+                self.names |= pattern.props.names
+
+
+REVERSED = {"out": "in", "in": "out", "both": "both"}
+MISSING = object()
+
+
+def property_values(patterns, row, ctx):
+    return [pattern.props(row, ctx) if pattern.props is not None else None for pattern in patterns]
+
+
+def has_properties(entity, props):
+    return props is None or all(equals(entity.props.get(name), value) for name, value in props.items())
+
+
+def node_matches(pattern, props, node):
+    return all(label in node.labels for label in pattern.labels) and has_properties(node, props)
+
+
+def anchor_candidates(path, node_props, row, ctx, hints):
+    """Position of the node to start matching from, and its candidate nodes."""
+    graph = ctx.graph
+    for i, pattern in enumerate(path.nodes):
+        if pattern.labels and node_props[i]:
+            return i, graph.find_nodes(pattern.labels[0], node_props[i])
+    for i, pattern in enumerate(path.nodes):
+        for name, operator, value in hints.get(pattern.var, ()):
+            if not value.names <= row.keys() or (name is not None and not pattern.labels):
+                continue
+            value = value(row, ctx)
+            values = value if operator == "IN" else [value]
+            if not isinstance(values, list):
+                continue
+            found = {}
+            for item in values:
+                if item is None:
+                    continue
+                if name is None:
+                    node = graph.get_node(item) if isinstance(item, int) else None
+                    nodes = [node] if node is not None else []
+                else:
+                    nodes = graph.find_nodes(pattern.labels[0], {name: item})
+                found.update((node.id, node) for node in nodes)
+            return i, list(found.values())
+    sizes = [min(graph.count(label) for label in pattern.labels) if pattern.labels else math.inf
+             for pattern in path.nodes]
+    i = sizes.index(min(sizes))
+    pattern = path.nodes[i]
+    if not pattern.labels:
+        return i, graph.nodes()
+    return i, graph.nodes(min(pattern.labels, key=graph.count))
+
+
+def match_path(path, row, ctx, used=frozenset(), hints=None):
+    """Rows extending row with every match of path, with the relationships used so far."""
+    nodes, rels = path.nodes, path.rels
+    node_props, rel_props = property_values(nodes, row, ctx), property_values(rels, row, ctx)
+    # A null property value in a pattern matches nothing
+    if any(props and any(value is None for value in props.values()) for props in node_props + rel_props):
+        return
+    anchor = next((i for i, pattern in enumerate(nodes) if pattern.var in row), None)
+    if anchor is None:
+        anchor, candidates = anchor_candidates(path, node_props, row, ctx, hints or {})
+    else:
+        bound = row[nodes[anchor].var]
+        if bound is None:
+            return
+        if not isinstance(bound, Node):
+            raise CypherError(f"Type mismatch: expected Node but was {type_name(bound)}")
+        candidates = [bound]
+    steps = [(k, k, k + 1, rels[k].direction) for k in range(anchor, len(rels))]
+    steps += [(k, k + 1, k, REVERSED[rels[k].direction]) for k in range(anchor - 1, -1, -1)]
+
+    def walk(step, bindings, used):
+        if step == len(steps):
+            yield bindings, used
+            return
+        k, origin, target, direction = steps[step]
+        rel_pattern, target_pattern = rels[k], nodes[target]
+        node = bindings[nodes[origin].var]
+        candidates = ctx.graph.relationships(node, None, direction)
+        if direction == "both":
+            candidates = {rel.id: rel for rel in candidates}.values()
+        bound_rel = bindings.get(rel_pattern.var, MISSING)
+        bound_target = bindings.get(target_pattern.var, MISSING)
+        for rel in candidates:
+            if rel.id in used or rel_pattern.types and rel.type not in rel_pattern.types:
+                continue
+            if bound_rel is not MISSING and bound_rel is not rel or not has_properties(rel, rel_props[k]):
+                continue
+            other = rel.end if direction == "out" else rel.start if direction == "in" \
+                else rel.end if rel.start is node else rel.start
+            if bound_target is not MISSING:
+                if bound_target is not other:
+                    continue
+            elif not node_matches(target_pattern, node_props[target], other):
+                continue
+            extended = dict(bindings)
+            extended[target_pattern.var] = other
+            extended[rel_pattern.var] = rel
+            yield from walk(step + 1, extended, used | {rel.id})
+
+    for node in candidates:
+        if not node_matches(nodes[anchor], node_props[anchor], node):
+            continue
+        bindings = dict(row)
+        bindings[nodes[anchor].var] = node
+        yield from walk(0, bindings, used)
+
+
+def match_paths(paths, row, ctx, hints=None):
+    # Relationships are matched at most once across all the paths of a clause
+    def extend(i, bindings, used):
+        if i == len(paths):
+            yield bindings
+            return
+        for extended, now_used in match_path(paths[i], bindings, ctx, used, hints):
+            yield from extend(i + 1, extended, now_used)
+    return extend(0, row, frozenset())
+
+
+def entity_props(pattern, bindings, ctx, merge):
+    props = pattern.props(bindings, ctx) if pattern.props is not None else {}
+    for name, value in props.items():
+        if value is None and merge:
+            raise CypherError(f"Cannot merge the following node or relationship because of null property value "
+                              f"for '{name}'")
+    return {name: check_value(value) for name, value in props.items() if value is not None}
+
+
+def create_path(path, row, ctx, merge=False):
+    bindings = dict(row)
+    for pattern in path.nodes:
+        if pattern.var in bindings:
+            if bindings[pattern.var] is None:
+                raise CypherError(f"Failed to create relationship, node `{pattern.var}` is missing")
+            continue
+        bindings[pattern.var] = ctx.graph.create_node(pattern.labels, entity_props(pattern, bindings, ctx, merge))
+    for k, pattern in enumerate(path.rels):
+        if len(pattern.types) != 1:
+            raise CypherError("Exactly one relationship type must be specified for CREATE and MERGE")
+        if pattern.direction == "both" and not merge:
+            raise CypherError("Only directed relationships are supported in CREATE")
+        left, right = bindings[path.nodes[k].var], bindings[path.nodes[k + 1].var]
+        start, end = (right, left) if pattern.direction == "in" else (left, right)
+        bindings[pattern.var] = ctx.graph.create_relationship(start, pattern.types[0], end,
+                                                              entity_props(pattern, bindings, ctx, merge))
+    return bindings
+
+
+# Clauses
+
+class Context:
+    def __init__(self, graph, params):
+        self.graph = graph
+        self.params = params
+
+    def graph_projection(self, name, projection):
+        if name in self.graph.projections:
+            raise CypherError(f"A graph with name '{name}' already exists.")
+        self.graph.projections[name] = projection
+
+
+class Match:
+    def __init__(self, paths, where, optional):
+        self.paths = paths
+        self.where = where
+        self.optional = optional
+        self.names = set().union(*(path.variables for path in paths))
+        # Conjuncts of the WHERE that look a pattern node up by property or id, such as a.id = item.source
+        self.hints = {}
+        for conjunct in getattr(where, "conjuncts", [where] if where else []):
+            for var, name, operator, value in getattr(conjunct, "lookups", ()):
+                if var not in value.names:
+                    self.hints.setdefault(var, []).append((name, operator, value))
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            found = False
+            for bindings in match_paths(self.paths, row, ctx, self.hints):
+                if self.where is None or self.where(bindings, ctx) is True:
+                    found = True
+                    yield bindings
+            if self.optional and not found:
+                yield {**row, **{name: None for name in self.names if name not in row}}
+
+
+class Merge:
+    def __init__(self, path, on_create, on_match):
+        self.path = path
+        self.on_create = on_create
+        self.on_match = on_match
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            matches = [bindings for bindings, _ in match_path(self.path, row, ctx)]
+            if not matches:
+                bindings = create_path(self.path, row, ctx, merge=True)
+                for item in self.on_create:
+                    item(bindings, ctx)
+                yield bindings
+                continue
+            for bindings in matches:
+                for item in self.on_match:
+                    item(bindings, ctx)
+                yield bindings
+
+
+class Create:
+    def __init__(self, paths):
+        self.paths = paths
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            for path in self.paths:
+                row = create_path(path, row, ctx)
+            yield row
+
+
+class Update:
+    # SET and REMOVE: every item is applied to the row in order
+    def __init__(self, items):
+        self.items = items
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            for item in self.items:
+                item(row, ctx)
+            yield row
+
+
+class Delete:
+    def __init__(self, values, detach):
+        self.values = values
+        self.detach = detach
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            for value in self.values:
+                self.delete(value(row, ctx), ctx)
+            yield row
+
+    def delete(self, value, ctx):
+        if value is None:
+            return
+        if isinstance(value, list):
+            for item in value:
+                self.delete(item, ctx)
+        elif isinstance(value, Node):
+            ctx.graph.delete_node(value, detach=self.detach)
+        elif isinstance(value, Relationship):
+            ctx.graph.delete_relationship(value)
+        else:
+            raise CypherError(f"Expected a Node, Relationship or Path, but got a {type_name(value)}")
+
+
+class Unwind:
+    def __init__(self, value, var):
+        self.value = value
+        self.var = var
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            values = self.value(row, ctx)
+            if values is None:
+                continue
+            for value in values if isinstance(values, list) else [values]:
+                unwound = dict(row)
+                unwound[self.var] = value
+                yield unwound
+
+
+AGGREGATED = " aggregated"
+
+
+class Projection:
+    """WITH and RETURN: projection, grouping by the non-aggregate items, DISTINCT, ORDER BY, SKIP, LIMIT and WHERE."""
+
+    def __init__(self, items, star, distinct, aggregates, order, skip, limit, where):
+        self.items = items
+        self.star = star
+        self.distinct = distinct
+        self.aggregates = aggregates
+        self.order = order
+        self.skip = skip
+        self.limit = limit
+        self.where = where
+
+    def project(self, row, ctx):
+        projected = dict(row) if self.star else {}
+        for name, value, _ in self.items:
+            projected[name] = value(row, ctx)
+        return projected
+
+    def grouped(self, rows, ctx):
+        keys = [(name, value) for name, value, aggregated in self.items if not aggregated]
+        groups = {}
+        for row in rows:
+            key = freeze([value(row, ctx) for _, value in keys])
+            if key not in groups:
+                groups[key] = (row, [(factory(), argument) for factory, argument in self.aggregates])
+            for state, argument in groups[key][1]:
+                state.add(argument(row, ctx))
+        if not groups and not keys:
+            groups[()] = ({}, [(factory(), argument) for factory, argument in self.aggregates])
+        for row, states in groups.values():
+            scope = dict(row)
+            scope[AGGREGATED] = [state.result(ctx) for state, _ in states]
+            yield self.project(scope, ctx), row
+
+    def apply(self, rows, ctx):
+        if self.aggregates:
+            results = self.grouped(rows, ctx)
+        else:
+            results = ((self.project(row, ctx), row) for row in rows)
+        if self.distinct:
+            results = self.unique(results)
+        if self.order:
+            results = list(results)
+            for value, descending in reversed(self.order):
+                results.sort(key=lambda result: order_key(value({**result[1], **result[0]}, ctx)),
+                             reverse=descending)
+        projected = (result[0] for result in results)
+        if self.skip is not None or self.limit is not None:
+            skip = self.skip({}, ctx) if self.skip is not None else 0
+            limit = self.limit({}, ctx) if self.limit is not None else None
+            projected = islice(projected, skip, None if limit is None else skip + limit)
+        for row in projected:
+            if self.where is None or self.where(row, ctx) is True:
+                yield row
+
+    @staticmethod
+    def unique(results):
+        seen = set()
+        for projected, row in results:
+            key = freeze(list(projected.values()))
+            if key not in seen:
+                seen.add(key)
+                yield projected, row
+
+
+class Call:
+    def __init__(self, name, arguments, yields, where):
+        self.name = name
+        self.procedure = PROCEDURES.get(name.lower())
+        if self.procedure is None:
+            raise CypherError(f"There is no procedure with the name `{name}` registered in the memory backend")
+        self.arguments = arguments
+        self.yields = yields
+        self.where = where
+
+    def records(self, row, ctx):
+        return self.procedure(ctx, *(argument(row, ctx) for argument in self.arguments))
+
+    def apply(self, rows, ctx):
+        for row in rows:
+            records = self.records(row, ctx)
+            if self.yields is None:
+                yield row
+                continue
+            for record in records:
+                extended = dict(row)
+                for field, alias in self.yields:
+                    if field not in record:
+                        raise CypherError(f"Unknown procedure output: `{field}` of {self.name}")
+                    extended[alias] = record[field]
+                if self.where is None or self.where(extended, ctx) is True:
+                    yield extended
+
+
+class Query:
+    def __init__(self, clauses):
+        self.clauses = clauses
+        self.returns = isinstance(clauses[-1], Projection) and getattr(clauses[-1], "is_return", False)
+        # A procedure called on its own returns its records, as CALL proc() does without YIELD
+        self.standalone = len(clauses) == 1 and isinstance(clauses[0], Call) and clauses[0].yields is None
+
+    def execute(self, ctx, rows=None):
+        if self.standalone:
+            return list(self.clauses[0].records({}, ctx))
+        stream = iter(rows if rows is not None else [{}])
+        for clause in self.clauses:
+            stream = clause.apply(stream, ctx)
+        if self.returns:
+            return list(stream)
+        for _ in stream:
+            pass
+        return []
+
+
+class SchemaCommand:
+    # CREATE CONSTRAINT / INDEX / FULLTEXT INDEX: unique constraints and indexes are both property indexes
+    PATTERNS = [
+        ("constraint", re.compile(r"CREATE\s+CONSTRAINT\s+(?:`?\w+`?\s+)?(?:IF\s+NOT\s+EXISTS\s+)?"
+                                  r"FOR\s+\((\w+):`?([^`)]+?)`?\)\s+REQUIRE\s+\1\.`?(\w+)`?\s+IS\s+UNIQUE", re.I)),
+        ("index", re.compile(r"CREATE\s+(?:RANGE\s+|TEXT\s+)?INDEX\s+(?:`?\w+`?\s+)?(?:IF\s+NOT\s+EXISTS\s+)?"
+                             r"FOR\s+\((\w+):`?([^`)]+?)`?\)\s+ON\s+\(\1\.`?(\w+)`?\)", re.I)),
+        ("fulltext", re.compile(r"CREATE\s+FULLTEXT\s+INDEX\s+`?(\w+)`?\s+(?:IF\s+NOT\s+EXISTS\s+)?"
+                                r"FOR\s+\((\w+):`?([^`)]+?)`?\)\s+ON\s+EACH\s+\[\2\.`?(\w+)`?\]", re.I)),
+    ]
+
+    def __init__(self, text):
+        statement = text.strip().rstrip(";").strip()
+        for kind, pattern in self.PATTERNS:
+            match = pattern.fullmatch(statement)
+            if match:
+                self.kind, self.arguments = kind, match.groups()
+                return
+        raise CypherError(f"Schema command not supported by the memory backend: {statement[:80]}")
+
+    def execute(self, ctx, rows=None):
+        graph = ctx.graph
+        if self.kind == "fulltext":
+            name, _, label, prop = self.arguments
+            if graph.create_fulltext(name, label, prop):
+                graph.counters["indexes_added"] += 1
+        elif self.kind == "index":
+            _, label, prop = self.arguments
+            if graph.create_index(label, prop):
+                graph.counters["indexes_added"] += 1
+        else:
+            _, label, prop = self.arguments
+            try:
+                if graph.create_constraint(label, prop):
+                    graph.counters["constraints_added"] += 1
+            except ConstraintViolation as e:
+                raise CypherError(str(e)) from None
+        return []
+
+
+# Parser
+
+def compiled(function, names, **info):
+    function.names = frozenset(names)
+    for key, value in info.items():
+        setattr(function, key, value)
+    return function
+
+
+def constant(value):
+    return compiled(lambda row, ctx: value, ())
+
+
+def variable(name):
+    def value(row, ctx):
+        try:
+            return row[name]
+        except KeyError:
+            raise CypherError(f"Variable `{name}` not defined") from None
+    return compiled(value, {name}, variable=name)
+
+
+def parameter(name):
+    def value(row, ctx):
+        try:
+            return ctx.params[name]
+        except KeyError:
+            raise CypherError(f"Expected parameter(s): {name}") from None
+    return compiled(value, ())
+
+
+def names_of(*values):
+    return frozenset().union(*(value.names for value in values if value is not None))
+
+
+COMPARISONS = {
+    "=": equals,
+    "<>": lambda a, b: None if (equal := equals(a, b)) is None else not equal,
+    "!=": lambda a, b: None if (equal := equals(a, b)) is None else not equal,
+    "<": lambda a, b: None if (order := compare(a, b)) is None else order < 0,
+    ">": lambda a, b: None if (order := compare(a, b)) is None else order > 0,
+    "<=": lambda a, b: None if (order := compare(a, b)) is None else order <= 0,
+    ">=": lambda a, b: None if (order := compare(a, b)) is None else order >= 0,
+    "=~": lambda a, b: None if a is None or b is None else re.fullmatch(b, a) is not None,
+    "STARTS WITH": lambda a, b: None if a is None or b is None else a.startswith(b),
+    "ENDS WITH": lambda a, b: None if a is None or b is None else a.endswith(b),
+    "CONTAINS": lambda a, b: None if a is None or b is None else b in a,
+}
+
+
+def lookup(value):
+    # (variable, property) of n.prop, or (variable, None) of id(n)
+    if getattr(value, "property_of", None):
+        return value.property_of
+    if getattr(value, "id_of", None):
+        return value.id_of, None
+    return None
+
+
+class Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+        self.anonymous = 0
+        self.aggregates = None
+
+    # Tokens
+
+    def peek(self, k=0):
+        return self.tokens[min(self.i + k, len(self.tokens) - 1)]
+
+    def advance(self):
+        token = self.peek()
+        self.i = min(self.i + 1, len(self.tokens) - 1)
+        return token
+
+    def error(self, message="Invalid input"):
+        token = self.peek()
+        raise CypherError(f"{message} at position {token.start}: {self.text[token.start:token.start + 40]!r}")
+
+    def at_keyword(self, word, k=0):
+        token = self.peek(k)
+        return token.kind == "name" and token.value.upper() == word
+
+    def accept_keyword(self, *words):
+        if all(self.at_keyword(word, k) for k, word in enumerate(words)):
+            self.i += len(words)
+            return True
+        return False
+
+    def expect_keyword(self, *words):
+        if not self.accept_keyword(*words):
+            self.error(f"Expected {' '.join(words)}")
+
+    def at_op(self, op, k=0):
+        token = self.peek(k)
+        return token.kind == "op" and token.value == op
+
+    def accept_op(self, op):
+        if self.at_op(op):
+            self.i += 1
+            return True
+        return False
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            self.error(f"Expected '{op}'")
+
+    def at_identifier(self, k=0):
+        return self.peek(k).kind in ("name", "quoted")
+
+    def identifier(self):
+        if not self.at_identifier():
+            self.error("Expected an identifier")
+        return self.advance().value
+
+    def anonymous_name(self):
+        self.anonymous += 1
+        return f" anonymous{self.anonymous}"
+
+    # Clauses
+
+    def parse(self):
+        statement = self.text.strip()
+        if re.match(r"CREATE\s+(CONSTRAINT|INDEX|FULLTEXT|RANGE|TEXT)\b", statement, re.I):
+            return SchemaCommand(statement)
+        clauses = []
+        while self.peek().kind != "end":
+            if self.accept_op(";"):
+                if self.peek().kind != "end":
+                    self.error("Only one statement can be run at a time")
+                break
+            clauses.append(self.parse_clause())
+        if not clauses:
+            self.error("Empty query")
+        return Query(clauses)
+
+    def parse_clause(self):
+        if self.accept_keyword("OPTIONAL", "MATCH"):
+            return self.parse_match(optional=True)
+        if self.accept_keyword("MATCH"):
+            return self.parse_match(optional=False)
+        if self.accept_keyword("UNWIND"):
+            value = self.parse_expression()
+            self.expect_keyword("AS")
+            return Unwind(value, self.identifier())
+        if self.accept_keyword("MERGE"):
+            path = self.parse_path()
+            on_create, on_match = [], []
+            while self.accept_keyword("ON"):
+                items = on_create if self.accept_keyword("CREATE") else on_match if self.accept_keyword("MATCH") \
+                    else self.error("Expected CREATE or MATCH")
+                self.expect_keyword("SET")
+                items.extend(self.parse_set_items())
+            return Merge(path, on_create, on_match)
+        if self.accept_keyword("CREATE"):
+            return Create(self.parse_paths())
+        if self.accept_keyword("SET"):
+            return Update(self.parse_set_items())
+        if self.accept_keyword("REMOVE"):
+            return Update(self.parse_remove_items())
+        detach = self.accept_keyword("DETACH")
+        if self.accept_keyword("DELETE"):
+            values = [self.parse_expression()]
+            while self.accept_op(","):
+                values.append(self.parse_expression())
+            return Delete(values, detach)
+        if detach:
+            self.error("Expected DELETE")
+        if self.accept_keyword("WITH"):
+            return self.parse_projection(is_return=False)
+        if self.accept_keyword("RETURN"):
+            return self.parse_projection(is_return=True)
+        if self.accept_keyword("CALL"):
+            return self.parse_call()
+        self.error("Unsupported clause")
+
+    def parse_match(self, optional):
+        paths = self.parse_paths()
+        where = self.parse_expression() if self.accept_keyword("WHERE") else None
+        return Match(paths, where, optional)
+
+    def parse_call(self):
+        if self.at_op("{"):
+            self.error("CALL subqueries are not supported by the memory backend")
+        name = self.dotted_name()
+        self.expect_op("(")
+        arguments = []
+        if not self.at_op(")"):
+            arguments.append(self.parse_expression())
+            while self.accept_op(","):
+                arguments.append(self.parse_expression())
+        self.expect_op(")")
+        yields, where = None, None
+        if self.accept_keyword("YIELD"):
+            yields = []
+            while True:
+                field = self.identifier()
+                yields.append((field, self.identifier() if self.accept_keyword("AS") else field))
+                if not self.accept_op(","):
+                    break
+            where = self.parse_expression() if self.accept_keyword("WHERE") else None
+        return Call(name, arguments, yields, where)
+
+    def dotted_name(self):
+        parts = [self.identifier()]
+        while self.at_op(".") and self.at_identifier(1):
+            self.advance()
+            parts.append(self.identifier())
+        return ".".join(parts)
+
+    def parse_projection(self, is_return):
+        distinct = self.accept_keyword("DISTINCT")
+        star = self.accept_op("*")
+        items = []
+        self.aggregates = []
+        if not star or self.accept_op(","):
+            while True:
+                start, count = self.peek().start, len(self.aggregates)
+                value = self.parse_expression()
+                end = self.tokens[self.i - 1].end
+                name = self.identifier() if self.accept_keyword("AS") else self.text[start:end].strip()
+                items.append((name, value, len(self.aggregates) > count))
+                if not self.accept_op(","):
+                    break
+        aggregates, self.aggregates = self.aggregates, None
+        order = []
+        if self.accept_keyword("ORDER", "BY"):
+            while True:
+                value = self.parse_expression()
+                descending = self.accept_keyword("DESC") or self.accept_keyword("DESCENDING")
+                if not descending:
+                    self.accept_keyword("ASC") or self.accept_keyword("ASCENDING")
+                order.append((value, descending))
+                if not self.accept_op(","):
+                    break
+        skip = self.parse_expression() if self.accept_keyword("SKIP") else None
+        limit = self.parse_expression() if self.accept_keyword("LIMIT") else None
+        where = self.parse_expression() if not is_return and self.accept_keyword("WHERE") else None
+        projection = Projection(items, star, distinct, aggregates, order, skip, limit, where)
+        projection.is_return = is_return
+        return projection
+
+    def parse_set_items(self):
+        items = []
+        while True:
+            var = self.identifier()
+            if self.at_op(":"):
+                items.append(self.label_update(var, self.parse_labels(), add=True))
+            elif self.accept_op("+=") or self.accept_op("="):
+                replace = self.tokens[self.i - 1].value == "="
+                items.append(self.map_update(var, self.parse_expression(), replace))
+            else:
+                self.expect_op(".")
+                name = self.identifier()
+                self.expect_op("=")
+                items.append(self.property_update(var, name, self.parse_expression()))
+            if not self.accept_op(","):
+                return items
+
+    def parse_remove_items(self):
+        items = []
+        while True:
+            var = self.identifier()
+            if self.at_op(":"):
+                items.append(self.label_update(var, self.parse_labels(), add=False))
+            else:
+                self.expect_op(".")
+                items.append(self.property_update(var, self.identifier(), constant(None)))
+            if not self.accept_op(","):
+                return items
+
+    def parse_labels(self):
+        labels = []
+        while self.accept_op(":"):
+            labels.append(self.identifier())
+        return labels
+
+    @staticmethod
+    def entity(var, row):
+        entity = row.get(var, MISSING)
+        if entity is MISSING:
+            raise CypherError(f"Variable `{var}` not defined")
+        if entity is not None and not isinstance(entity, Entity):
+            raise CypherError(f"Type mismatch: expected Node or Relationship but was {type_name(entity)}")
+        return entity
+
+    def property_update(self, var, name, value):
+        def update(row, ctx):
+            entity = self.entity(var, row)
+            if entity is not None:
+                ctx.graph.set_property(entity, name, check_value(value(row, ctx)))
+        return update
+
+    def map_update(self, var, value, replace):
+        def update(row, ctx):
+            entity = self.entity(var, row)
+            if entity is None:
+                return
+            props = value(row, ctx)
+            props = props.props if isinstance(props, Entity) else props or {}
+            if replace:
+                for name in set(entity.props) - set(props):
+                    ctx.graph.set_property(entity, name, None)
+            for name, item in props.items():
+                ctx.graph.set_property(entity, name, check_value(item))
+        return update
+
+    def label_update(self, var, labels, add):
+        def update(row, ctx):
+            node = self.entity(var, row)
+            if node is None:
+                return
+            for label in labels:
+                if add:
+                    ctx.graph.add_label(node, label)
+                else:
+                    ctx.graph.remove_label(node, label)
+        return update
+
+    # Patterns
+
+    def parse_paths(self):
+        paths = [self.parse_path()]
+        while self.accept_op(","):
+            paths.append(self.parse_path())
+        return paths
+
+    def parse_path(self):
+        if self.at_identifier() and self.at_op("=", 1):
+            self.error("Path variables are not supported by the memory backend")
+        nodes, rels = [self.parse_node_pattern()], []
+        while self.at_op("-") or self.at_op("<") and self.at_op("-", 1):
+            rels.append(self.parse_rel_pattern())
+            nodes.append(self.parse_node_pattern())
+        return PathPattern(nodes, rels)
+
+    def parse_node_pattern(self):
+        self.expect_op("(")
+        var = self.identifier() if self.at_identifier() else self.anonymous_name()
+        labels = self.parse_labels()
+        props = self.parse_pattern_properties()
+        self.expect_op(")")
+        return NodePattern(var, labels, props)
+
+    def parse_pattern_properties(self):
+        if self.at_op("{"):
+            return self.parse_map()
+        if self.peek().kind == "param":
+            return parameter(self.advance().value)
+        return None
+
+    def parse_rel_pattern(self):
+        left = self.accept_op("<")
+        self.expect_op("-")
+        var, types, props = None, [], None
+        if self.accept_op("["):
+            var = self.identifier() if self.at_identifier() else None
+            if self.accept_op(":"):
+                types.append(self.identifier())
+                while self.accept_op("|"):
+                    self.accept_op(":")
+                    types.append(self.identifier())
+            if self.at_op("*"):
+                self.error("Variable length relationships are not supported by the memory backend")
+            props = self.parse_pattern_properties()
+            self.expect_op("]")
+        self.expect_op("-")
+        right = self.accept_op(">")
+        if left and right:
+            self.error("A relationship cannot point both ways")
+        return RelPattern(var or self.anonymous_name(), types, props, "in" if left else "out" if right else "both")
+
+    def pattern_predicate(self, paths, where):
+        def exists(row, ctx):
+            return any(where is None or where(bindings, ctx) is True for bindings in match_paths(paths, row, ctx))
+        return compiled(exists, set().union(*(path.names for path in paths)) | names_of(where))
+
+    # Expressions
+
+    def parse_expression(self):
+        return self.parse_or()
+
+    def parse_or(self):
+        left = self.parse_xor()
+        while self.accept_keyword("OR"):
+            left = self.logical(left, self.parse_xor(), "OR")
+        return left
+
+    def parse_xor(self):
+        left = self.parse_and()
+        while self.accept_keyword("XOR"):
+            left = self.logical(left, self.parse_and(), "XOR")
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.accept_keyword("AND"):
+            right = self.parse_not()
+            conjuncts = getattr(left, "conjuncts", [left]) + getattr(right, "conjuncts", [right])
+            left = self.logical(left, right, "AND")
+            left.conjuncts = conjuncts
+        return left
+
+    @staticmethod
+    def logical(left, right, operator):
+        if operator == "AND":
+            def value(row, ctx):
+                a = truth(left(row, ctx), "AND")
+                if a is False:
+                    return False
+                b = truth(right(row, ctx), "AND")
+                return False if b is False else None if a is None or b is None else True
+        elif operator == "OR":
+            def value(row, ctx):
+                a = truth(left(row, ctx), "OR")
+                if a is True:
+                    return True
+                b = truth(right(row, ctx), "OR")
+                return True if b is True else None if a is None or b is None else False
+        else:
+            def value(row, ctx):
+                a, b = truth(left(row, ctx), "XOR"), truth(right(row, ctx), "XOR")
+                return None if a is None or b is None else a != b
+        return compiled(value, names_of(left, right))
+
+    def parse_not(self):
+        if self.accept_keyword("NOT"):
+            operand = self.parse_not()
+
+            def value(row, ctx):
+                result = truth(operand(row, ctx), "NOT")
+                return None if result is None else not result
+            return compiled(value, operand.names)
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_additive()
+        while True:
+            token = self.peek()
+            if token.kind == "op" and token.value in COMPARISONS:
+                operator = self.advance().value
+            elif self.accept_keyword("STARTS", "WITH"):
+                operator = "STARTS WITH"
+            elif self.accept_keyword("ENDS", "WITH"):
+                operator = "ENDS WITH"
+            elif self.accept_keyword("CONTAINS"):
+                operator = "CONTAINS"
+            elif self.accept_keyword("IN"):
+                operator = "IN"
+            elif self.accept_keyword("IS", "NOT", "NULL"):
+                left = self.null_check(left, negated=True)
+                continue
+            elif self.accept_keyword("IS", "NULL"):
+                left = self.null_check(left, negated=False)
+                continue
+            else:
+                return left
+            right = self.parse_additive()
+            left = self.comparison(operator, left, right)
+
+    @staticmethod
+    def null_check(operand, negated):
+        return compiled(lambda row, ctx: (operand(row, ctx) is None) != negated, operand.names)
+
+    @staticmethod
+    def comparison(operator, left, right):
+        lookups = []
+        if operator == "IN":
+            if lookup(left):
+                lookups.append((*lookup(left), "IN", right))
+
+            def value(row, ctx):
+                return contains(right(row, ctx), left(row, ctx))
+        else:
+            function = COMPARISONS[operator]
+            if operator == "=":
+                if lookup(left):
+                    lookups.append((*lookup(left), "=", right))
+                if lookup(right):
+                    lookups.append((*lookup(right), "=", left))
+
+            def value(row, ctx):
+                try:
+                    return function(left(row, ctx), right(row, ctx))
+                except (TypeError, AttributeError, re.error) as e:
+                    raise CypherError(f"Cannot apply {operator}: {e}") from None
+        return compiled(value, names_of(left, right), lookups=lookups)
+
+    def parse_additive(self):
+        left = self.parse_multiplicative()
+        while self.at_op("+") or self.at_op("-"):
+            operator = self.advance().value
+            right = self.parse_multiplicative()
+            left = self.binary(add if operator == "+" else arithmetic("-"), left, right)
+        return left
+
+    def parse_multiplicative(self):
+        left = self.parse_power()
+        while self.at_op("*") or self.at_op("/") or self.at_op("%"):
+            operator = self.advance().value
+            left = self.binary(arithmetic(operator), left, self.parse_power())
+        return left
+
+    def parse_power(self):
+        left = self.parse_unary()
+        while self.accept_op("^"):
+            left = self.binary(arithmetic("^"), left, self.parse_unary())
+        return left
+
+    @staticmethod
+    def binary(function, left, right):
+        return compiled(lambda row, ctx: function(left(row, ctx), right(row, ctx)), names_of(left, right))
+
+    def parse_unary(self):
+        if self.accept_op("-"):
+            operand = self.parse_unary()
+            return self.binary(arithmetic("-"), constant(0), operand)
+        self.accept_op("+")
+        return self.parse_postfix()
+
+    def parse_postfix(self):
+        value = self.parse_atom()
+        while True:
+            if self.at_op(".") and self.at_identifier(1):
+                self.advance()
+                value = self.property_access(value, self.identifier())
+            elif self.accept_op("["):
+                value = self.parse_subscript(value)
+            elif self.at_op(":") and self.at_identifier(1):
+                value = self.label_check(value, self.parse_labels())
+            elif self.at_op("{") and self.at_op(".", 1):
+                value = self.parse_map_projection(value)
+            else:
+                return value
+
+    @staticmethod
+    def property_access(target, name):
+        var = getattr(target, "variable", None)
+        return compiled(lambda row, ctx: get_property(target(row, ctx), name), target.names,
+                        property_of=(var, name) if var else None)
+
+    def parse_subscript(self, target):
+        start = None if self.at_op("..") else self.parse_expression()
+        if self.accept_op(".."):
+            end = None if self.at_op("]") else self.parse_expression()
+            self.expect_op("]")
+
+            def value(row, ctx):
+                values = target(row, ctx)
+                first = start(row, ctx) if start else None
+                last = end(row, ctx) if end else None
+                return None if values is None else values[first:last]
+            return compiled(value, names_of(target, start, end))
+        self.expect_op("]")
+
+        def value(row, ctx):
+            values, index = target(row, ctx), start(row, ctx)
+            if values is None or index is None:
+                return None
+            if isinstance(values, (dict, Entity)):
+                return get_property(values, index)
+            return values[index] if -len(values) <= index < len(values) else None
+        return compiled(value, names_of(target, start))
+
+    @staticmethod
+    def label_check(target, labels):
+        def value(row, ctx):
+            node = target(row, ctx)
+            return None if node is None else all(label in node.labels for label in labels)
+        return compiled(value, target.names)
+
+    def parse_map_projection(self, target):
+        self.expect_op("{")
+        names = []
+        while True:
+            self.expect_op(".")
+            names.append(self.identifier())
+            if not self.accept_op(","):
+                break
+        self.expect_op("}")
+
+        def value(row, ctx):
+            entity = target(row, ctx)
+            return None if entity is None else {name: get_property(entity, name) for name in names}
+        return compiled(value, target.names)
+
+    def parse_map(self):
+        self.expect_op("{")
+        entries = []
+        if not self.at_op("}"):
+            while True:
+                key = self.advance()
+                if key.kind not in ("name", "quoted", "string"):
+                    self.error("Expected a map key")
+                self.expect_op(":")
+                entries.append((key.value, self.parse_expression()))
+                if not self.accept_op(","):
+                    break
+        self.expect_op("}")
+        return compiled(lambda row, ctx: {key: value(row, ctx) for key, value in entries},
+                        names_of(*(value for _, value in entries)))
+
+    def parse_atom(self):
+        token = self.peek()
+        if token.kind in ("number", "string"):
+            return constant(self.advance().value)
+        if token.kind == "param":
+            return parameter(self.advance().value)
+        if self.at_op("["):
+            return self.parse_list()
+        if self.at_op("{"):
+            return self.parse_map()
+        if self.at_op("("):
+            return self.parse_parenthesized()
+        if token.kind == "quoted":
+            return variable(self.advance().value)
+        if token.kind != "name":
+            self.error()
+        word = token.value.upper()
+        if word in ("TRUE", "FALSE", "NULL"):
+            self.advance()
+            return constant({"TRUE": True, "FALSE": False, "NULL": None}[word])
+        if word == "CASE":
+            return self.parse_case()
+        if word == "EXISTS" and (self.at_op("{", 1) or self.at_op("(", 1)):
+            return self.parse_exists()
+        if word == "REDUCE" and self.at_op("(", 1):
+            return self.parse_reduce()
+        k = 1
+        while self.at_op(".", k) and self.at_identifier(k + 1):
+            k += 2
+        if self.at_op("(", k):
+            return self.parse_function()
+        return variable(self.advance().value)
+
+    def parse_parenthesized(self):
+        # A pattern such as (n)-[:R]->(m) is a predicate, anything else a parenthesized expression
+        start = self.i
+        try:
+            path = self.parse_path()
+            if path.rels:
+                return self.pattern_predicate([path], None)
+        except CypherError:
+            pass
+        self.i = start
+        self.expect_op("(")
+        value = self.parse_expression()
+        self.expect_op(")")
+        return value
+
+    def parse_list(self):
+        self.expect_op("[")
+        if self.at_identifier() and self.at_keyword("IN", 1):
+            var = self.identifier()
+            self.expect_keyword("IN")
+            source = self.parse_expression()
+            where = self.parse_expression() if self.accept_keyword("WHERE") else None
+            mapping = self.parse_expression() if self.accept_op("|") else None
+            self.expect_op("]")
+
+            def value(row, ctx):
+                values = source(row, ctx)
+                if values is None:
+                    return None
+                result = []
+                for item in values:
+                    scope = dict(row)
+                    scope[var] = item
+                    if where is None or where(scope, ctx) is True:
+                        result.append(item if mapping is None else mapping(scope, ctx))
+                return result
+            return compiled(value, source.names | (names_of(where, mapping) - {var}))
+        items = []
+        if not self.at_op("]"):
+            while True:
+                items.append(self.parse_expression())
+                if not self.accept_op(","):
+                    break
+        self.expect_op("]")
+        return compiled(lambda row, ctx: [item(row, ctx) for item in items], names_of(*items))
+
+    def parse_case(self):
+        self.expect_keyword("CASE")
+        subject = None if self.at_keyword("WHEN") else self.parse_expression()
+        branches = []
+        while self.accept_keyword("WHEN"):
+            condition = self.parse_expression()
+            self.expect_keyword("THEN")
+            branches.append((condition, self.parse_expression()))
+        default = self.parse_expression() if self.accept_keyword("ELSE") else None
+        self.expect_keyword("END")
+        if not branches:
+            self.error("Expected WHEN")
+
+        def value(row, ctx):
+            tested = subject(row, ctx) if subject is not None else None
+            for condition, result in branches:
+                if (equals(tested, condition(row, ctx)) if subject is not None else condition(row, ctx)) is True:
+                    return result(row, ctx)
+            return default(row, ctx) if default is not None else None
+        return compiled(value, names_of(subject, default, *(part for branch in branches for part in branch)))
+
+    def parse_exists(self):
+        self.expect_keyword("EXISTS")
+        if self.accept_op("{"):
+            self.accept_keyword("MATCH")
+            paths = self.parse_paths()
+            where = self.parse_expression() if self.accept_keyword("WHERE") else None
+            self.expect_op("}")
+            return self.pattern_predicate(paths, where)
+        self.expect_op("(")
+        path = self.parse_path()
+        self.expect_op(")")
+        return self.pattern_predicate([path], None)
+
+    def parse_reduce(self):
+        self.advance()
+        self.expect_op("(")
+        accumulator = self.identifier()
+        self.expect_op("=")
+        initial = self.parse_expression()
+        self.expect_op(",")
+        var = self.identifier()
+        self.expect_keyword("IN")
+        source = self.parse_expression()
+        self.expect_op("|")
+        step = self.parse_expression()
+        self.expect_op(")")
+
+        def value(row, ctx):
+            values = source(row, ctx)
+            if values is None:
+                return None
+            scope = dict(row)
+            scope[accumulator] = initial(row, ctx)
+            for item in values:
+                scope[var] = item
+                scope[accumulator] = step(scope, ctx)
+            return scope[accumulator]
+        return compiled(value, names_of(initial, source) | (step.names - {accumulator, var}))
+
+    def parse_function(self):
+        name = self.dotted_name()
+        key = name.lower()
+        self.expect_op("(")
+        distinct = self.accept_keyword("DISTINCT")
+        if key == "count" and self.accept_op("*"):
+            self.expect_op(")")
+            return self.aggregate(Count, constant(True), distinct=False)
+        arguments = []
+        if not self.at_op(")"):
+            while True:
+                arguments.append(self.parse_expression())
+                if not self.accept_op(","):
+                    break
+        self.expect_op(")")
+        if key in AGGREGATES:
+            if len(arguments) == 1:
+                argument = arguments[0]
+            else:
+                argument = compiled(lambda row, ctx: [value(row, ctx) for value in arguments], names_of(*arguments))
+            return self.aggregate(AGGREGATES[key], argument, distinct)
+        function = FUNCTIONS.get(key)
+        if function is None:
+            raise CypherError(f"Unknown function '{name}'")
+
+        def value(row, ctx):
+            values = [argument(row, ctx) for argument in arguments]
+            try:
+                return function(*values)
+            except (TypeError, ValueError, AttributeError, IndexError, re.error) as e:
+                raise CypherError(f"Failed to invoke function `{name}`: {e}") from None
+        id_of = getattr(arguments[0], "variable", None) if key == "id" and len(arguments) == 1 else None
+        return compiled(value, names_of(*arguments), id_of=id_of)
+
+    def aggregate(self, factory, argument, distinct):
+        if self.aggregates is None:
+            self.error("Invalid use of aggregating function")
+        index = len(self.aggregates)
+        self.aggregates.append(((lambda: Distinct(factory())) if distinct else factory, argument))
+        return compiled(lambda row, ctx: row[AGGREGATED][index], ())
+
+
+@lru_cache(maxsize=1024)
+def parse(text):
+    return Parser(text).parse()
+
+
+def run(graph, text, params=None):
+    """Records of the Cypher query text, run over graph with params."""
+    return parse(text).execute(Context(graph, params or {}))
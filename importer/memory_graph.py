@@ -0,0 +1,507 @@
+import logging
+import pickle
+import re
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import combinations
+
+
+class ConstraintViolation(Exception):
+    pass
+
+
+class Entity:
+    __slots__ = ("id", "props")
+
+    def __init__(self, entity_id):
+        self.id = entity_id
+        self.props = {}
+
+    def get(self, name, default=None):
+        return self.props.get(name, default)
+
+
+class Node(Entity):
+    __slots__ = ("labels",)
+
+    def __init__(self, node_id, labels):
+        super().__init__(node_id)
+        self.labels = set(labels)
+
+
+class Relationship(Entity):
+    __slots__ = ("type", "start", "end")
+
+    def __init__(self, rel_id, rel_type, start, end):
+        super().__init__(rel_id)
+        self.type = rel_type
+        self.start = start
+        self.end = end
+
+
+def hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class MemoryGraph:
+    """Property graph held in Python dicts, standing in for Neo4j in local runs.
+
+    Nodes are looked up by label and property through indexes built on first
+    use, or by CREATE INDEX and CREATE CONSTRAINT, and kept up to date by every
+    write. Writes are counted like neo4j.SummaryCounters so the import metrics
+    keep working, and logged while a transaction is open so that a failing
+    query leaves nothing behind. GDS projections live in `projections` and,
+    as in a restarted server, are not saved with the graph.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.counters = Counter()
+        self.projections = {}
+        self._nodes = {}
+        self._by_label = defaultdict(dict)
+        self._relationships = {}
+        self._out = defaultdict(dict)
+        self._in = defaultdict(dict)
+        self._indexes = {}
+        self._indexed = defaultdict(set)
+        self._unique = set()
+        self._fulltext = {}
+        self._next_id = 0
+        self._undo = None
+
+    # Transactions
+
+    @contextmanager
+    def transaction(self):
+        """Writes of the block, undone if it raises; nested blocks are part of the outer one."""
+        with self.lock:
+            if self._undo is not None:
+                yield
+                return
+            self._undo, counters = [], self.counters.copy()
+            try:
+                yield
+            except BaseException:
+                undo, self._undo = self._undo, None
+                for action in reversed(undo):
+                    action()
+                self.counters = counters
+                raise
+            finally:
+                self._undo = None
+
+    def _log(self, action):
+        if self._undo is not None:
+            self._undo.append(action)
+
+    # Nodes
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def create_node(self, labels, props=None):
+        node = Node(self._new_id(), labels)
+        node.props.update(props or {})
+        self._insert_node(node)
+        self._log(lambda: self._remove_node(node))
+        self.counters["nodes_created"] += 1
+        self.counters["labels_added"] += len(node.labels)
+        self.counters["properties_set"] += len(node.props)
+        for label in node.labels:
+            for name in node.props:
+                self._check_unique(label, name, node)
+        return node
+
+    def _insert_node(self, node):
+        self._nodes[node.id] = node
+        for label in node.labels:
+            self._by_label[label][node.id] = node
+            for name in self._indexed[label]:
+                self._index_add(label, name, node)
+        self._fulltext_update(node)
+
+    def _remove_node(self, node):
+        self._nodes.pop(node.id, None)
+        for label in node.labels:
+            self._by_label[label].pop(node.id, None)
+            for name in self._indexed[label]:
+                self._index_remove(label, name, node)
+        for index in self._fulltext.values():
+            index.remove(node)
+
+    def node(self, label, value, key="id"):
+        nodes = self.find_nodes(label, {key: value})
+        return nodes[0] if nodes else None
+
+    def merge_node(self, label, value, key="id"):
+        return self.node(label, value, key) or self.create_node([label], {key: value})
+
+    def nodes(self, label=None):
+        with self.lock:
+            if label is None:
+                return list(self._nodes.values())
+            return list(self._by_label.get(label, {}).values())
+
+    def count(self, label):
+        return len(self._by_label.get(label, ()))
+
+    def get_node(self, node_id):
+        return self._nodes.get(node_id)
+
+    def find_nodes(self, label, props):
+        """Nodes of label having all of props, looked up in the index of the first property."""
+        name, value = next(iter(props.items()))
+        if value is None or any(v is None for v in props.values()):
+            return []
+        if hashable(value):
+            candidates = self.index(label, name).get(value, {}).values()
+        else:
+            candidates = self._by_label.get(label, {}).values()
+        return [node for node in candidates if all(node.props.get(k) == v for k, v in props.items())]
+
+    def add_label(self, node, label):
+        if label in node.labels:
+            return
+        node.labels.add(label)
+        self._by_label[label][node.id] = node
+        for name in self._indexed[label]:
+            self._index_add(label, name, node)
+        self._fulltext_update(node)
+        self._log(lambda: self._remove_label(node, label))
+        self.counters["labels_added"] += 1
+        for name in node.props:
+            self._check_unique(label, name, node)
+
+    def remove_label(self, node, label):
+        if label not in node.labels:
+            return
+        self._remove_label(node, label)
+        self._log(lambda: self.add_label(node, label))
+        self.counters["labels_removed"] += 1
+
+    def _remove_label(self, node, label):
+        node.labels.discard(label)
+        self._by_label[label].pop(node.id, None)
+        for name in self._indexed[label]:
+            self._index_remove(label, name, node)
+        for index in self._fulltext.values():
+            if index.label == label:
+                index.remove(node)
+
+    def set(self, entity, **props):
+        for name, value in props.items():
+            self.set_property(entity, name, value)
+
+    def set_property(self, entity, name, value):
+        # Cypher semantics: setting null removes the property
+        missing = name not in entity.props
+        old = entity.props.get(name)
+        self._write_property(entity, name, value)
+        self._log(lambda: self._write_property(entity, name, None if missing else old))
+        self.counters["properties_set"] += 1
+        if isinstance(entity, Node) and value is not None:
+            for label in entity.labels:
+                self._check_unique(label, name, entity)
+
+    def _write_property(self, entity, name, value):
+        node = entity if isinstance(entity, Node) and entity.id in self._nodes else None
+        if node is not None:
+            for label in node.labels:
+                if name in self._indexed[label]:
+                    self._index_remove(label, name, node)
+        if value is None:
+            entity.props.pop(name, None)
+        else:
+            entity.props[name] = value
+        if node is not None:
+            for label in node.labels:
+                if name in self._indexed[label]:
+                    self._index_add(label, name, node)
+            self._fulltext_update(node, name)
+
+    def delete_node(self, node, detach=True):
+        """DETACH DELETE node, or DELETE when it has no relationships."""
+        if node.id not in self._nodes:
+            return
+        rels = {rel.id: rel for rel in self.relationships(node)}
+        if rels and not detach:
+            raise ConstraintViolation(f"Cannot delete node<{node.id}>, because it still has relationships. "
+                                      f"To delete this node, you must first delete its relationships.")
+        for rel in rels.values():
+            self.delete_relationship(rel)
+        self._remove_node(node)
+        self._log(lambda: self._insert_node(node))
+        self.counters["nodes_deleted"] += 1
+
+    def merge_nodes(self, target, others, properties="discard"):
+        """Move the relationships of others to target and delete them, like apoc.refactor.mergeNodes.
+
+        Labels are combined, and properties missing from target are taken from
+        the others, which override it with properties="overwrite". With the
+        relationships moved, those of the same type and end points are merged,
+        and those between the merged nodes are dropped.
+        """
+        merged = {node.id for node in others} | {target.id}
+        for other in others:
+            if other is target:
+                continue
+            for label in other.labels:
+                self.add_label(target, label)
+            for name, value in other.props.items():
+                if properties == "overwrite" or name not in target.props:
+                    self.set_property(target, name, value)
+            for rel in {rel.id: rel for rel in self.relationships(other)}.values():
+                if rel.start.id in merged and rel.end.id in merged:
+                    continue
+                start = target if rel.start is other else rel.start
+                end = target if rel.end is other else rel.end
+                existing = [r for r in self._out.get(start.id, {}).values() if r.type == rel.type and r.end is end]
+                if not existing:
+                    self.create_relationship(start, rel.type, end, rel.props)
+            self.delete_node(other)
+
+    # Indexes
+
+    def index(self, label, name):
+        key = (label, name)
+        if key not in self._indexes:
+            self._indexes[key] = defaultdict(dict)
+            self._indexed[label].add(name)
+            for node in self._by_label.get(label, {}).values():
+                self._index_add(label, name, node)
+        return self._indexes[key]
+
+    def create_index(self, label, name):
+        created = (label, name) not in self._indexes
+        self.index(label, name)
+        return created
+
+    def create_constraint(self, label, name):
+        created = (label, name) not in self._unique
+        index = self.index(label, name)
+        for value, nodes in index.items():
+            if len(nodes) > 1:
+                raise ConstraintViolation(f"Unable to create the constraint, {len(nodes)} {label} nodes have "
+                                          f"{name} = {value!r}")
+        self._unique.add((label, name))
+        return created
+
+    def _index_add(self, label, name, node):
+        value = node.props.get(name)
+        if value is not None and hashable(value):
+            self._indexes[(label, name)][value][node.id] = node
+
+    def _index_remove(self, label, name, node):
+        value = node.props.get(name)
+        if value is not None and hashable(value):
+            entries = self._indexes[(label, name)]
+            entries.get(value, {}).pop(node.id, None)
+            if value in entries and not entries[value]:
+                del entries[value]
+
+    def _check_unique(self, label, name, node):
+        if (label, name) in self._unique and len(self._indexes[(label, name)].get(node.props.get(name), ())) > 1:
+            raise ConstraintViolation(f"Node({node.id}) already exists with label `{label}` and property "
+                                      f"`{name}` = {node.props.get(name)!r}")
+
+    # Relationships
+
+    def create_relationship(self, start, rel_type, end, props=None):
+        rel = Relationship(self._new_id(), rel_type, start, end)
+        rel.props.update(props or {})
+        self._insert_relationship(rel)
+        self._log(lambda: self._remove_relationship(rel))
+        self.counters["relationships_created"] += 1
+        self.counters["properties_set"] += len(rel.props)
+        return rel
+
+    def merge_relationship(self, start, rel_type, end, **key_props):
+        """Return the relationship matching the pattern, creating it if needed, and whether it was created."""
+        for rel in self._out.get(start.id, {}).values():
+            if rel.type == rel_type and rel.end is end and all(rel.props.get(k) == v for k, v in key_props.items()):
+                return rel, False
+        return self.create_relationship(start, rel_type, end, key_props), True
+
+    def _insert_relationship(self, rel):
+        self._relationships[rel.id] = rel
+        self._out[rel.start.id][rel.id] = rel
+        self._in[rel.end.id][rel.id] = rel
+
+    def _remove_relationship(self, rel):
+        self._relationships.pop(rel.id, None)
+        self._out[rel.start.id].pop(rel.id, None)
+        self._in[rel.end.id].pop(rel.id, None)
+
+    def delete_relationship(self, rel):
+        if rel.id not in self._relationships:
+            return
+        self._remove_relationship(rel)
+        self._log(lambda: self._insert_relationship(rel))
+        self.counters["relationships_deleted"] += 1
+
+    def relationships(self, node, rel_type=None, direction="both"):
+        rels = []
+        if direction in ("out", "both"):
+            rels.extend(self._out.get(node.id, {}).values())
+        if direction in ("in", "both"):
+            rels.extend(self._in.get(node.id, {}).values())
+        return [rel for rel in rels if rel_type is None or rel.type == rel_type]
+
+    def neighbors(self, node, rel_type=None, direction="both"):
+        return [rel.end if rel.start is node else rel.start for rel in self.relationships(node, rel_type, direction)]
+
+    def all_relationships(self, rel_type=None):
+        with self.lock:
+            return [rel for rel in self._relationships.values() if rel_type is None or rel.type == rel_type]
+
+    # Fulltext indexes
+
+    def fulltext(self, name, label, prop):
+        """Create the fulltext index `name` over `prop` of `label` nodes, like CREATE FULLTEXT INDEX."""
+        if name not in self._fulltext:
+            index = FulltextIndex(label, prop)
+            for node in self.nodes(label):
+                index.add(node)
+            self._fulltext[name] = index
+        return self._fulltext[name]
+
+    def create_fulltext(self, name, label, prop):
+        created = name not in self._fulltext
+        self.fulltext(name, label, prop)
+        return created
+
+    def query_fulltext(self, name, query):
+        if name not in self._fulltext:
+            raise KeyError(f"There is no such fulltext schema index: {name}")
+        return self._fulltext[name].query(query)
+
+    def _fulltext_update(self, node, prop=None):
+        for index in self._fulltext.values():
+            if index.label in node.labels and (prop is None or index.prop == prop):
+                index.add(node)
+
+    # Persistence
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump({name: value for name, value in self.__dict__.items()
+                         if name not in ("lock", "projections", "_undo")}, f)
+
+    @classmethod
+    def load(cls, path):
+        graph = cls()
+        with open(path, "rb") as f:
+            graph.__dict__.update(pickle.load(f))
+        logging.info(f"Loaded {len(graph._nodes)} nodes and {len(graph._relationships)} relationships from {path}")
+        return graph
+
+
+def to_set(values):
+    # apoc.coll.toSet: distinct values in first-seen order, without nulls
+    return list(dict.fromkeys(value for value in values if value is not None))
+
+
+def float_to_edits(similarity, length):
+    # Lucene FuzzyQuery.floatToEdits, used for the legacy term~0.65 syntax
+    if similarity >= 1:
+        return min(int(similarity), 2)
+    if similarity == 0:
+        return 0
+    return min(int((1 - similarity) * length), 2)
+
+
+def edit_distance(a, b, limit):
+    """Damerau (optimal string alignment) distance, or limit + 1 once it is exceeded."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+QUERY_TERM = re.compile(r"^(?P<term>.+?)(?:~(?P<similarity>[0-9.]+))?$")
+
+
+class FulltextIndex:
+    """Lowercased word index with fuzzy term lookup, like a standard-analyzer Lucene index.
+
+    Terms within the allowed edit distance are found through the terms that
+    share a deletion variant with them, then checked with the exact distance.
+    """
+
+    def __init__(self, label, prop):
+        self.label = label
+        self.prop = prop
+        self.postings = defaultdict(set)
+        self.variants = defaultdict(set)
+        self._documents = {}
+        self._cache = {}
+
+    @staticmethod
+    def _deletions(term, edits):
+        variants = {term}
+        for count in range(1, min(edits, len(term)) + 1):
+            for positions in combinations(range(len(term)), count):
+                variants.add("".join(c for i, c in enumerate(term) if i not in positions))
+        return variants
+
+    def add(self, node):
+        self.remove(node)
+        value = node.get(self.prop)
+        tokens = set(TOKEN.findall(value.lower())) if isinstance(value, str) else set()
+        self._documents[node.id] = tokens
+        for token in tokens:
+            if token not in self.postings or not self.postings[token]:
+                for variant in self._deletions(token, 2):
+                    self.variants[variant].add(token)
+            self.postings[token].add(node)
+        self._cache.clear()
+
+    def remove(self, node):
+        for token in self._documents.pop(node.id, ()):
+            self.postings[token].discard(node)
+        self._cache.clear()
+
+    def matching_terms(self, term, edits):
+        key = (term, edits)
+        if key not in self._cache:
+            candidates = set()
+            for variant in self._deletions(term, edits):
+                candidates |= self.variants.get(variant, set())
+            self._cache[key] = [token for token in candidates if edit_distance(term, token, edits) <= edits]
+        return self._cache[key]
+
+    def query(self, query):
+        """Nodes matching every term of a `word~0.65 AND word~0.65` query."""
+        result = None
+        for clause in query.split(" AND "):
+            match = QUERY_TERM.match(clause.strip().lower())
+            if not match:
+                continue
+            term = match.group("term")
+            similarity = match.group("similarity")
+            edits = float_to_edits(float(similarity), len(term)) if similarity else 0
+            nodes = set()
+            for token in self.matching_terms(term, edits):
+                nodes |= self.postings[token]
+            result = nodes if result is None else result & nodes
+            if not result:
+                return []
+        return sorted(result or (), key=lambda node: node.id)
@@ -0,0 +1,133 @@
+import logging
+import os
+
+from importer.memory_cypher import run
+from importer.memory_graph import MemoryGraph
+from importer.neo4j_importer import Neo4jBaseImporter
+from importer.metrics import COUNTERS
+
+
+class MemoryCounters:
+    def __init__(self, counts):
+        for name in COUNTERS:
+            setattr(self, name, counts.get(name, 0))
+
+
+class MemorySummary:
+    def __init__(self, counts):
+        self.counters = MemoryCounters(counts)
+
+
+class MemoryRecord(dict):
+    # neo4j.Record: values by key or position
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+    def data(self):
+        return dict(self)
+
+
+class MemoryResult:
+    def __init__(self, records=(), counts=None):
+        self._records = [MemoryRecord(record) for record in records]
+        self._summary = MemorySummary(counts or {})
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def single(self):
+        return self._records[0] if self._records else None
+
+    def data(self):
+        return [record.data() for record in self._records]
+
+    def consume(self):
+        return self._summary
+
+
+class MemorySession:
+    """The part of neo4j.Session used by the importers, running their Cypher over a MemoryGraph."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        parameters = {**(parameters or {}), **kwargs}
+        # Every query is a transaction of its own, unless it is run inside execute_write
+        with self.graph.transaction():
+            before = self.graph.counters.copy()
+            records = run(self.graph, str(query), parameters)
+            counts = self.graph.counters - before
+        return MemoryResult(records, counts)
+
+    def execute_write(self, work, *args, **kwargs):
+        # One transaction at a time, holding the graph lock, and rolled back if work raises
+        with self.graph.transaction():
+            return work(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+
+class MemoryDriver:
+    """Stands in for neo4j.Driver; the graph is loaded from graph_file on first use and saved on close."""
+
+    def __init__(self, graph=None, graph_file=None):
+        self._graph = graph
+        self.graph_file = graph_file
+
+    @property
+    def graph(self) -> MemoryGraph:
+        if self._graph is None:
+            if self.graph_file and os.path.isfile(self.graph_file):
+                self._graph = MemoryGraph.load(self.graph_file)
+            else:
+                self._graph = MemoryGraph()
+        return self._graph
+
+    def session(self, **kwargs):
+        return MemorySession(self.graph)
+
+    def close(self):
+        if self.graph_file and self._graph is not None:
+            self._graph.save(self.graph_file)
+            logging.info(f"Memory graph saved to {self.graph_file}")
+
+
+class MemoryGraphImporter(Neo4jBaseImporter):
+    """Run the importers against an in-process MemoryGraph instead of a Neo4j server.
+
+    The driver stands in for neo4j.Driver, and its sessions run the Cypher of
+    the factories, APOC, GDS and fulltext procedures included, with the
+    interpreter of importer.memory_cypher, so every stage runs the same
+    queries as online. With graph_file, the graph is loaded before the run
+    and saved when the driver is closed, so separate steps can build on each
+    other.
+    """
+
+    checkpoint_backend = "memory"
+
+    def __init__(self, driver=None):
+        super().__init__(driver=driver or MemoryDriver())
+
+    @property
+    def graph_file(self):
+        return self._driver.graph_file
+
+    @graph_file.setter
+    def graph_file(self, path):
+        self._driver.graph_file = path
+
+    @property
+    def graph(self) -> MemoryGraph:
+        return self._driver.graph
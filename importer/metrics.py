@@ -0,0 +1,139 @@
+import csv
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+# Attributes of neo4j.SummaryCounters summed per stage
+COUNTERS = (
+    "nodes_created",
+    "nodes_deleted",
+    "relationships_created",
+    "relationships_deleted",
+    "properties_set",
+    "labels_added",
+    "labels_removed",
+    "indexes_added",
+    "constraints_added",
+)
+
+
+class ImportMetrics:
+    """Per-batch timings and write counters of one import run, aggregated per stage."""
+
+    def __init__(self, importer):
+        self.importer = importer
+        self.started = datetime.now()
+        self.batches = []
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record_batch(self, stage, query, rows, seconds, summary=None, failed=False):
+        counters = summary.counters if summary is not None else None
+        entry = {
+            "stage": stage,
+            "query": " ".join(query.split())[:120],
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_second": rows / seconds if seconds > 0 else None,
+            "failed": failed,
+        }
+        entry.update({name: getattr(counters, name, 0) if counters else 0 for name in COUNTERS})
+
+        with self._lock:
+            self.batches.append(entry)
+            stats = self.stages.setdefault(stage, self._empty_stage())
+            stats["batches"] += 1
+            stats["failed_batches"] += int(failed)
+            stats["rows"] += rows
+            stats["batch_seconds"] += seconds
+            for name in COUNTERS:
+                stats[name] += entry[name]
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            self.stages.setdefault(stage, self._empty_stage())["wall_seconds"] = seconds
+
+    def record_cache(self, stage, hits, misses):
+        with self._lock:
+            stats = self.stages.setdefault(stage, self._empty_stage())
+            stats["cache_hits"] += hits
+            stats["cache_misses"] += misses
+
+    def stage_summary(self, stage):
+        stats = self.stages.get(stage)
+        if not stats:
+            return None
+        rate = stats["rows"] / stats["batch_seconds"] if stats["batch_seconds"] > 0 else 0
+        return (f"{stage}: {stats['rows']} rows in {stats['batches']} batches, {stats['batch_seconds']:.1f}s "
+                f"({rate:,.0f} rows/s), {stats['nodes_created']} nodes and "
+                f"{stats['relationships_created']} relationships created, {stats['properties_set']} properties set")
+
+    def report(self):
+        stages = {}
+        for stage, stats in self.stages.items():
+            stats = dict(stats)
+            seconds = stats["wall_seconds"] or stats["batch_seconds"]
+            stats["rows_per_second"] = stats["rows"] / seconds if seconds > 0 else None
+            lookups = stats["cache_hits"] + stats["cache_misses"]
+            stats["cache_hit_rate"] = stats["cache_hits"] / lookups if lookups else None
+            stages[stage] = stats
+        return {
+            "importer": self.importer,
+            "started": self.started.isoformat(timespec="seconds"),
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "stages": stages,
+        }
+
+    def write(self, directory, prometheus=False):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = f"{self.importer}_{self.started:%Y%m%d_%H%M%S}"
+
+        paths = [directory / f"{name}.json", directory / f"{name}.csv"]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+        with open(paths[1], "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["stage", "query", "rows", "seconds", "rows_per_second", "failed",
+                                                   *COUNTERS])
+            writer.writeheader()
+            writer.writerows(self.batches)
+
+        if prometheus:
+            paths.append(directory / f"{name}.prom")
+            with open(paths[2], "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+
+        return paths
+
+    def to_prometheus(self):
+        metrics = {
+            "klab_import_rows_total": ("counter", "Rows sent to the database", "rows"),
+            "klab_import_batches_total": ("counter", "Batches sent to the database", "batches"),
+            "klab_import_failed_batches_total": ("counter", "Batches written to the dead-letter file",
+                                                 "failed_batches"),
+            "klab_import_batch_seconds_total": ("counter", "Time spent in batch transactions", "batch_seconds"),
+            "klab_import_stage_seconds": ("gauge", "Wall time of the stage", "wall_seconds"),
+            "klab_import_cache_hits_total": ("counter", "Similarity scores found in the cache", "cache_hits"),
+            "klab_import_cache_misses_total": ("counter", "Similarity scores computed and cached", "cache_misses"),
+        }
+        metrics.update({f"klab_import_{name}_total": ("counter", f"Sum of {name} counters", name)
+                        for name in COUNTERS})
+
+        lines = []
+        for metric, (kind, help_text, field) in metrics.items():
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for stage, stats in self.stages.items():
+                if stats[field] is None:
+                    continue
+                lines.append(f'{metric}{{importer="{self.importer}",stage="{stage}"}} {stats[field]}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _empty_stage():
+        stats = {"batches": 0, "failed_batches": 0, "rows": 0, "batch_seconds": 0.0, "wall_seconds": None,
+                 "cache_hits": 0, "cache_misses": 0}
+        stats.update({name: 0 for name in COUNTERS})
+        return stats
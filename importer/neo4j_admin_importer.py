@@ -0,0 +1,294 @@
+import csv
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+from importer.neo4j_importer import Neo4jBaseImporter
+from util.frame_utils import column_values, display_name
+
+IMPORT_SCRIPT = "import.sh"
+MANIFEST = "manifest.json"
+MERGED_DIR = "merged"
+
+
+def _value_type(value):
+    # Same types the driver would send for these Python values online
+    if isinstance(value, list):
+        return f"{_property_type(value) or 'string'}[]"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, datetime):
+        return "localdatetime"
+    if isinstance(value, date):
+        return "date"
+    return "string"
+
+
+def _widen(first, second):
+    # Narrowest type holding the values of both, None standing for no value yet
+    if first is None or first == second:
+        return second
+    if second is None:
+        return first
+    if first.endswith("[]") and second.endswith("[]"):
+        return f"{_widen(first[:-2], second[:-2])}[]"
+    if {first, second} == {"long", "double"}:
+        return "double"
+    return "string"
+
+
+def _property_type(values):
+    property_type, lists = None, False
+    for value in values:
+        if value is not None and value != []:
+            property_type = _widen(property_type, _value_type(value))
+        lists = lists or value == []
+    # Empty lists alone still make an array column
+    return property_type or ("string[]" if lists else None)
+
+
+class Neo4jAdminImporter(Neo4jBaseImporter):
+    """Write node and relationship CSVs for `neo4j-admin database import full`.
+
+    Factories opt in stage by stage with a bulk_<stage> method that builds the
+    rows of that stage and hands them to write_nodes and write_relationships.
+    Every node file has an :ID column in the id space of its label, and rows
+    whose id or relationship was already written are dropped, like MERGE would.
+    Headers go to their own file, rewritten whenever later rows widen a type.
+    Nodes and relationships written by several importers, such as
+    organizations from both contracts and licenses, are merged into one file
+    the way the online MERGEs would: list properties are unioned in file
+    order, other properties come from the file written last, and
+    derived_properties are computed again from the merged lists. The write
+    order of the files is kept in a manifest, each file moving to its end
+    when a run writes it again.
+    Stages without a bulk form, such as constraints or steps that read nodes
+    created by other importers, are left out of the checkpoint, so running the
+    online importer afterwards with --resume runs only those.
+    """
+
+    # Node properties computed from a merged list property, by label
+    derived_properties = {"Organization": {"name": ("names", display_name)}}
+
+    def __init__(self, driver=None):
+        super().__init__(driver=driver)
+        self.output_dir = "bulk"
+        self.array_delimiter = "|"
+        self._written = {}
+        self._headers = {}
+
+    def run_stage(self, stage, *args, **kwargs):
+        name = stage.__name__
+        bulk = getattr(self, f"bulk_{name}", None)
+        if bulk is None:
+            logging.info(f"Stage {name} has no bulk form, run it online afterwards with --resume")
+            return None
+        if self.checkpoints.is_completed(name):
+            logging.info(f"Skipping completed stage {name}")
+            return None
+
+        start = time.perf_counter()
+        try:
+            result = bulk(*args, **kwargs)
+        finally:
+            self.metrics.record_stage(name, time.perf_counter() - start)
+        self.checkpoints.complete(name)
+        return result
+
+    def store_batches(self, query, batches, **kwargs):
+        raise RuntimeError("The neo4j-admin backend writes files, Cypher batches run with the neo4j backend")
+
+    def write_nodes(self, name: str, label: str, frame):
+        """Append the rows of frame to the node file of name; frame must have an id column."""
+        frame = frame[frame["id"].notna()].drop_duplicates("id")
+        path = self._path("nodes", label, name)
+        ids = [self._format(value) for value in column_values(frame["id"])]
+        keep = [node_id not in self._seen(path) for node_id in ids]
+        frame, ids = frame[keep], [node_id for node_id, new in zip(ids, keep) if new]
+        self._seen(path).update(ids)
+        self._append(path, [f":ID({label})"], [ids], frame, len(frame))
+
+    def write_relationships(self, name: str, rel_type: str, frame, start_label: str, end_label: str):
+        """Append the rows of frame to the relationship file of name; frame must have start and end columns."""
+        frame = frame[frame["start"].notna() & frame["end"].notna()]
+        path = self._path("relationships", rel_type, name)
+        starts = [self._format(value) for value in column_values(frame["start"])]
+        ends = [self._format(value) for value in column_values(frame["end"])]
+        # Relationships are merged online, so a pair is written once, with its first properties
+        keys = list(zip(starts, ends))
+        keep, seen = [], self._seen(path)
+        for key in keys:
+            keep.append(key not in seen)
+            seen.add(key)
+        frame = frame[keep].drop(columns=["start", "end"])
+        starts = [value for value, new in zip(starts, keep) if new]
+        ends = [value for value, new in zip(ends, keep) if new]
+        self._append(path, [f":START_ID({start_label})", f":END_ID({end_label})"], [starts, ends], frame, len(frame))
+
+    def _path(self, kind, name, file_name):
+        return Path(self.output_dir) / f"{kind}.{name}.{file_name}.csv"
+
+    @staticmethod
+    def _header_path(path):
+        return path.with_name(f"{path.stem}.header.csv")
+
+    def _seen(self, path):
+        return self._written.setdefault(path, set())
+
+    def _format(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, list):
+            return self.array_delimiter.join(self._format(item) for item in value)
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        if isinstance(value, bool):
+            return str(value).lower()
+        return str(value)
+
+    def _append(self, path, id_header, id_values, frame, rows):
+        columns = [column_values(frame[column]) for column in frame.columns]
+        new = path not in self._headers
+        if new:
+            # Files are written from scratch by every run
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("", encoding="utf-8")
+            self._record_write(path)
+            self._headers[path] = (id_header, list(frame.columns), [None] * len(columns))
+        _, names, types = self._headers[path]
+        widened = [_widen(current, _property_type(values)) for current, values in zip(types, columns)]
+        if new or widened != types:
+            self._headers[path] = (id_header, names, widened)
+            self._write_header(path)
+        if not rows:
+            return
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            for row in zip(*id_values, *columns):
+                writer.writerow([self._format(value) for value in row])
+        logging.info(f"Wrote {rows} rows to {path}")
+
+    def _read_manifest(self):
+        path = Path(self.output_dir) / MANIFEST
+        if not path.is_file():
+            return []
+        return json.loads(path.read_text(encoding="utf-8"))
+
+    def _record_write(self, path):
+        order = [name for name in self._read_manifest() if name != path.name]
+        order.append(path.name)
+        (Path(self.output_dir) / MANIFEST).write_text(json.dumps(order, indent=2), encoding="utf-8")
+
+    def _write_header(self, path):
+        id_header, names, types = self._headers[path]
+        # Columns without any value yet are typed as strings, like the values neo4j-admin would read
+        header = id_header + [f"{name}:{property_type or 'string'}" for name, property_type in zip(names, types)]
+        with open(self._header_path(path), "w", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerow(header)
+
+    def close(self):
+        self.write_import_script()
+        super().close()
+
+    def _read_part(self, path):
+        with open(self._header_path(path), encoding="utf-8", newline="") as f:
+            header = next(csv.reader(f))
+        with open(path, encoding="utf-8", newline="") as f:
+            return header, list(csv.reader(f))
+
+    def merge_parts(self, kind, name, parts):
+        """Merge the files written for the same label or relationship type by several importers.
+
+        Each merged row goes to the file of the last part it was found in,
+        with the types of that part, so ids keep the type they have online.
+        """
+        directory = Path(self.output_dir) / MERGED_DIR
+        keys = 1 if kind == "nodes" else 2
+        id_headers, part_types, columns, rows, owners = [], [], {}, {}, {}
+        for index, part in enumerate(parts):
+            header, part_rows = self._read_part(part)
+            id_headers.append(header[:keys])
+            types = dict(column.rpartition(":")[::2] for column in header[keys:])
+            part_types.append(types)
+            for column_name, property_type in types.items():
+                columns[column_name] = _widen(columns.get(column_name), property_type)
+            for row in part_rows:
+                key = tuple(row[:keys])
+                properties = rows.setdefault(key, {})
+                owners[key] = index
+                for column_name, value in zip(types, row[keys:]):
+                    if columns[column_name].endswith("[]") and properties.get(column_name):
+                        # Union in order of appearance, like apoc.coll.toSet on the concatenated lists
+                        values = properties[column_name].split(self.array_delimiter)
+                        values += [item for item in value.split(self.array_delimiter) if item and item not in values]
+                        value = self.array_delimiter.join(values)
+                    properties[column_name] = value
+
+        derived = self.derived_properties.get(name, {}) if kind == "nodes" else {}
+        directory.mkdir(parents=True, exist_ok=True)
+        for stale in directory.glob(f"{kind}.{name}.*.csv"):
+            stale.unlink()
+        files = []
+        for index, part in enumerate(parts):
+            path = directory / part.name
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(id_headers[index] + [f"{column_name}:{part_types[index].get(column_name, property_type)}"
+                                                     for column_name, property_type in columns.items()])
+                for key, properties in rows.items():
+                    if owners[key] != index:
+                        continue
+                    for column_name, (source, derive) in derived.items():
+                        if column_name in columns and properties.get(source):
+                            properties[column_name] = derive(properties[source].split(self.array_delimiter)) or ""
+                    writer.writerow(list(key) + [properties.get(column_name, "") for column_name in columns])
+            files.append(path)
+        logging.info(f"Merged {len(rows)} {name} {kind} of {len(parts)} files into {directory}")
+        return files
+
+    def write_import_script(self):
+        # Lists every file in the output directory, so importers can be run one after the other
+        directory = Path(self.output_dir)
+        if not directory.is_dir():
+            return
+        groups = {}
+        for path in sorted(directory.glob("*.csv")):
+            if path.name.endswith(".header.csv") or not self._header_path(path).exists():
+                continue
+            kind, name, _ = path.name.split(".", 2)
+            groups.setdefault((kind, name), []).append(path)
+        order = {file_name: index for index, file_name in enumerate(self._read_manifest())}
+        options = []
+        for (kind, name), parts in groups.items():
+            if len(parts) == 1:
+                files = [f"{self._header_path(parts[0]).name},{parts[0].name}"]
+            else:
+                # Parts in the order the importers wrote them, so the last one wins as it would online
+                parts.sort(key=lambda part: (order.get(part.name, -1), part.name))
+                files = [path.relative_to(directory).as_posix() for path in self.merge_parts(kind, name, parts)]
+            options.extend(f"    --{kind}={name}={file} \\" for file in files)
+        script = "\n".join([
+            "#!/bin/bash",
+            "# Generated by the neo4j-admin backend: full import of the files in this directory.",
+            "# The database must be stopped; usage: ./import.sh [database]",
+            'cd "$(dirname "$0")"',
+            '"${NEO4J_ADMIN:-neo4j-admin}" database import full \\',
+            *options,
+            "    --id-type=string \\",
+            f"    --array-delimiter='{self.array_delimiter}' \\",
+            "    --multiline-fields=true \\",
+            "    --overwrite-destination=true \\",
+            '    "${1:-neo4j}"',
+            "",
+        ])
+        path = directory / IMPORT_SCRIPT
+        path.write_text(script, encoding="utf-8")
+        os.chmod(path, 0o755)
+        logging.info(f"Import command written to {path}")
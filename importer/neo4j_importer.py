@@ -1,40 +1,378 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from itertools import islice
 from typing import Iterable
 
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
 from tqdm import tqdm
 
 from database.neo4j_db import Neo4jGraphDB
+from importer.batch_sizing import AdaptiveBatchSize
+from importer.checkpoint import CheckpointStore
+from importer.metrics import ImportMetrics
+from util.csv_utils import CsvSource, ParseCache
+from util.frame_utils import iter_record_batches, skip_rows
+
+# Deadlocks, lock timeouts and leader switches are worth retrying; anything else is not
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+# Codes of the failures caused by the size of a transaction, which a smaller batch may avoid
+SIZE_ERROR_CODES = ("MemoryPoolOutOfMemoryError", "OutOfMemoryError", "TransactionMemoryLimit", "TransactionTimedOut")
+
+
+def _is_size_error(error):
+    if isinstance(error, MemoryError):
+        return True
+    code = getattr(error, "code", None) or ""
+    return code.rsplit(".", 1)[-1].startswith(SIZE_ERROR_CODES)
+
+
+def _encode_value(value):
+    # Dates are tagged so that replayed batches send them as dates again, not strings
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _decode_value(obj):
+    if len(obj) == 1:
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+        if "$date" in obj:
+            return date.fromisoformat(obj["$date"])
+    return obj
 
 
 class Neo4jBaseImporter(Neo4jGraphDB):
-    def __init__(self):
-        super().__init__()
+    # Bump in an importer whenever its normalize() output changes, to invalidate parse caches
+    cache_version = 1
+    # Options that change what the importer writes, part of the pipeline fingerprint of its step
+    result_options = ()
+    # Checkpoints are kept per backend, which neo4j-admin shares to hand its remaining stages over to neo4j
+    checkpoint_backend = "neo4j"
+
+    def __init__(self, driver=None):
+        super().__init__(driver=driver)
         self.batch_size = 1000
+        self.chunk_size = None
+        self.parse_cache = False
+        self.keep_raw_dates = False
+        self.workers = 1
+        self.max_in_flight = None
+        self.max_retries = 5
+        self.retry_backoff = 0.5
+        self.dead_letter_file = "dead_letters.jsonl"
+        self._dead_letter_lock = threading.Lock()
+        self.resume = False
+        self.checkpoint_file = None
+        self.checkpoint_scope = None
+        self._checkpoints = None
+        self._stage = None
+        self._stage_stores = 0
+        self.adaptive_batch = False
+        self.target_latency = 2.0
+        self._batch_sizers = {}
+        self.metrics = ImportMetrics(type(self).__name__)
+        self.metrics_dir = None
+        self.prometheus = False
+        self._store_label = None
+
+    @property
+    def checkpoints(self) -> CheckpointStore:
+        if self._checkpoints is None:
+            backend = self.checkpoint_backend
+            path = self.checkpoint_file or os.path.join(".checkpoints", backend, f"{type(self).__name__}.json")
+            self._checkpoints = CheckpointStore(path, f"{backend}:{self.checkpoint_scope or type(self).__name__}")
+            if self.resume:
+                self._checkpoints.load()
+        return self._checkpoints
+
+    def run_stage(self, stage, *args, **kwargs):
+        # Stages are checkpointed by method name; completed ones are skipped on resume
+        name = stage.__name__
+        if self.checkpoints.is_completed(name):
+            logging.info(f"Skipping completed stage {name}")
+            return None
+
+        self._stage, self._stage_stores = name, 0
+        start = time.perf_counter()
+        try:
+            result = stage(*args, **kwargs)
+        finally:
+            self._stage = None
+            self.metrics.record_stage(name, time.perf_counter() - start)
+        self.checkpoints.complete(name)
+        return result
+
+    def write_metrics(self):
+        if not self.metrics_dir:
+            return
+        paths = self.metrics.write(self.metrics_dir, prometheus=self.prometheus)
+        logging.info(f"Import metrics written to {', '.join(str(path) for path in paths)}")
+
+    def _next_checkpoint_key(self):
+        if self._stage is None:
+            return None
+        self._stage_stores += 1
+        return f"{self._stage}/{self._stage_stores}"
+
+    def open_source(self, path, normalize):
+        cache = None
+        if self.parse_cache:
+            try:
+                import pyarrow  # noqa: F401
+                raw = ".raw" if self.keep_raw_dates else ""
+                mode = ".chunked" if self.chunk_size else ""
+                cache = ParseCache(path, f"{type(self).__name__}.v{self.cache_version}{raw}{mode}")
+            except ImportError:
+                logging.warning("pyarrow is not installed, parse cache disabled")
+        return CsvSource(path, normalize, chunk_size=self.chunk_size, cache=cache)
+
+    def batch_sizer(self, query: str):
+        # One controller per query, kept for the whole run so later calls start from the learned size
+        if not self.adaptive_batch:
+            return None
+        if query not in self._batch_sizers:
+            self._batch_sizers[query] = AdaptiveBatchSize(self.batch_size, target_latency=self.target_latency)
+        return self._batch_sizers[query]
 
     def batch_store(self, query: str, generator: Iterable, size: int = None, **kwargs):
-        def batched(iterable, n):
+        sizer = self.batch_sizer(query)
+
+        def batched(iterable):
             it = iter(iterable)
-            while batch := list(islice(it, n)):
+            while batch := list(islice(it, sizer.next_size() if sizer else self.batch_size)):
                 yield batch
 
-        try:
-            with self._driver.session(database=self.database) as session:
-                batches = batched(generator, self.batch_size)
+        self.store_batches(query, batched(generator), total_rows=size, sizer=sizer, **kwargs)
+
+    def batch_store_frame(self, query: str, frame, **kwargs):
+        # Rows are converted to dicts in bulk, one slice of the frame per batch
+        sizer = self.batch_sizer(query)
+        batches = iter_record_batches(frame, sizer.next_size if sizer else self.batch_size)
+        self.store_batches(query, batches, total_rows=len(frame), sizer=sizer, **kwargs)
+
+    def batch_store_source(self, query: str, source: CsvSource, **kwargs):
+        sizer = self.batch_sizer(query)
+        batch_size = sizer.next_size if sizer else self.batch_size
+        batches = (batch for frame in source.frames() for batch in iter_record_batches(frame, batch_size))
+        self.store_batches(query, batches, total_rows=source.size, sizer=sizer, **kwargs)
+
+    def store_batches(self, query: str, batches: Iterable, total_rows: int = None,
+                      partition_key=None, resumable: bool = True, sizer: AdaptiveBatchSize = None):
+        """Store batches, recording committed rows in the checkpoint of the running stage.
 
-                if size:
-                    total_batches = (size + self.batch_size - 1) // self.batch_size
-                    batches = tqdm(batches, total=total_batches, desc="Loading data into Neo4j...")
-                else:
-                    batches = tqdm(batches, desc="Loading data into Neo4j...")
+        On resume, rows already committed are generated but not sent again.
+        Pass resumable=False when the rows come from a query that already
+        leaves out the work done, since row offsets are then meaningless.
+        """
+        key = self._next_checkpoint_key()
+        self._store_label = self._stage or "batch_store"
+        skip = self.checkpoints.committed_rows(key) if key and resumable else 0
+        if skip:
+            logging.info(f"Resuming {key} after {skip} committed rows")
+            batches = skip_rows(batches, skip)
+        batches = enumerate(batches)
 
-                for batch in batches:
-                    if not batch:
-                        continue
+        def commit(index, rows):
+            if key:
+                self.checkpoints.commit_batch(key, index, rows)
 
-                    session.run(query, {"batch": batch})
+        if self.workers > 1:
+            self._store_batches_parallel(query, batches, total_rows, partition_key, commit, skip, sizer)
+        else:
+            with self._driver.session(database=self.database) as session, \
+                    tqdm(total=total_rows, initial=skip, unit="rows", desc="Loading data into Neo4j...") as progress:
+                for index, batch in batches:
+                    if batch:
+                        self.store_batch(session, query, batch, sizer)
+                    commit(index, len(batch))
+                    progress.update(len(batch))
 
+        if sizer:
+            logging.info(f"{self._store_label} settled on batches of {sizer.size} rows")
+        if summary := self.metrics.stage_summary(self._store_label):
+            logging.info(summary)
+
+    def store_batch(self, session, query: str, batch: list, sizer: AdaptiveBatchSize = None) -> bool:
+        # A failing batch is set aside in the dead-letter file so the remaining ones still go through
+        start = time.perf_counter()
+        try:
+            summary = self.write_batch(session, query, batch)
         except Exception as e:
-            print(f"Batch insert failed: {e}")
+            if sizer and len(batch) > sizer.min_size and _is_size_error(e):
+                # Too heavy for one transaction: shrink and retry both halves on their own
+                sizer.shrink()
+                logging.warning(f"Batch of {len(batch)} rows failed, retrying in halves: {e}")
+                middle = len(batch) // 2
+                first = self.store_batch(session, query, batch[:middle], sizer)
+                second = self.store_batch(session, query, batch[middle:], sizer)
+                return first and second
+            logging.error(f"Batch insert failed, {len(batch)} rows written to {self.dead_letter_file}: {e}")
+            self.write_dead_letter(query, batch, e)
+            self.metrics.record_batch(self._store_label, query, len(batch), time.perf_counter() - start, failed=True)
+            return False
+
+        elapsed = time.perf_counter() - start
+        self.metrics.record_batch(self._store_label, query, len(batch), elapsed, summary)
+        if sizer:
+            sizer.observe(batch, elapsed)
+        return True
+
+    def write_batch(self, session, query: str, batch: list):
+        """Run one batch in a managed write transaction, retrying transient failures.
+
+        execute_write already retries within the driver's retry window; the
+        outer loop adds exponential backoff on top of it for longer outages.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return session.execute_write(self._run_batch, query, batch)
+            except RETRYABLE_ERRORS as e:
+                # The same batch would run out of memory or time again
+                if attempt == self.max_retries or _is_size_error(e):
+                    raise
+                delay = self.retry_backoff * 2 ** attempt * (1 + random.random())
+                logging.warning(f"Transient failure, retrying batch in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    @staticmethod
+    def _run_batch(tx, query, batch):
+        return tx.run(query, {"batch": batch}).consume()
+
+    def write_dead_letter(self, query: str, batch: list, error: Exception):
+        entry = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "importer": type(self).__name__,
+            "error": str(error),
+            "query": query,
+            "batch": batch,
+        }
+        with self._dead_letter_lock:
+            with open(self.dead_letter_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, default=_encode_value) + "\n")
+
+    def replay_dead_letters(self, dead_letter_file: str):
+        # Batches failing again are appended to self.dead_letter_file, which may be the same file
+        replaying_file = f"{dead_letter_file}.replaying"
+        os.replace(dead_letter_file, replaying_file)
+
+        with open(replaying_file, encoding="utf-8") as f:
+            entries = [json.loads(line, object_hook=_decode_value) for line in f if line.strip()]
+
+        failed = 0
+        self._store_label = "replay_dead_letters"
+        with self._driver.session(database=self.database) as session:
+            for entry in tqdm(entries, desc="Replaying dead letters..."):
+                if not self.store_batch(session, entry["query"], entry["batch"]):
+                    failed += 1
+
+        os.remove(replaying_file)
+        logging.info(f"Replayed {len(entries) - failed} of {len(entries)} batches")
+
+    def _store_batches_parallel(self, query, batches, total_rows, partition_key, commit, skip, sizer):
+        """Dispatch batches to a pool of workers, each with its own session.
+
+        With a partition key, rows are routed by the hash of that key to one
+        single-threaded worker per partition, so that two concurrent
+        transactions never MERGE the same node. The key is a column, or a
+        function of the row when the query merges on a computed value. An input batch is committed
+        once every batch holding some of its rows has been stored.
+        """
+        local = threading.local()
+        lock = threading.Lock()
+        sessions = []
+        errors = []
+        remaining = {}
+        in_flight = threading.BoundedSemaphore(self.max_in_flight or 2 * self.workers)
+        progress = tqdm(total=total_rows, initial=skip, unit="rows",
+                        desc=f"Loading data into Neo4j ({self.workers} workers)...")
+
+        def release(indices):
+            with lock:
+                for index in indices:
+                    remaining[index][0] -= 1
+                    if remaining[index][0] == 0:
+                        commit(index, remaining.pop(index)[1])
+
+        def run(rows, indices):
+            session = getattr(local, "session", None)
+            if session is None:
+                session = local.session = self._driver.session(database=self.database)
+                with lock:
+                    sessions.append(session)
+            self.store_batch(session, query, rows, sizer)
+            release(indices)
+            progress.update(len(rows))
+
+        def done(future):
+            in_flight.release()
+            if future.exception() is not None:
+                errors.append(future.exception())
+
+        def submit(executor, rows, indices):
+            # Blocks once max_in_flight batches are queued or running
+            in_flight.acquire()
+            executor.submit(run, rows, indices).add_done_callback(done)
+
+        if partition_key:
+            executors = [ThreadPoolExecutor(max_workers=1) for _ in range(self.workers)]
+        else:
+            executors = [ThreadPoolExecutor(max_workers=self.workers)]
+
+        try:
+            if partition_key:
+                partitions = [([], set()) for _ in range(self.workers)]
+                for index, batch in batches:
+                    if errors:
+                        break
+                    # Hold the batch open until all of its rows are routed
+                    with lock:
+                        remaining[index] = [1, len(batch)]
+                    for row in batch:
+                        value = partition_key(row) if callable(partition_key) else row.get(partition_key)
+                        position = hash(value) % self.workers
+                        rows, indices = partitions[position]
+                        if index not in indices:
+                            indices.add(index)
+                            with lock:
+                                remaining[index][0] += 1
+                        rows.append(row)
+                        if len(rows) >= (sizer.next_size() if sizer else self.batch_size):
+                            submit(executors[position], rows, indices)
+                            partitions[position] = ([], set())
+                    release([index])
+                for position, (rows, indices) in enumerate(partitions):
+                    if rows and not errors:
+                        submit(executors[position], rows, indices)
+            else:
+                for index, batch in batches:
+                    if errors:
+                        break
+                    with lock:
+                        remaining[index] = [1, len(batch)]
+                    if batch:
+                        submit(executors[0], batch, [index])
+                    else:
+                        release([index])
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+            for session in sessions:
+                session.close()
+            progress.close()
+
+        if errors:
+            # Batch failures are dead-lettered in store_batch, so anything reaching here is fatal
+            logging.error(f"Parallel batch store aborted: {errors[0]!r}")
+            raise errors[0]
 
     def create_indices(self, indices):
         for index in indices:
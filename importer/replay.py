@@ -0,0 +1,23 @@
+def dead_letter_replay_factory(base_importer_cls, backend: str):
+    import logging
+
+    class DeadLetterReplayer(base_importer_cls):
+        def __init__(self):
+            super().__init__()
+            self.backend = backend
+
+        def import_data(self, dead_letter_file):
+            logging.info("Replaying failed batches...")
+            self.replay_dead_letters(dead_letter_file)
+
+    return DeadLetterReplayer
+
+if __name__ == '__main__':
+    from util.cli_entry import run_backend_importer
+
+    run_backend_importer(
+        dead_letter_replay_factory,
+        description="Replay batches recorded in a dead-letter file with selected backend.",
+        file_help="Path to the dead-letter file",
+        default_base_path="./"
+    )
@@ -1,3 +1,5 @@
+from itertools import islice
+
 from rdflib import Namespace, URIRef, Literal, Graph
 from rdflib.namespace import RDF, XSD
 from tqdm import tqdm
@@ -5,6 +7,11 @@ from tqdm import tqdm
 from database.neo4j_db import Neo4jGraphDB
 
 
+def to_native(value):
+    # neo4j.time values (Date, DateTime) become datetime objects that rdflib can serialize
+    return value.to_native() if hasattr(value, "to_native") else value
+
+
 class Neo4jToRDFConverter:
     def __init__(self, entity_mappings,
                        data_property_mappings,
@@ -43,26 +50,28 @@ class Neo4jToRDFConverter:
         result = session.run(cypher)
         return result.single()["total"]
 
-    def _fetch_nodes_batch(self, session, label, offset, filter_clause=None, query=None):
+    def _stream_nodes(self, session, label, filter_clause=None, query=None):
+        # One query for the whole label, read as it is consumed, so no page re-runs the match
         if query:
             cypher = f"""
             CALL () {{
                 {query}
             }}
             RETURN n
-            SKIP $offset
-            LIMIT $limit
             """
         else:
             cypher = f"""
             MATCH (n:{label})
             {filter_clause or ""}
             RETURN n
-            SKIP $offset
-            LIMIT $limit
             """
 
-        return list(session.run(cypher, offset=offset, limit=self.batch_size))
+        return session.run(cypher)
+
+    def _batches(self, result):
+        records = iter(result)
+        while batch := list(islice(records, self.batch_size)):
+            yield batch
 
     def _add_node_to_graph(self, session, node_label, node_data, base_uri, graph):
         node_id = node_data.element_id
@@ -81,7 +90,7 @@ class Neo4jToRDFConverter:
                 for item in value:
                     graph.add((subject_uri, predicate_uri, Literal(item)))
             elif prop_info["type"] == "date":
-                graph.add((subject_uri, predicate_uri, Literal(value, datatype=XSD.date)))
+                graph.add((subject_uri, predicate_uri, Literal(to_native(value), datatype=XSD.date)))
             else:
                 graph.add((subject_uri, predicate_uri, Literal(value)))
 
@@ -106,7 +115,7 @@ class Neo4jToRDFConverter:
                     if data_type == "float":
                         graph.add((subject_uri, predicate_uri, Literal(value, datatype=XSD.float)))
                     elif data_type == "date":
-                        graph.add((subject_uri, predicate_uri, Literal(value, datatype=XSD.date)))
+                        graph.add((subject_uri, predicate_uri, Literal(to_native(value), datatype=XSD.date)))
                     else:
                         graph.add((subject_uri, predicate_uri, Literal(value)))
 
@@ -125,26 +134,20 @@ class Neo4jToRDFConverter:
             """
 
             total = session.run(count_query).single()["total"]
-            offset = 0
+            query = f"""
+            CALL () {{ WITH *
+                {cypher_query}
+            }}
+            RETURN src_id, dst_id
+            """
 
             with tqdm(total=total, desc=f"Processing relation {relation}", unit="rel") as pbar:
-                while offset < total:
-                    paginated_query = f"""
-                    CALL () {{ WITH *
-                        {cypher_query}
-                    }}
-                    RETURN src_id, dst_id
-                    SKIP $offset
-                    LIMIT $limit
-                    """
-
-                    result = session.run(paginated_query, offset=offset, limit=self.batch_size)
-
+                for records in self._batches(session.run(query)):
                     batch_graph = Graph()
                     self._bind_namespaces(batch_graph)
 
                     count = 0
-                    for record in result:
+                    for record in records:
                         src_id = record["src_id"]
                         dst_id = record["dst_id"]
 
@@ -162,36 +165,30 @@ class Neo4jToRDFConverter:
                         with open(output_file, "a", encoding="utf-8") as f:
                             f.write(batch_graph.serialize(format=serialization_format))
 
-                    offset += self.batch_size
                     pbar.update(count)
 
     def convert(self, output_file=None, serialization_format="turtle") -> Graph:
-        with self.driver.session() as session:
+        # Computed properties are queried in a second session while the nodes of a label are still streaming
+        with self.driver.session() as session, self.driver.session() as lookup_session:
             for label, mapping in self.entity_mappings.items():
                 base_uri = mapping["uri"] if isinstance(mapping, dict) else mapping
                 filter_clause = mapping.get("filter", "") if isinstance(mapping, dict) else ""
                 query = mapping.get("query", None) if isinstance(mapping, dict) else None
 
                 total = self._get_node_count(session, label, filter_clause, query)
-                offset = 0
 
                 with tqdm(total=total, desc=f"Processing {label}", unit="node") as pbar:
-                    while True:
-                        records = self._fetch_nodes_batch(session, label, offset, filter_clause, query)
-                        if not records:
-                            break
-
+                    for records in self._batches(self._stream_nodes(session, label, filter_clause, query)):
                         batch_graph = Graph()
                         self._bind_namespaces(batch_graph)
 
                         for record in records:
-                            self._add_node_to_graph(session, label, record["n"], base_uri, batch_graph)
+                            self._add_node_to_graph(lookup_session, label, record["n"], base_uri, batch_graph)
 
                         if output_file:
                             with open(output_file, "ab") as f:
                                 f.write(batch_graph.serialize(format=serialization_format).encode("utf-8"))
 
-                        offset += self.batch_size
                         pbar.update(len(records))
 
             self._handle_object_properties(session, output_file=output_file, serialization_format=serialization_format)
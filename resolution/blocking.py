@@ -0,0 +1,71 @@
+import re
+from collections import defaultdict
+
+NON_WORD = re.compile(r"[^a-zA-Z0-9\s]")
+# Legal forms and connectives left out of organization names before they are compared
+LEGAL_SUFFIX = re.compile(r"(?i)\b(?:co|ltd|inc|corp|llc|llp|pvt|gmbh|s.a.|s.l.|and|not)\b")
+
+_SOUNDEX_CODES = {letter: code for code, letters in {
+    "1": "BFPV", "2": "CGJKQSXZ", "3": "DT", "4": "L", "5": "MN", "6": "R",
+}.items() for letter in letters}
+
+
+def soundex(word):
+    """American Soundex code of word: its first letter and the codes of the next three consonant sounds."""
+    word = "".join(c for c in word.upper() if c.isalpha())
+    if not word:
+        return ""
+    code, previous = word[0], _SOUNDEX_CODES.get(word[0], "")
+    for c in word[1:]:
+        digit = _SOUNDEX_CODES.get(c, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # H and W do not separate letters with the same code, vowels do
+        if c not in "HW":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def name_words(name):
+    # Same words as the fulltext query of the people similarity stage
+    return NON_WORD.sub("", name or "").upper().split()
+
+
+def clean_org_name(name):
+    return LEGAL_SUFFIX.sub("", name or "").strip()
+
+
+def org_name_words(clean_name):
+    # Words of a cleaned name that the organization similarity stage queries
+    return [word for word in NON_WORD.sub("", clean_name).split()
+            if len(word) > 2 and word.lower() not in ("and", "not")]
+
+
+def person_block_keys(name):
+    """Blocking keys of a person name; names sharing any key are compared.
+
+    - the Soundex code of the last word, for spelling variants of the last name;
+    - the Soundex code of the first word with the initial of the last one, for
+      last names whose typos change their code;
+    - the sorted two-letter prefixes of all words, for names whose words come
+      in another order.
+    """
+    words = name_words(name)
+    if not words:
+        return []
+    keys = [f"L:{soundex(words[-1])}"]
+    if len(words) > 1:
+        keys.append(f"N:{soundex(words[0])}{words[-1][0]}")
+        keys.append("P:" + " ".join(sorted(word[:2] for word in words)))
+    return keys
+
+
+def build_blocks(names, block_keys):
+    """Indices of names grouped by blocking key, leaving out blocks of a single name."""
+    blocks = defaultdict(list)
+    for index, name in enumerate(names):
+        for key in block_keys(name):
+            blocks[key].append(index)
+    return {key: members for key, members in blocks.items() if len(members) > 1}
@@ -0,0 +1,125 @@
+import logging
+import sqlite3
+
+from resolution.similarity import sorensen_dice_similarity
+
+
+def normalize_name(name):
+    # Sørensen–Dice compares the bigrams of the upper-cased words, so case and spacing don't change a score
+    return " ".join(name.upper().split())
+
+
+class SimilarityCache:
+    """Sørensen–Dice scores of normalized name pairs and cleaned names, kept in SQLite between runs.
+
+    The file is read into dicts when the cache is opened, so lookups cost no
+    more than a dict access, and only the entries added or used by the run
+    are written back on close. Every entry records the last run that used
+    it; once the file holds more than max_entries scores, the entries of
+    the oldest runs are evicted first. Without a path the cache only lasts
+    for the run.
+    """
+
+    def __init__(self, path=None, max_entries=5_000_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._scores, self._cleaned = {}, {}
+        self._used_scores, self._used_cleaned = set(), set()
+        self.run = 1
+        if path:
+            self._connection = sqlite3.connect(path)
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS scores (a TEXT, b TEXT, score REAL, used INTEGER, PRIMARY KEY (a, b))
+                    WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS cleaned (kind TEXT, name TEXT, clean TEXT, used INTEGER,
+                    PRIMARY KEY (kind, name)) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS scores_used ON scores (used);
+            """)
+            self.run = 1 + (self._connection.execute("SELECT max(used) FROM scores").fetchone()[0] or 0)
+            self._scores = {(a, b): score for a, b, score in self._connection.execute("SELECT a, b, score FROM scores")}
+            self._cleaned = {(kind, name): clean for kind, name, clean in
+                             self._connection.execute("SELECT kind, name, clean FROM cleaned")}
+            logging.info(f"Loaded {len(self._scores)} similarity scores and {len(self._cleaned)} cleaned names "
+                         f"from {path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def key(name1, name2):
+        return tuple(sorted((normalize_name(name1), normalize_name(name2))))
+
+    def score(self, name1, name2):
+        """sorensen_dice_similarity(name1, name2), computed once per normalized pair."""
+        if name1 is None or name2 is None:
+            return None
+        key = self.key(name1, name2)
+        score = self._scores.get(key)
+        if score is None:
+            self.misses += 1
+            score = self._scores[key] = sorensen_dice_similarity(*key)
+        else:
+            self.hits += 1
+        self._used_scores.add(key)
+        return score
+
+    def cached_scores(self, pairs):
+        """Scores of the (name1, name2) pairs if every one of them is cached, else None."""
+        keys = [self.key(name1, name2) for name1, name2 in pairs]
+        scores = [self._scores.get(key) for key in keys]
+        if any(score is None for score in scores):
+            return None
+        self.hits += len(keys)
+        self._used_scores.update(keys)
+        return scores
+
+    def add_scores(self, pairs, scores):
+        # Scores computed elsewhere, such as the vectorized ones of the people engine
+        for (name1, name2), score in zip(pairs, scores):
+            key = self.key(name1, name2)
+            self._scores[key] = score
+            self._used_scores.add(key)
+        self.misses += len(scores)
+
+    def clean(self, kind, name, cleaner):
+        """cleaner(name), computed once per name and kind of cleaning."""
+        key = (kind, name)
+        clean = self._cleaned.get(key)
+        if clean is None:
+            clean = self._cleaned[key] = cleaner(name)
+        self._used_cleaned.add(key)
+        return clean
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def summary(self):
+        rate = self.hit_rate()
+        return (f"Similarity cache: {self.hits} hits, {self.misses} misses"
+                + (f" ({rate:.1%} hit rate)" if rate is not None else ""))
+
+    def close(self):
+        if not self.path:
+            return
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                ((a, b, self._scores[(a, b)], self.run) for a, b in self._used_scores))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cleaned VALUES (?, ?, ?, ?)",
+                ((kind, name, self._cleaned[(kind, name)], self.run) for kind, name in self._used_cleaned))
+            excess = len(self._scores) - self.max_entries
+            if excess > 0:
+                # Least recently used runs first
+                self._connection.execute("DELETE FROM scores WHERE (a, b) IN "
+                                         "(SELECT a, b FROM scores ORDER BY used LIMIT ?)", (excess,))
+                self._connection.execute("DELETE FROM cleaned WHERE used < (SELECT min(used) FROM scores)")
+                logging.info(f"Evicted {excess} similarity scores from {self.path}")
+        self._connection.close()
+        self.path = None
@@ -0,0 +1,161 @@
+import numpy as np
+
+
+class UnionFind:
+    """Disjoint sets of hashable items, with path halving and union by size."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        self.add(item)
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def groups(self):
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return list(groups.values())
+
+
+def plan_cluster_updates(neighbors, next_cluster_id):
+    """Cluster rows for records that are not in a cluster yet, merging the clusters they connect.
+
+    neighbors maps the id of every unclustered record to the (id, cluster id)
+    of the records it is similar to, the cluster id being None for records
+    that are not in a cluster either. Since similarity edges are only created
+    for new records, the components of the whole graph only change through
+    these records: each group of connected new records joins the existing
+    clusters it touches, into the lowest of their ids, or gets a new cluster
+    numbered from next_cluster_id.
+
+    Returns one row per cluster to write, with the new records it gains and
+    the existing clusters merged into it.
+    """
+    sets = UnionFind()
+    for record, similar in neighbors.items():
+        sets.add(("record", record))
+        for other, cluster in similar:
+            if other is None:
+                continue
+            sets.union(("record", record), ("record", other) if cluster is None else ("cluster", cluster))
+
+    rows = []
+    for group in sorted(sets.groups(), key=lambda group: min(str(value) for _, value in group)):
+        records = sorted((value for kind, value in group if kind == "record"), key=str)
+        clusters = sorted(value for kind, value in group if kind == "cluster")
+        if clusters:
+            cluster_id, merged = clusters[0], clusters[1:]
+        else:
+            cluster_id, merged = next_cluster_id, []
+            next_cluster_id += 1
+        rows.append({"id": cluster_id, "records": records, "merged": merged})
+    return rows
+
+
+class ArrayUnionFind:
+    """Disjoint sets of the integers 0..size-1 held in int32 arrays, for graphs too large for UnionFind.
+
+    Union by rank with path compression. Union by rank keeps every tree at
+    most log2(size) deep, so the roots of a whole page of edges are found in
+    at most that many vectorized steps, which also compress the paths they
+    walk. Only the distinct pairs of roots still to be joined are then linked
+    one at a time. Every root keeps the smallest member of its set, which
+    roots() reports, so components do not depend on edge order.
+    """
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int32)
+        self.rank = np.zeros(size, dtype=np.int8)
+        self.smallest = np.arange(size, dtype=np.int32)
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def find_all(self, items):
+        # One step up every path at once, then every node walked is pointed at its root
+        path, roots = [items], self.parent[items]
+        while True:
+            above = self.parent[roots]
+            if (above == roots).all():
+                break
+            path.append(roots)
+            roots = above
+        for nodes in path:
+            self.parent[nodes] = roots
+        return roots
+
+    def link(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+        self.smallest[a] = min(self.smallest[a], self.smallest[b])
+        return a
+
+    def union(self, a, b):
+        a, b = np.asarray(a, dtype=np.int32), np.asarray(b, dtype=np.int32)
+        if not len(a):
+            return
+        root_a, root_b = self.find_all(a), self.find_all(b)
+        linked = root_a != root_b
+        pairs = np.unique(np.stack([np.minimum(root_a, root_b)[linked], np.maximum(root_a, root_b)[linked]],
+                                   axis=1), axis=0)
+        for x, y in pairs.tolist():
+            self.link(x, y)
+
+    def roots(self):
+        """Smallest member of the set of every item."""
+        return self.smallest[self.find_all(np.arange(len(self.parent), dtype=np.int32))]
+
+
+def aggregate_clusters(members, lists, name_list, distinct=False):
+    """One row per cluster from the rows of its members, for a single write of each cluster node.
+
+    members are dicts with the cluster id under "cluster" and the member id
+    under "id"; lists maps each list property of the cluster to the member
+    key it collects, leaving out nulls, and distinct keeps only the first
+    of equal values, like apoc.coll.toSet. Members are taken in id order and
+    the cluster is named after the first shortest value of name_list.
+    """
+    grouped = {}
+    for member in members:
+        grouped.setdefault(member["cluster"], []).append(member)
+    rows = []
+    for cluster_id, group in grouped.items():
+        group.sort(key=lambda member: str(member["id"]))
+        row = {"id": cluster_id, "size": len(group)}
+        for prop, key in lists.items():
+            values = [member[key] for member in group if member[key] is not None]
+            row[prop] = list(dict.fromkeys(values)) if distinct else values
+        row["name"] = min(row[name_list], key=len) if row[name_list] else None
+        rows.append(row)
+    return rows
@@ -0,0 +1,175 @@
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from resolution.blocking import build_blocks, person_block_keys
+from resolution.similarity import bigram_matrix, dice_scores
+from resolution.tasks import deal_tasks
+
+
+def compared_pairs(new):
+    """(row, column) positions of the pairs score_blocks compares in a block with these new flags."""
+    positions = np.arange(len(new))
+    rows = np.flatnonzero(new)
+    pair_rows, columns = np.nonzero(~new[None, :] | (positions[None, :] > rows[:, None]))
+    return rows[pair_rows], columns
+
+
+def score_blocks(blocks, threshold, chunk_rows=1024):
+    """Pairs scoring above threshold within each (members, names, new) block.
+
+    Every new name is compared with the names of its block that are not new,
+    and with the new names after it, so each pair is scored once per block.
+    Returns the new member, the member it matched and the score of each match, and
+    the number of pairs compared.
+    """
+    records, candidates, scores, compared = [], [], [], 0
+    for members, names, new in blocks:
+        matrix, totals = bigram_matrix(names)
+        positions = np.arange(len(names))
+        queries = np.flatnonzero(new)
+        for start in range(0, len(queries), chunk_rows):
+            rows = queries[start:start + chunk_rows]
+            block_scores = dice_scores(matrix[rows], totals[rows], matrix, totals)
+            compare = ~new[None, :] | (positions[None, :] > rows[:, None])
+            compared += int(compare.sum())
+            hit_rows, hit_columns = np.nonzero(compare & (block_scores > threshold))
+            records.append(members[rows[hit_rows]])
+            candidates.append(members[hit_columns])
+            scores.append(block_scores[hit_rows, hit_columns])
+    if not records:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0), compared
+    return np.concatenate(records), np.concatenate(candidates), np.concatenate(scores), compared
+
+
+class Resolution:
+    """Matching name pairs of one resolve() run, as indices into its names, with run statistics."""
+
+    def __init__(self, records, candidates, scores, new, blocks, compared, elapsed):
+        self.records = records
+        self.candidates = candidates
+        self.scores = scores
+        self.new = new
+        self.blocks = blocks
+        self.compared = compared
+        self.elapsed = elapsed
+
+    def __len__(self):
+        return len(self.scores)
+
+    def edges(self, mutual=True):
+        """(source, target, score) of the IS_SIMILAR_TO edges the fulltext stage would create.
+
+        That stage links every candidate to the new record it was found for,
+        so pairs of two new records get an edge in each direction, unless
+        mutual is False for stages that skip pairs already linked.
+        """
+        for record, candidate, score in zip(self.records.tolist(), self.candidates.tolist(), self.scores.tolist()):
+            yield candidate, record, score
+            if mutual and self.new[candidate]:
+                yield record, candidate, score
+
+    def pairs(self):
+        return {(min(a, b), max(a, b)) for a, b in zip(self.records.tolist(), self.candidates.tolist())}
+
+    def recall(self, reference):
+        """Share of the reference pairs of indices, in any direction, that were found."""
+        reference = {(min(a, b), max(a, b)) for a, b in reference if a != b}
+        if not reference:
+            return None
+        return len(reference & self.pairs()) / len(reference)
+
+    def summary(self):
+        rate = self.compared / self.elapsed if self.elapsed else 0.0
+        return (f"{int(self.new.sum())} of {len(self.new)} names resolved in {self.blocks} blocks: "
+                f"{self.compared:,} pairs compared in {self.elapsed:.1f}s ({rate:,.0f} pairs/s), "
+                f"{len(self)} matches")
+
+
+class NameResolver:
+    """Client-side entity resolution of names with blocking and vectorized Sørensen–Dice.
+
+    Names are grouped into blocks by block_keys, and the bigram multisets of
+    each block are compared all at once with matrix products, over a pool of
+    processes. Pairs scoring strictly above threshold match, the same rule as
+    the `apoc.text.sorensenDiceSimilarity(...) > threshold` filter in Cypher.
+    """
+
+    def __init__(self, block_keys=person_block_keys, threshold=0.695, processes=None, blocks_per_task=500):
+        self.block_keys = block_keys
+        self.threshold = threshold
+        self.processes = processes or os.cpu_count() or 1
+        self.blocks_per_task = blocks_per_task
+
+    def resolve(self, names, new=None, cache=None) -> Resolution:
+        """Match the new names (all of them by default) against every name.
+
+        With a SimilarityCache, blocks whose compared pairs are all cached are
+        not scored again. The other blocks add the score of every pair they
+        compare, not only of their matches, so a later run finds them whatever
+        its threshold.
+        """
+        start = time.perf_counter()
+        new = np.ones(len(names), dtype=bool) if new is None else np.asarray(new, dtype=bool)
+        blocks = []
+        for members in build_blocks(names, self.block_keys).values():
+            members = np.asarray(members)
+            if new[members].any():
+                blocks.append((members, [names[m] for m in members], new[members]))
+        block_count, cached = len(blocks), []
+        if cache is not None:
+            blocks, cached = self.cached_blocks(blocks, cache)
+        task_count = max(1, min(len(blocks) // self.blocks_per_task + 1, self.processes * 4))
+        tasks = deal_tasks(blocks, lambda block: len(block[0]), task_count)
+
+        # Every compared pair is kept when its score goes to the cache
+        threshold = self.threshold if cache is None else -1.0
+        if self.processes > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                results = list(executor.map(score_blocks, tasks, repeat(threshold)))
+        else:
+            results = [score_blocks(task, threshold) for task in tasks]
+        if cache is not None:
+            results = [self.cache_scores(result, names, cache) for result in results] + cached
+
+        records = np.concatenate([result[0] for result in results])
+        candidates = np.concatenate([result[1] for result in results])
+        scores = np.concatenate([result[2] for result in results])
+        # A pair sharing several blocking keys is found once per block
+        _, unique = np.unique(records * len(names) + candidates, return_index=True)
+        resolution = Resolution(records[unique], candidates[unique], scores[unique], new, block_count,
+                                sum(result[3] for result in results), time.perf_counter() - start)
+        logging.info(resolution.summary())
+        return resolution
+
+    def cached_blocks(self, blocks, cache):
+        """Blocks with a pair missing from cache, and the matches of the others as a score_blocks result."""
+        uncached, records, candidates, scores = [], [], [], []
+        for members, block_names, block_new in blocks:
+            rows, columns = compared_pairs(block_new)
+            block_scores = cache.cached_scores([(block_names[row], block_names[column])
+                                                for row, column in zip(rows.tolist(), columns.tolist())])
+            if block_scores is None:
+                uncached.append((members, block_names, block_new))
+                continue
+            block_scores = np.asarray(block_scores, dtype=float)
+            above = block_scores > self.threshold
+            records.append(members[rows[above]])
+            candidates.append(members[columns[above]])
+            scores.append(block_scores[above])
+        if not records:
+            return uncached, []
+        return uncached, [(np.concatenate(records), np.concatenate(candidates), np.concatenate(scores), 0)]
+
+    def cache_scores(self, result, names, cache):
+        # Add every compared pair of a score_blocks result to cache, and keep the matches
+        records, candidates, scores, compared = result
+        cache.add_scores([(names[record], names[candidate])
+                          for record, candidate in zip(records.tolist(), candidates.tolist())], scores.tolist())
+        above = scores > self.threshold
+        return records[above], candidates[above], scores[above], compared
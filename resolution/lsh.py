@@ -0,0 +1,153 @@
+import logging
+import pickle
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from resolution.blocking import clean_org_name, org_name_words
+from resolution.engine import Resolution
+from resolution.similarity import bigrams, sorensen_dice_similarity
+
+# Mersenne prime for the universal hash family of the MinHash permutations
+PRIME = (1 << 31) - 1
+
+
+class OrgNameIndex:
+    """MinHash index of cleaned organization names, blocked by address, kept between runs.
+
+    Every name is signed with num_perm MinHash values of its bigram set, cut
+    into bands of rows values. Two organizations are candidates when they
+    share an address and at least one band of their signatures, which is the
+    LSH test for a bigram Jaccard similarity around (1 / bands) ** (1 / rows);
+    candidates are then scored with the exact Sørensen–Dice of their cleaned
+    names. The address blocks keep the candidate test linear in the number of
+    organizations: only names with a common address are ever compared.
+
+    The index keeps the signature and addresses of every organization added,
+    so it can be saved and later used to resolve new organizations only.
+    """
+
+    def __init__(self, num_perm=64, bands=32, threshold=0.3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, num_perm, dtype=np.uint64)
+        self.names = {}
+        self.signatures = {}
+        self.addresses = {}
+        self.by_address = defaultdict(set)
+
+    def __len__(self):
+        return len(self.names)
+
+    def signature(self, clean_name):
+        # crc32 rather than hash(), which is salted per process and would not survive a reload
+        shingles = np.array([zlib.crc32(gram.encode("utf-8")) for gram in bigrams(clean_name)], dtype=np.uint64)
+        if not len(shingles):
+            return None
+        hashes = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % PRIME
+        return hashes.min(axis=1).astype(np.uint32)
+
+    def add(self, record_id, name, addresses, cleaner=clean_org_name):
+        """Add or refresh an organization; returns False when it is already indexed as given."""
+        clean_name = cleaner(name)
+        addresses = frozenset(address for address in addresses if address is not None)
+        if self.names.get(record_id) == clean_name and self.addresses.get(record_id) == addresses:
+            return False
+        self.remove(record_id)
+        self.names[record_id] = clean_name
+        self.signatures[record_id] = self.signature(clean_name)
+        self.addresses[record_id] = addresses
+        for address in addresses:
+            self.by_address[address].add(record_id)
+        return True
+
+    def remove(self, record_id):
+        for address in self.addresses.pop(record_id, ()):
+            self.by_address[address].discard(record_id)
+            if not self.by_address[address]:
+                del self.by_address[address]
+        self.names.pop(record_id, None)
+        self.signatures.pop(record_id, None)
+
+    def candidates(self, record_id):
+        """Indexed organizations sharing an address and a signature band with record_id."""
+        members = set()
+        for address in self.addresses.get(record_id, ()):
+            members |= self.by_address[address]
+        members.discard(record_id)
+        signature = self.signatures.get(record_id)
+        members = [member for member in members if self.signatures[member] is not None]
+        if signature is None or not members:
+            return [], len(members)
+        rows = self.num_perm // self.bands
+        others = np.stack([self.signatures[member] for member in members]).reshape(len(members), self.bands, rows)
+        collide = (others == signature.reshape(self.bands, rows)).all(axis=2).any(axis=1)
+        return [member for member, hit in zip(members, collide) if hit], len(members)
+
+    def resolve(self, ids, names, addresses, new=None, cache=None) -> Resolution:
+        """Index every organization, then match each new one (all by default) to the indexed ones.
+
+        Like the fulltext stage, each pair is matched once, by whichever of
+        its organizations comes first, and names with no word of three
+        letters or more are not looked up. Indexed organizations missing from
+        ids are dropped, so only new or renamed ones are signed again. A
+        SimilarityCache, when given, keeps the cleaned names and pair scores
+        for later runs.
+        """
+        start = time.perf_counter()
+        new = np.ones(len(ids), dtype=bool) if new is None else np.asarray(new, dtype=bool)
+        position = {record_id: i for i, record_id in enumerate(ids)}
+        for record_id in [record_id for record_id in self.names if record_id not in position]:
+            self.remove(record_id)
+        if cache is None:
+            cleaner, similarity = clean_org_name, sorensen_dice_similarity
+        else:
+            cleaner, similarity = (lambda name: cache.clean("organization", name, clean_org_name)), cache.score
+        refreshed = sum(self.add(record_id, name, record_addresses, cleaner)
+                        for record_id, name, record_addresses in zip(ids, names, addresses))
+
+        records, candidates, scores, compared, seen = [], [], [], 0, set()
+        for i in np.flatnonzero(new).tolist():
+            record_id = ids[i]
+            clean_name = self.names[record_id]
+            if not org_name_words(clean_name):
+                continue
+            matches, tested = self.candidates(record_id)
+            compared += tested
+            for match in matches:
+                pair = frozenset((record_id, match))
+                if pair in seen:
+                    continue
+                score = similarity(clean_name, self.names[match])
+                if score > self.threshold:
+                    seen.add(pair)
+                    records.append(i)
+                    candidates.append(position[match])
+                    scores.append(score)
+
+        resolution = Resolution(np.array(records, dtype=np.int64), np.array(candidates, dtype=np.int64),
+                                np.array(scores), new, len(self.by_address), compared, time.perf_counter() - start)
+        logging.info(f"{refreshed} of {len(ids)} organizations (re)indexed; {resolution.summary()}")
+        return resolution
+
+    # Persistence
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self.__dict__, f)
+        logging.info(f"Organization name index of {len(self)} names saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        index = cls.__new__(cls)
+        with open(path, "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        logging.info(f"Loaded the organization name index of {len(index)} names from {path}")
+        return index
@@ -0,0 +1,57 @@
+from collections import Counter
+
+import numpy as np
+
+
+def bigrams(text):
+    return Counter(word[i:i + 2] for word in text.upper().split() for i in range(len(word) - 1))
+
+
+def sorensen_dice_similarity(text1, text2):
+    """apoc.text.sorensenDiceSimilarity: 2 * shared bigrams / all bigrams of the upper-cased words."""
+    if text1 is None or text2 is None:
+        return None
+    a, b = bigrams(text1), bigrams(text2)
+    total = sum(a.values()) + sum(b.values())
+    if total == 0:
+        return 1.0 if text1.upper() == text2.upper() else 0.0
+    return 2 * sum((a & b).values()) / total
+
+
+def bigram_matrix(names):
+    """Bigram counts of names as a dense (names x distinct bigrams) matrix, with the bigram total of each name."""
+    counts = [bigrams(name) for name in names]
+    vocabulary = {}
+    for count in counts:
+        for gram in count:
+            vocabulary.setdefault(gram, len(vocabulary))
+    matrix = np.zeros((len(names), max(len(vocabulary), 1)), dtype=np.int16)
+    for row, count in enumerate(counts):
+        for gram, n in count.items():
+            matrix[row, vocabulary[gram]] = n
+    return matrix, matrix.sum(axis=1)
+
+
+def shared_bigrams(rows, columns):
+    """Size of the bigram multiset intersection of every row with every column, as a matrix.
+
+    min(a, b) is the number of levels t >= 1 with a >= t and b >= t, so the
+    multiset intersection is a sum of products of indicator matrices, one per
+    repeat level; names rarely repeat a bigram, so there are one or two levels.
+    """
+    levels = int(max(rows.max(initial=0), columns.max(initial=0)))
+    shared = np.zeros((rows.shape[0], columns.shape[0]), dtype=np.float32)
+    for level in range(1, levels + 1):
+        shared += (rows >= level).astype(np.float32) @ (columns >= level).astype(np.float32).T
+    return shared
+
+
+def dice_scores(rows, row_totals, columns, column_totals):
+    """Sørensen–Dice of every row name with every column name from their bigram counts.
+
+    Names without any bigram (single letters) score 0, where the APOC function
+    compares them for equality.
+    """
+    denominator = row_totals[:, None] + column_totals[None, :]
+    shared = shared_bigrams(rows, columns)
+    return np.where(denominator > 0, 2 * shared / np.maximum(denominator, 1), 0.0)
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import logging
+
+import numpy as np
+
+from resolution.clusters import ArrayUnionFind
+from util.logger import setup_logging
+
+# Cluster size buckets reported by the sweep, as (column, smallest size, largest size)
+SIZE_BUCKETS = (("size_2", 2, 2), ("size_3_9", 3, 9), ("size_10_99", 10, 99), ("size_100+", 100, None))
+
+
+class CandidatePairs:
+    """Every candidate pair of a similarity stage with its score, recorded once to tune the threshold offline.
+
+    Pairs are kept whatever their score, with the record ids of both ends
+    as strings, so any threshold can be replayed without querying the
+    database again. records is the number of records the candidates were
+    looked up for, records in no pair being clusters of their own.
+
+    The file is Parquet, with the record count in the schema metadata, or
+    NumPy .npz when the path ends in .npz or pyarrow is not installed.
+    """
+
+    def __init__(self, records, sources, targets, scores):
+        self.records = records
+        self.sources = sources
+        self.targets = targets
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.scores)
+
+    @classmethod
+    def from_pairs(cls, records, pairs):
+        # A pair found from both of its records is kept once, with its best score
+        best = {}
+        for source, target, score in pairs:
+            if score is None or source == target:
+                continue
+            key = tuple(sorted((str(source), str(target))))
+            if score > best.get(key, -1.0):
+                best[key] = score
+        return cls(records, np.array([key[0] for key in best], dtype=str),
+                   np.array([key[1] for key in best], dtype=str), np.fromiter(best.values(), dtype=float))
+
+    def save(self, path):
+        try:
+            if str(path).endswith(".npz"):
+                raise ImportError
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({"source": self.sources, "target": self.targets, "score": self.scores},
+                             metadata={"records": str(self.records)})
+            pq.write_table(table, path)
+        except ImportError:
+            with open(path, "wb") as f:
+                np.savez(f, records=self.records, sources=self.sources, targets=self.targets, scores=self.scores)
+        logging.info(f"{len(self)} candidate pairs of {self.records} records saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            parquet = f.read(4) == b"PAR1"
+        if parquet:
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(path)
+            return cls(int(table.schema.metadata[b"records"]),
+                       table["source"].to_numpy(zero_copy_only=False).astype(str),
+                       table["target"].to_numpy(zero_copy_only=False).astype(str),
+                       table["score"].to_numpy().astype(float))
+        with np.load(path) as data:
+            return cls(int(data["records"]), data["sources"], data["targets"], data["scores"])
+
+
+def pair_count(counts):
+    return int((counts * (counts - 1) // 2).sum())
+
+
+def pairwise_quality(clusters, labels):
+    """Pairwise precision and recall of clusters against the labels of the same records.
+
+    A pair of records is predicted when both are in the same cluster and
+    true when both have the same label.
+    """
+    _, cluster_codes = np.unique(clusters, return_inverse=True)
+    _, label_codes = np.unique(labels, return_inverse=True)
+    predicted = pair_count(np.unique(cluster_codes, return_counts=True)[1])
+    true = pair_count(np.unique(label_codes, return_counts=True)[1])
+    both = pair_count(np.unique(cluster_codes.astype(np.int64) * (label_codes.max(initial=0) + 1) + label_codes,
+                                return_counts=True)[1])
+    return (both / predicted if predicted else None), (both / true if true else None)
+
+
+def sweep(pairs, thresholds, labels=None):
+    """Clusters of the records for each threshold, linking the pairs that score strictly above it.
+
+    Thresholds are replayed from the highest down, so each pair is merged
+    into a single union-find once, in score order, whatever the size of the
+    grid. labels maps record ids to the entity they belong to, for a
+    labelled sample of the records.
+    """
+    ids, ends = np.unique(np.concatenate([pairs.sources, pairs.targets]), return_inverse=True)
+    order = np.argsort(-pairs.scores, kind="stable")
+    sources, targets = ends[:len(pairs)][order], ends[len(pairs):][order]
+    descending = -pairs.scores[order]
+    outside = pairs.records - len(ids)
+
+    if labels:
+        sample = np.array(list(labels), dtype=str)
+        sample_labels = np.array([str(label) for label in labels.values()], dtype=str)
+        positions = np.minimum(np.searchsorted(ids, sample), max(len(ids) - 1, 0))
+        in_pairs = ids[positions] == sample if len(ids) else np.zeros(len(sample), dtype=bool)
+
+    sets = ArrayUnionFind(len(ids))
+    rows, linked = [], 0
+    for threshold in sorted(set(thresholds), reverse=True):
+        end = int(np.searchsorted(descending, -threshold, side="left"))
+        sets.union(sources[linked:end], targets[linked:end])
+        linked = end
+        roots = sets.roots()
+        sizes = np.unique(roots, return_counts=True)[1]
+        row = {"threshold": threshold, "pairs": end, "clusters": len(sizes) + outside,
+               "singletons": int((sizes == 1).sum()) + outside, "largest": int(sizes.max(initial=1))}
+        for name, smallest, largest in SIZE_BUCKETS:
+            row[name] = int(((sizes >= smallest) & (sizes <= (largest or row["largest"]))).sum())
+        if labels:
+            # Labelled records in no pair get a cluster of their own, numbered after the roots
+            clusters = np.where(in_pairs, roots[positions], len(ids) + np.arange(len(sample)))
+            row["precision"], row["recall"] = pairwise_quality(clusters, sample_labels)
+        rows.append(row)
+    return rows[::-1]
+
+
+def read_labels(path):
+    # CSV with an id and a label column: records sharing a label are the same entity
+    with open(path, newline="") as f:
+        return {row["id"]: row["label"] for row in csv.DictReader(f)}
+
+
+def grid(start, stop, step):
+    return [round(value, 6) for value in np.arange(start, stop + step / 2, step)]
+
+
+def main():
+    setup_logging()
+
+    parser = argparse.ArgumentParser(description="Cluster statistics of recorded candidate pairs over a grid "
+                                                 "of similarity thresholds.")
+    parser.add_argument("pairs", help="Candidate pairs saved by a clustering step run with --record-candidates")
+    parser.add_argument("--grid", type=float, nargs=3, default=(0.3, 0.95, 0.05), metavar=("START", "STOP", "STEP"),
+                        help="Thresholds from START to STOP by STEP (default: 0.3 0.95 0.05)")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=None,
+                        help="Thresholds to evaluate instead of the grid")
+    parser.add_argument("--labels", default=None,
+                        help="CSV of id,label for a labelled sample, to report pairwise precision and recall")
+    parser.add_argument("--output", default=None, help="Also write the results to this CSV file")
+    args = parser.parse_args()
+
+    pairs = CandidatePairs.load(args.pairs)
+    labels = read_labels(args.labels) if args.labels else None
+    rows = sweep(pairs, args.thresholds or grid(*args.grid), labels)
+    logging.info(f"{len(pairs)} candidate pairs of {pairs.records} records"
+                 + (f", {len(labels)} labelled" if labels else ""))
+
+    columns = list(rows[0]) if rows else []
+    logging.info(" ".join(f"{column:>10}" for column in columns))
+    for row in rows:
+        logging.info(" ".join(f"{'-' if value is None else round(value, 4):>10}" for value in row.values()))
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+def deal_tasks(items, size, task_count):
+    """items split into task_count tasks, largest first and dealt round-robin, so that tasks take about as long."""
+    ordered = sorted(items, key=size, reverse=True)
+    return [ordered[i::task_count] for i in range(task_count)]
@@ -0,0 +1,42 @@
+import numpy as np
+
+from resolution.clusters import ArrayUnionFind, UnionFind
+
+
+def smallest_members(size, sources, targets):
+    sets = UnionFind()
+    for item in range(size):
+        sets.add(item)
+    for a, b in zip(sources, targets):
+        sets.union(a, b)
+    smallest = np.empty(size, dtype=np.int64)
+    for group in sets.groups():
+        smallest[group] = min(group)
+    return smallest
+
+
+def test_pages_match_union_find():
+    rng = np.random.default_rng(7)
+    size = 2000
+    sources, targets = rng.integers(0, size, 1500), rng.integers(0, size, 1500)
+    sets = ArrayUnionFind(size)
+    for begin in range(0, len(sources), 100):
+        sets.union(sources[begin:begin + 100], targets[begin:begin + 100])
+    assert (sets.roots() == smallest_members(size, sources, targets)).all()
+
+
+def test_components_do_not_depend_on_edge_order():
+    size = 10_000
+    # A path linked from its far end, the worst order for hooking larger roots under smaller ones
+    sources, targets = np.arange(size - 1)[::-1], np.arange(1, size)[::-1]
+    sets = ArrayUnionFind(size)
+    sets.union(sources, targets)
+    assert (sets.roots() == 0).all()
+    assert sets.rank.max() <= np.log2(size)
+
+
+def test_empty_page():
+    sets = ArrayUnionFind(3)
+    sets.union([], [])
+    sets.union([2], [2])
+    assert sets.roots().tolist() == [0, 1, 2]
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from util.csv_utils import CsvSource, ParseCache
+
+
+def write_csv(path, rows):
+    path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+    return path
+
+
+def streamed(path, chunk_size):
+    return pd.concat(CsvSource(path, lambda frame, offset: frame, chunk_size=chunk_size).frames(),
+                     ignore_index=True)
+
+
+def full(path):
+    return next(CsvSource(path, lambda frame, offset: frame).frames())
+
+
+def test_string_after_numbers_across_chunks(tmp_path):
+    path = write_csv(tmp_path / "zip.csv", ["Name,Zip", "a,60601", "b,60602", "c,60601-1234", "d,60603"])
+
+    frame = streamed(path, 2)
+
+    pd.testing.assert_frame_equal(frame, full(path))
+    assert frame["Zip"].tolist() == ["60601", "60602", "60601-1234", "60603"]
+
+
+def test_integers_with_gap_in_a_later_chunk(tmp_path):
+    path = write_csv(tmp_path / "gap.csv", ["Name,Zip,Amount", "a,60601,1", "b,60602,2", "c,,3", "d,60603,4.5"])
+
+    frame = streamed(path, 2)
+
+    pd.testing.assert_frame_equal(frame, full(path))
+    assert frame["Zip"].map(str, na_action="ignore").tolist()[:2] == ["60601.0", "60602.0"]
+
+
+def test_column_empty_in_first_chunk(tmp_path):
+    path = write_csv(tmp_path / "empty.csv", ["Name,Note", "a,", "b,", "c,late"])
+
+    pd.testing.assert_frame_equal(streamed(path, 2), full(path))
+
+
+def test_generated_ids_follow_the_chunks(tmp_path):
+    path = write_csv(tmp_path / "ids.csv", ["Name", "a", "b", "c"])
+
+    def normalize(frame, offset):
+        frame.insert(0, "RECORD_ID", range(offset, offset + len(frame)))
+        return frame
+
+    source = CsvSource(path, normalize, chunk_size=2)
+    frame = pd.concat(source.frames(), ignore_index=True)
+
+    assert frame["RECORD_ID"].tolist() == [0, 1, 2]
+    assert source.size == 3
+
+
+def test_parse_cache_keeps_extended_namespaces(tmp_path):
+    path = write_csv(tmp_path / "Data.csv", ["id", "1", "2"])
+    raw = ParseCache(path, "Importer.v1.raw")
+    list(raw.tee([full(path)]))
+    cache = ParseCache(path, "Importer.v1")
+    list(cache.tee([full(path)]))
+    assert raw.exists() and cache.exists()
+
+    write_csv(path, ["id", "1", "2", "3"])
+    edited = ParseCache(path, "Importer.v1")
+    list(edited.tee([full(path)]))
+    assert edited.exists() and raw.exists() and not cache.exists()
@@ -0,0 +1,184 @@
+import argparse
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from factory.chicago.pipeline import STEPS, ChicagoPipeline
+from importer.memory_cypher import run
+from importer.memory_importer import MemoryGraphImporter
+from util.cli_entry import add_importer_arguments, importer_options
+
+DATA = Path(__file__).parent / "data" / "chicago"
+
+
+def build_graph(path, *args):
+    # Every Chicago step, run by the pipeline over the small files of tests/data
+    parser = argparse.ArgumentParser()
+    add_importer_arguments(parser)
+    options = importer_options(parser.parse_args(list(args)))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(path)
+        pipeline = ChicagoPipeline(STEPS, MemoryGraphImporter, "memory", str(DATA), options, force=True)
+        try:
+            assert pipeline.run()
+            return pipeline.db.graph
+        finally:
+            pipeline.close()
+
+
+@pytest.fixture(scope="module", params=[(), ("--similarity", "local", "--wcc", "local", "--louvain", "local")],
+                ids=["gds", "local"])
+def graph(request, tmp_path_factory):
+    return build_graph(tmp_path_factory.mktemp("graph"), *request.param)
+
+
+def rows(graph, query, **params):
+    return [dict(record) for record in run(graph, query, params)]
+
+
+def test_labels(graph):
+    counts = {row["label"]: row["count"] for row in rows(graph, """
+        MATCH (n) UNWIND labels(n) AS label RETURN label, count(*) AS count
+    """)}
+    assert counts == {
+        "PersonRecord": 6, "Person": 4, "RecordProcessed": 10, "Department": 4,
+        "ContractRecord": 3, "Contract": 2, "ContractType": 2, "ProcurementType": 3,
+        "Organization": 4, "OrganizationGroup": 3, "Address": 3,
+        "LicenseRecord": 2, "LicenseType": 2, "PipelineStep": 7,
+    }
+
+
+def test_people_resolve_by_full_name(graph):
+    people = rows(graph, """
+        MATCH (r:PersonRecord)-[:RECORD_RESOLVED_TO]->(p:Person)
+        RETURN p.name AS name, count(r) AS records, p.size AS size ORDER BY name
+    """)
+    assert people == [
+        {"name": "Ana Ortiz", "records": 1, "size": 1},
+        {"name": "John A Smith", "records": 3, "size": 3},
+        {"name": "Mary B Jones", "records": 1, "size": 1},
+        {"name": "Peter Quill", "records": 1, "size": 1},
+    ]
+    smith = rows(graph, "MATCH (p:Person {name: 'John A Smith'}) RETURN p.employerIds AS ids, p.titles AS titles")
+    assert sorted(smith[0]["ids"]) == [101, 102]
+    assert sorted(smith[0]["titles"]) == ["CLERK", "MANAGER", "PRESIDENT"]
+
+
+def test_people_work_for_licensed_organizations(graph):
+    links = rows(graph, """
+        MATCH (p:Person)-[r:WORKS_FOR_ORG]->(o:Organization)
+        RETURN p.name AS name, o.id AS org ORDER BY name, org
+    """)
+    assert links == [
+        {"name": "John A Smith", "org": 101},
+        {"name": "John A Smith", "org": 102},
+        {"name": "Mary B Jones", "org": 101},
+        {"name": "Peter Quill", "org": 102},
+    ]
+
+
+def test_employees_work_for_departments(graph):
+    links = rows(graph, """
+        MATCH (r:PersonRecord)-[w:WORKS_FOR_DEPARTMENT]->(d:Department)
+        RETURN r.fullName AS name, d.id AS department, w.employmentType AS type ORDER BY name
+    """)
+    assert links == [
+        {"name": "Ana Ortiz", "department": "DEPT OF FLEET MGMT", "type": "P"},
+        {"name": "John A Smith", "department": "DEPARTMENT OF LAW", "type": "F"},
+    ]
+
+
+def test_contracts_span_their_rows(graph):
+    contracts = rows(graph, """
+        MATCH (c:Contract) RETURN c.id AS id, c.name AS name, c.startDate AS start, c.endDate AS end ORDER BY id
+    """)
+    assert contracts == [
+        {"id": 500, "name": "INK + PAPER", "start": date(2019, 1, 2), "end": date(2022, 1, 2)},
+        {"id": 600, "name": "TONER", "start": date(2021, 3, 1), "end": date(2023, 3, 1)},
+    ]
+
+
+def test_contract_records_link_every_vendor_of_their_number(graph):
+    vendors = rows(graph, """
+        MATCH (n:ContractRecord)-[:HAS_VENDOR]->(o:Organization)
+        RETURN n.contractId AS contract, n.id AS record, collect(o.id) AS vendors ORDER BY record
+    """)
+    assert [(row["contract"], sorted(row["vendors"])) for row in vendors] == [
+        (500, ["V1", "V2"]), (500, ["V1", "V2"]), (600, ["V1"]),
+    ]
+    types = rows(graph, """
+        MATCH (n:ContractRecord {id: 2})-[:HAS_PROCUREMENT_TYPE]->(t) RETURN t.id AS type
+    """)
+    assert types == [{"type": "RFP"}]
+
+
+def test_organizations_merge_both_sources(graph):
+    organizations = rows(graph, """
+        MATCH (o:Organization)-[:HAS_ADDRESS]->(a:Address)
+        RETURN o.id AS id, o.name AS name, o.source AS source, a.id AS address ORDER BY name, source
+    """)
+    assert organizations == [
+        {"id": "V1", "name": "ACME LLC", "source": "CONTRACTS", "address": "1 MAIN ST"},
+        {"id": 101, "name": "ACME LLC", "source": "LICENSES", "address": "1 MAIN ST"},
+        {"id": "V2", "name": "BOLT INC", "source": "CONTRACTS", "address": "2 OAK ST"},
+        {"id": 102, "name": "BOLT INC", "source": "LICENSES", "address": "9 ELM ST"},
+    ]
+    # The license importer runs last and sets the coordinates of the shared address
+    address = rows(graph, "MATCH (a:Address {id: '1 MAIN ST'}) RETURN a.latitude AS lat, a.addressPostalCode AS zip")
+    assert address == [{"lat": 41.88, "zip": "60601"}]
+
+
+def test_organization_groups_need_name_and_address(graph):
+    groups = rows(graph, """
+        MATCH (o:Organization)-[:BELONGS_TO_ORG_GROUP]->(g:OrganizationGroup)
+        WITH g, collect(toString(o.id)) AS ids
+        RETURN g.name AS name, g.size AS size, ids ORDER BY size DESC, name
+    """)
+    assert [(group["name"], group["size"], sorted(group["ids"])) for group in groups] == [
+        ("ACME LLC", 2, ["101", "V1"]), ("BOLT INC", 1, ["V2"]), ("BOLT INC", 1, ["102"]),
+    ]
+
+
+def test_departments_match_across_sources(graph):
+    pairs = rows(graph, """
+        MATCH (a:Department)-[r:IS_SIMILAR_TO]->(b:Department) RETURN a.id AS a, b.id AS b, r.method AS method
+    """)
+    matched = {frozenset((pair["a"], pair["b"])) for pair in pairs}
+    assert matched == {
+        frozenset(("DEPARTMENT OF LAW", "DEPT OF LAW")),
+        frozenset(("DEPT OF FLEET MGMT", "DEPARTMENT OF FLEET MANAGEMENT")),
+    }
+
+
+def test_second_run_changes_nothing(tmp_path):
+    first = build_graph(tmp_path)
+    counts = first.counters.copy()
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path)
+        parser = argparse.ArgumentParser()
+        add_importer_arguments(parser)
+        pipeline = ChicagoPipeline(STEPS, MemoryGraphImporter, "memory", str(DATA),
+                                   importer_options(parser.parse_args([])))
+        pipeline.db._driver._graph = first
+        try:
+            assert pipeline.run()
+        finally:
+            pipeline.close()
+    assert {result.status for result in pipeline.results.values()} == {"skipped"}
+    assert first.counters == counts
+
+
+def test_only_refuses_steps_whose_dependencies_never_ran(tmp_path):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(tmp_path)
+        parser = argparse.ArgumentParser()
+        add_importer_arguments(parser)
+        pipeline = ChicagoPipeline(STEPS, MemoryGraphImporter, "memory", str(DATA),
+                                   importer_options(parser.parse_args([])), only=["people_cluster"])
+        try:
+            assert not pipeline.run()
+        finally:
+            pipeline.close()
+    assert {result.status for result in pipeline.results.values()} == {"not run"}
+    assert not rows(pipeline.db.graph, "MATCH (n) RETURN n")
@@ -0,0 +1,89 @@
+import pytest
+
+from importer.memory_cypher import CypherError, run
+from importer.memory_graph import ConstraintViolation, MemoryGraph
+
+
+@pytest.fixture
+def graph():
+    return MemoryGraph()
+
+
+def rows(graph, query, **params):
+    return [dict(record) for record in run(graph, query, params)]
+
+
+def test_unwind_merge_and_set(graph):
+    batch = [{"id": 1, "name": "A"}, {"id": 2, "name": "B"}, {"id": 1, "name": "C"}]
+    rows(graph, """
+        UNWIND $batch AS item
+        MERGE (n:Thing {id: item.id})
+        SET n.names = apoc.coll.toSet(coalesce(n.names, []) + [item.name])
+    """, batch=batch)
+    assert rows(graph, "MATCH (n:Thing) RETURN n.id AS id, n.names AS names ORDER BY id") == [
+        {"id": 1, "names": ["A", "C"]}, {"id": 2, "names": ["B"]},
+    ]
+
+
+def test_merge_relationship_is_idempotent(graph):
+    for _ in range(2):
+        rows(graph, """
+            MERGE (a:Thing {id: 1}) MERGE (b:Thing {id: 2})
+            MERGE (a)-[r:LINKS_TO]->(b) ON CREATE SET r.created = true
+        """)
+    assert rows(graph, "MATCH (:Thing)-[r:LINKS_TO]->(:Thing) RETURN count(r) AS count, collect(r.created) AS flags") \
+        == [{"count": 1, "flags": [True]}]
+
+
+def test_merge_on_null_property_fails(graph):
+    with pytest.raises(CypherError):
+        rows(graph, "UNWIND $batch AS item MERGE (n:Thing {id: item.id})", batch=[{"id": None}])
+
+
+def test_aggregation_and_where(graph):
+    rows(graph, "UNWIND range(1, 6) AS i CREATE (:Thing {id: i, even: i % 2 = 0})")
+    result = rows(graph, """
+        MATCH (n:Thing) WHERE n.id > 1
+        WITH n.even AS even, count(*) AS count, collect(n.id) AS ids
+        RETURN even, count, ids ORDER BY even
+    """)
+    assert result == [{"even": False, "count": 2, "ids": [3, 5]}, {"even": True, "count": 3, "ids": [2, 4, 6]}]
+
+
+def test_optional_match_case_and_reduce(graph):
+    rows(graph, "CREATE (:Thing {id: 1, values: [1, 2, 3]})")
+    result = rows(graph, """
+        MATCH (n:Thing)
+        OPTIONAL MATCH (n)-[:LINKS_TO]->(m)
+        RETURN m AS missing,
+               CASE WHEN size(n.values) > 2 THEN 'long' ELSE 'short' END AS length,
+               reduce(total = 0, value IN n.values | total + value) AS total
+    """)
+    assert result == [{"missing": None, "length": "long", "total": 6}]
+
+
+def test_constraint_violation_rolls_back_transaction(graph):
+    graph.create_constraint("Thing", "id")
+    rows(graph, "CREATE (:Thing {id: 1})")
+    with pytest.raises(ConstraintViolation):
+        with graph.transaction():
+            rows(graph, "CREATE (:Thing {id: 2})")
+            rows(graph, "CREATE (:Thing {id: 1})")
+    assert rows(graph, "MATCH (n:Thing) RETURN collect(n.id) AS ids") == [{"ids": [1]}]
+
+
+def test_fulltext_query(graph):
+    graph.create_fulltext("things", "Thing", "name")
+    rows(graph, "UNWIND ['ACME LLC', 'BOLT INC'] AS name CREATE (:Thing {name: name})")
+    result = rows(graph, """
+        CALL db.index.fulltext.queryNodes('things', 'acmee~0.65 AND llc~0.65') YIELD node, score
+        RETURN node.name AS name
+    """)
+    assert result == [{"name": "ACME LLC"}]
+
+
+def test_detach_delete(graph):
+    rows(graph, "CREATE (:Thing {id: 1})-[:LINKS_TO]->(:Thing {id: 2})")
+    rows(graph, "MATCH (n:Thing {id: 1}) DETACH DELETE n")
+    assert rows(graph, "MATCH (n) OPTIONAL MATCH (n)-[r]-() RETURN n.id AS id, count(r) AS rels") \
+        == [{"id": 2, "rels": 0}]
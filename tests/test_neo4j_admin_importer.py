@@ -0,0 +1,31 @@
+import os
+
+import pandas as pd
+
+from importer.neo4j_admin_importer import Neo4jAdminImporter
+
+
+def write_organizations(output_dir, name, rows):
+    importer = Neo4jAdminImporter()
+    importer.output_dir = str(output_dir)
+    importer.write_nodes(name, "Organization", pd.DataFrame(rows))
+    importer.close()
+    return output_dir / f"nodes.Organization.{name}.csv"
+
+
+def test_parts_merge_in_write_order(tmp_path):
+    licenses = write_organizations(tmp_path, "licenses", [{"id": "1", "names": ["ACME"]}])
+    contracts = write_organizations(tmp_path, "contracts", [{"id": "1", "names": ["ACME LLC"]}])
+    # Timestamps say nothing about the order, a copied or restored directory may reverse them
+    os.utime(licenses, (contracts.stat().st_mtime + 60,) * 2)
+    write_organizations(tmp_path, "licenses", [{"id": "1", "names": ["ACME"]}])
+    os.utime(contracts, (licenses.stat().st_mtime + 60,) * 2)
+
+    importer = Neo4jAdminImporter()
+    importer.output_dir = str(tmp_path)
+    importer.close()
+    script = (tmp_path / "import.sh").read_text(encoding="utf-8")
+    assert script.index("merged/nodes.Organization.contracts.csv") < script.index("merged/nodes.Organization.licenses.csv")
+    merged = (tmp_path / "merged" / "nodes.Organization.licenses.csv").read_text(encoding="utf-8")
+    assert "ACME LLC|ACME" in merged
+    assert "--skip-bad-relationships" not in script
@@ -2,6 +2,85 @@ import argparse
 from util.logger import setup_logging
 from util.cli_utils import run_importer, run_updater
 from importer.neo4j_importer import Neo4jBaseImporter
+from importer.neo4j_admin_importer import Neo4jAdminImporter
+from importer.memory_importer import MemoryGraphImporter
+
+BACKENDS = {
+    "neo4j": Neo4jBaseImporter,
+    "neo4j-admin": Neo4jAdminImporter,
+    "memory": MemoryGraphImporter,
+}
+
+def add_importer_arguments(parser):
+    # Runtime options shared by every importer and updater, single step or pipeline
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Stream the file in chunks of this many rows instead of loading it whole")
+    parser.add_argument("--parse-cache", action="store_true",
+                        help="Reuse a Parquet copy of the parsed file stored next to it (requires pyarrow)")
+    parser.add_argument("--keep-raw-dates", action="store_true",
+                        help="Also store the original date strings next to the parsed dates")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of parallel sessions used to store batches")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Maximum number of batches queued or running at once (default: 2 x workers)")
+    parser.add_argument("--dead-letter-file", default="dead_letters.jsonl",
+                        help="File collecting batches that failed after all retries, for replay")
+    parser.add_argument("--adaptive-batch", action="store_true",
+                        help="Grow or shrink the batch size of every query to match the target latency")
+    parser.add_argument("--target-latency", type=float, default=2.0,
+                        help="Target transaction latency in seconds for --adaptive-batch")
+    parser.add_argument("--metrics-dir", default=None,
+                        help="Directory for the JSON and CSV timing report of the run")
+    parser.add_argument("--prometheus", action="store_true",
+                        help="Also write the report in Prometheus text format")
+    parser.add_argument("--similarity", choices=["fulltext", "local"], default="fulltext",
+                        help="Find similar records with fulltext queries in the database, or with the "
+                             "blocking entity-resolution engine in this process")
+    parser.add_argument("--similarity-processes", type=int, default=None,
+                        help="Processes used by --similarity local and --louvain local (default: one per CPU)")
+    parser.add_argument("--similarity-index", default=None,
+                        help="File keeping the organization name index of --similarity local between runs, "
+                             "so that later runs only sign and query new organizations")
+    parser.add_argument("--similarity-cache", default=None,
+                        help="SQLite file keeping the similarity scores of name pairs computed in this process "
+                             "between runs")
+    parser.add_argument("--record-candidates", default=None, metavar="FILE",
+                        help="In the clustering steps, only save every candidate pair of the similarity stage "
+                             "with its score to this Parquet file, for python -m resolution.sweep")
+    parser.add_argument("--wcc", choices=["gds", "local"], default="gds",
+                        help="Compute the connected components of the clustering steps with the GDS plugin, "
+                             "or in this process from edges streamed out in pages")
+    parser.add_argument("--louvain", choices=["gds", "local"], default="gds",
+                        help="Detect the Louvain communities of people with the GDS plugin, "
+                             "or in this process from the similarity edges read once")
+    parser.add_argument("--incremental", action="store_true",
+                        help="In the clustering steps, only resolve the records that are not in a cluster yet "
+                             "and rewrite the clusters they join, instead of re-clustering the whole graph")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the stages and batches committed by a previous interrupted run")
+
+def importer_options(args):
+    return {
+        "chunk_size": args.chunk_size,
+        "parse_cache": args.parse_cache,
+        "keep_raw_dates": args.keep_raw_dates,
+        "workers": args.workers,
+        "max_in_flight": args.max_in_flight,
+        "dead_letter_file": args.dead_letter_file,
+        "adaptive_batch": args.adaptive_batch,
+        "target_latency": args.target_latency,
+        "metrics_dir": args.metrics_dir,
+        "prometheus": args.prometheus,
+        "similarity": args.similarity,
+        "similarity_processes": args.similarity_processes,
+        "similarity_index": args.similarity_index,
+        "similarity_cache": args.similarity_cache,
+        "candidates_file": args.record_candidates,
+        "incremental": args.incremental,
+        "wcc": args.wcc,
+        "louvain": args.louvain,
+        "resume": args.resume,
+    }
 
 def run_backend_importer(
     importer_factory_func,
@@ -13,7 +92,7 @@ def run_backend_importer(
     setup_logging()
 
     parser = argparse.ArgumentParser(description=description)
-    parser.add_argument("--backend", choices=["neo4j"], required=True,
+    parser.add_argument("--backend", choices=list(BACKENDS), required=True,
                         help="Which importer backend to use")
     
     # Only require --file if the importing flow needs it
@@ -24,18 +103,30 @@ def run_backend_importer(
 
     parser.add_argument("--base_path", default=default_base_path,
                         help="Base directory where the file is located")
+    parser.add_argument("--checkpoint-file", default=None,
+                        help="Checkpoint file (default: .checkpoints/<backend>/<importer>.json)")
+    parser.add_argument("--output-dir", default="bulk",
+                        help="Directory for the node and relationship files of the neo4j-admin backend")
+    parser.add_argument("--graph-file", default=None,
+                        help="File the memory backend loads its graph from and saves it to, to chain steps")
+    add_importer_arguments(parser)
 
     args = parser.parse_args()
+    if args.backend == "neo4j-admin" and not require_file:
+        parser.error("this step updates the graph in place, run it with --backend neo4j after the bulk import")
 
-    backend_map = {
-        "neo4j": Neo4jBaseImporter,
-    }
-
-    base_cls = backend_map.get(args.backend)
+    base_cls = BACKENDS.get(args.backend)
     if base_cls is None:
         raise ValueError(f"Unsupported backend: {args.backend}")
 
+    options = importer_options(args)
+    options["checkpoint_file"] = args.checkpoint_file
+    if args.backend == "neo4j-admin":
+        options["output_dir"] = args.output_dir
+    if args.backend == "memory":
+        options["graph_file"] = args.graph_file
+
     if require_file:
-        run_importer(importer_factory_func, base_cls, args.backend, args.file, base_path=args.base_path)
+        run_importer(importer_factory_func, base_cls, args.backend, args.file, base_path=args.base_path, **options)
     else:
-        run_updater(importer_factory_func, base_cls, args.backend)
+        run_updater(importer_factory_func, base_cls, args.backend, **options)
@@ -18,7 +18,17 @@ def validate_file_exists(file_path):
         logging.error(f"{file_path} doesn't exist in {file_path.parent}")
         sys.exit(1)
 
-def run_importer(importer_factory, base_cls, backend: str, file_name: str, base_path: str = "./data/"):
+def configure(importer, options):
+    # Runtime options from the command line override the importer defaults
+    for name, value in options.items():
+        setattr(importer, name, value)
+
+def checkpoint_scope(data_file):
+    # Checkpoints only apply to the exact same input file
+    stat = data_file.stat()
+    return f"{data_file.name}:{stat.st_size}:{int(stat.st_mtime)}"
+
+def run_importer(importer_factory, base_cls, backend: str, file_name: str, base_path: str = "./data/", **options):
     # Create the importer class dynamically using the backend and base class
     ImporterClass = importer_factory(base_cls, backend)
 
@@ -29,17 +39,28 @@ def run_importer(importer_factory, base_cls, backend: str, file_name: str, base_
 
     # Instantiate and run
     importer = ImporterClass()
+    configure(importer, options)
+    importer.checkpoint_scope = checkpoint_scope(data_file)
     logging.info(f"Importing {file_name} records using backend '{backend}'...")
-    importer.import_data(str(data_file))
+    try:
+        importer.import_data(str(data_file))
+    finally:
+        importer.write_metrics()
     importer.close()
 
-def run_updater(importer_factory, base_cls, backend: str):
+def run_updater(importer_factory, base_cls, backend: str, **options):
     # Create the importer class dynamically using the backend and base class
     ImporterClass = importer_factory(base_cls, backend)
 
     # Instantiate and run update logic
     updater = ImporterClass()
+    configure(updater, options)
     logging.info(f"Applying updates to the graph using backend '{backend}'...")
 
-    updater.apply_updates()
+    try:
+        updater.apply_updates()
+        # Checkpoints only help to resume an interrupted update, never to skip the next one
+        updater.checkpoints.clear()
+    finally:
+        updater.write_metrics()
     updater.close()
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+from pathlib import Path
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _widen_dtype(first, second):
+    # Type pandas infers for a column holding the values of both types
+    import numpy as np
+    import pandas as pd
+
+    if first is None or first == second:
+        return second
+    for dtype in (first, second):
+        if pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype):
+            return dtype
+    if not pd.api.types.is_bool_dtype(first) and not pd.api.types.is_bool_dtype(second):
+        return np.dtype("float64")
+    return np.dtype(object)
+
+
+class ParseCache:
+    """Parquet copy of a normalized CSV, stored next to the CSV.
+
+    The file name carries the importer namespace (name, version and read mode)
+    and the content hash of the CSV, so editing the file or bumping the importer
+    version makes the old copy unreachable.
+    """
+
+    def __init__(self, csv_path, namespace):
+        self.csv_path = Path(csv_path)
+        self.namespace = namespace
+        self._path = None
+
+    @property
+    def path(self):
+        if self._path is None:
+            digest = file_digest(self.csv_path)[:16]
+            self._path = self.csv_path.with_name(f"{self.csv_path.stem}.{self.namespace}.{digest}.parquet")
+        return self._path
+
+    def exists(self):
+        return self.path.is_file()
+
+    def read(self, chunk_size=None):
+        import pyarrow.parquet as pq
+
+        parquet = pq.ParquetFile(self.path, memory_map=True)
+        if chunk_size is None:
+            yield parquet.read().to_pandas()
+            return
+
+        for batch in parquet.iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+
+    def tee(self, frames):
+        # Frames are passed through unchanged; the cache is only published after a full pass
+        tmp_path = self.path.with_suffix(".tmp")
+        writer = None
+        try:
+            for frame in frames:
+                if writer is not False:
+                    writer = self._append(writer, tmp_path, frame)
+                yield frame
+
+            if writer:
+                writer.close()
+                writer = None
+                tmp_path.replace(self.path)
+                self._remove_stale()
+                logging.info(f"Cached parsed {self.csv_path.name} in {self.path.name}")
+        finally:
+            if writer:
+                writer.close()
+            tmp_path.unlink(missing_ok=True)
+
+    def _append(self, writer, tmp_path, frame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            if writer is None:
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(frame, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            return writer
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            logging.warning(f"Skipping parse cache for {self.csv_path.name}: {e}")
+            if writer:
+                writer.close()
+            return False
+
+    def _remove_stale(self):
+        # Anchored on the digest, so namespaces extending this one keep their copies
+        digest = "[0-9a-f]" * 16
+        for path in self.csv_path.parent.glob(f"{self.csv_path.stem}.{self.namespace}.{digest}.parquet"):
+            if path != self.path:
+                path.unlink(missing_ok=True)
+
+
+class CsvSource:
+    """Re-iterable view over a CSV file, normalized frame by frame.
+
+    Without a chunk size the whole file is parsed once and the same frame is
+    returned on every pass. With a chunk size the file is streamed on every pass
+    so that memory is bounded by the chunk, not by the file. With a parse cache
+    the normalized frames are read back from Parquet instead of the CSV.
+    """
+
+    def __init__(self, path, normalize, chunk_size=None, cache=None):
+        self.path = path
+        self.normalize = normalize
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self._frame = None
+        self._size = None
+        self._column_dtypes = None
+
+    @property
+    def size(self):
+        # Unknown for streamed sources until the first full pass is over
+        return self._size
+
+    def frames(self):
+        if self.chunk_size is None:
+            if self._frame is None:
+                self._frame = list(self._load())[0]
+                self._size = len(self._frame)
+            yield self._frame
+            return
+
+        size = 0
+        for frame in self._load():
+            yield frame
+            size += len(frame)
+        self._size = size
+
+    def _load(self):
+        if self.cache is not None and self.cache.exists():
+            logging.info(f"Reading parsed {Path(self.path).name} from {self.cache.path.name}")
+            return self.cache.read(self.chunk_size)
+
+        frames = self._parse()
+        if self.cache is not None:
+            frames = self.cache.tee(frames)
+        return frames
+
+    def _parse(self):
+        import pandas as pd
+
+        if self.chunk_size is None:
+            yield self.normalize(pd.read_csv(self.path, low_memory=False), 0)
+            return
+
+        # The offset keeps generated ids identical to the ones of a full load
+        offset = 0
+        with pd.read_csv(self.path, chunksize=self.chunk_size, dtype=self._dtypes(), low_memory=False) as reader:
+            for chunk in reader:
+                yield self.normalize(chunk, offset)
+                offset += len(chunk)
+
+    def _dtypes(self):
+        """Column types of a full load, so that chunks parse like the whole file would.
+
+        The types of every chunk are read in a first pass and widened as a
+        load of the whole file infers them: integers with a gap become floats,
+        and any chunk with a string makes the column strings. Done once per
+        source, on its first pass.
+        """
+        import pandas as pd
+
+        if self._column_dtypes is None:
+            dtypes = {}
+            with pd.read_csv(self.path, chunksize=self.chunk_size, low_memory=False) as reader:
+                for chunk in reader:
+                    for column, dtype in chunk.dtypes.items():
+                        dtypes[column] = _widen_dtype(dtypes.get(column), dtype)
+            self._column_dtypes = dtypes
+        return self._column_dtypes
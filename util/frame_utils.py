@@ -0,0 +1,130 @@
+import logging
+
+
+def column_values(series):
+    # Cast the whole column at once so numpy scalars become Python objects and NaN/NaT become None
+    values = series.astype(object)
+    return values.where(series.notna(), None).tolist()
+
+
+def iter_record_batches(frame, batch_size):
+    # batch_size may be a callable, asked again before every batch
+    columns = list(frame.columns)
+    start = 0
+    while start < len(frame):
+        size = batch_size() if callable(batch_size) else batch_size
+        chunk = frame.iloc[start:start + size]
+        values = [column_values(chunk.iloc[:, i]) for i in range(len(columns))]
+        yield [dict(zip(columns, row)) for row in zip(*values)]
+        start += size
+
+
+def skip_rows(batches, rows):
+    for batch in batches:
+        if rows >= len(batch):
+            rows -= len(batch)
+            continue
+        yield batch[rows:]
+        rows = 0
+
+
+def aggregate_sets(frames, key, columns):
+    """Group the rows of frames by key, collecting the distinct non-null values of columns.
+
+    columns maps each output column to the source column, or list of source
+    columns, whose values it collects. Values keep the order in which they are
+    first seen, like apoc.coll.toSet, and keys without values get an empty list.
+    frames may be the chunks of one file: only the distinct (key, value) pairs
+    of each chunk are kept while iterating.
+    """
+    import numpy as np
+    import pandas as pd
+
+    keys, pairs = [], {name: [] for name in columns}
+    for frame in frames:
+        frame = frame[frame[key].notna()]
+        keys.append(frame[key].drop_duplicates())
+        for name, sources in columns.items():
+            sources = [sources] if isinstance(sources, str) else list(sources)
+            # Row-major, so the values of one row stay next to each other as in the per-row merge
+            values = frame[sources].to_numpy(dtype=object).ravel()
+            long = pd.DataFrame({key: np.repeat(frame[key].to_numpy(dtype=object), len(sources)), name: values})
+            pairs[name].append(long[long[name].notna()].drop_duplicates())
+
+    if not keys:
+        return pd.DataFrame(columns=[key, *columns])
+    result = pd.DataFrame({key: pd.concat(keys).drop_duplicates().to_numpy(dtype=object)})
+    for name, parts in pairs.items():
+        long = pd.concat(parts).drop_duplicates()
+        grouped = long.groupby(key, sort=False)[name].agg(list)
+        result[name] = [value if isinstance(value, list) else [] for value in grouped.reindex(result[key])]
+    return result
+
+
+def parse_dates(frame, columns, date_format="%m/%d/%Y", keep_raw=False):
+    """Parse date columns in place into datetime.date values, stored as native Neo4j dates.
+
+    Empty and unparsable values become None. With keep_raw, the original
+    strings are kept in a "<column> RAW" column.
+    """
+    import pandas as pd
+
+    for column in columns:
+        if column not in frame:
+            continue
+        raw = frame[column]
+        parsed = pd.to_datetime(raw, format=date_format, errors="coerce")
+        invalid = int((parsed.isna() & raw.notna()).sum())
+        if invalid:
+            logging.warning(f"{invalid} values of '{column}' don't match {date_format}, stored as null")
+        if keep_raw:
+            frame[f"{column} RAW"] = raw
+        frame[column] = parsed.dt.date.astype(object).where(parsed.notna(), None)
+    return frame
+
+
+def count_missing(frames, column):
+    # Rows whose column is null, which queries matching on it leave out
+    return sum(int(frame[column].isna().sum()) for frame in frames)
+
+
+def distinct_rows(frames, key, columns=(), default=None):
+    """Distinct values of key across frames, with the last value seen of columns for each.
+
+    Null keys are replaced by default, or dropped when there is no default.
+    Used to build the small dimension tables created before the fact rows.
+    """
+    import pandas as pd
+
+    parts = []
+    for frame in frames:
+        part = frame[[key, *columns]]
+        part = part.dropna(subset=[key]) if default is None else part.fillna({key: default})
+        parts.append(part.drop_duplicates(key, keep="last"))
+    if not parts:
+        return pd.DataFrame(columns=[key, *columns])
+    return pd.concat(parts).drop_duplicates(key, keep="last").reset_index(drop=True)
+
+
+def full_names(first, middle, last):
+    """Vectorized form of the fullName expression of the person importers.
+
+    The parts are joined, whitespace is collapsed and every word capitalized;
+    names with no parts at all become None.
+    """
+    joined = first.fillna("").astype(str) + " " + middle.fillna("").astype(str) + " " + last.fillna("").astype(str)
+    joined = joined.str.replace(r"\s+", " ", regex=True).str.strip()
+    names = joined.str.lower().str.split(" ").map(lambda words: " ".join(w[:1].upper() + w[1:] for w in words))
+    return names.where(joined != "", None)
+
+
+def display_name(values):
+    # Shortest name of the list, first letter capitalized, as set on Organization.name
+    if not values:
+        return None
+    shortest = min(values, key=len)
+    return (shortest[:1].upper() + shortest[1:]).strip()
+
+
+def display_names(names):
+    return names.map(display_name)